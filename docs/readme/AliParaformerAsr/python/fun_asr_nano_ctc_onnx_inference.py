@@ -2,15 +2,17 @@ import os
 import sys
 import logging
 import time
+import queue
+import threading
 import traceback
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
-import torch
-import onnx
 import onnxruntime as ort
 
+from fun_asr_nano_frontend import WavFrontend, load_audio
+
 # ===================== 配置项（统一管理路径和参数） =====================
 # 基础配置 - 可根据实际环境修改
 CONFIG = {
@@ -18,19 +20,53 @@ CONFIG = {
     "onnx_model_dir": "/to/path/Fun-ASR-Nano-2512/onnx",
     "audio_test_path": "/to/path/Fun-ASR-Nano-2512/example/zh.mp3", 
     "blank_id_default": 60514,
-    "target_seq_len": 0,  # 大于0时限制解码时长(512≈30秒)
+    "target_seq_len": 0,  # 大于0时限制解码时长(512≈30秒)，未配置分桶时作为单一分桶使用
+    "seq_len_buckets": [],  # 解码器静态形状分桶(如 [128, 256, 512])，输入补齐到能容纳它的最小分桶
+    "bucket_warmup_runs": 1,  # 每个分桶的预热次数（复用ONNX Runtime内存模式）
     "warmup_runs": 3,
     "benchmark_runs": 5,
     "intra_op_num_threads": 1,  # 根据CPU核心数调整
     "inter_op_num_threads": 1,  # 根据任务并行度调整
+    "pipeline_feature_workers": 2,  # 流水线：音频加载+特征提取线程数
+    "pipeline_encoder_workers": 1,  # 流水线：编码器线程数（每个线程再使用intra_op_num_threads）
+    "pipeline_decoder_workers": 1,  # 流水线：解码器+CTC解码线程数
+    "pipeline_queue_size": 2,  # 流水线：相邻阶段间队列容量
     "audio_sample_rate": 16000,  # 音频采样率
-    "device_type": "CUDA" if torch.cuda.is_available() else "CPU",
+    "device_type": "CUDA" if "CUDAExecutionProvider" in ort.get_available_providers() else "CPU",
+    "verify_parity": False,  # 是否与funasr前端/whisper分词器做一致性校验（需安装funasr）
 }
 
 
 # ===================== Tokenizer 注册 =====================
+class TiktokenDecoder:
+    """
+    基于 multilingual.tiktoken 词表的轻量解码器
+
+    只负责把token id还原为文本，不依赖 tiktoken/whisper；词表之外的特殊token直接跳过。
+    """
+
+    def __init__(self, vocab_path: str):
+        import base64
+
+        if not os.path.exists(vocab_path):
+            raise FileNotFoundError(f"指定的vocab文件不存在：{vocab_path}")
+
+        self.id2bytes = {}
+        with open(vocab_path, "rb") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2:
+                    continue
+                self.id2bytes[int(parts[1])] = base64.b64decode(parts[0])
+
+    def decode(self, token_ids) -> str:
+        """将token id序列解码为文本（字节拼接后统一按UTF-8解码，多字节字符跨token也能正确还原）"""
+        data = b"".join(self.id2bytes.get(int(t), b"") for t in token_ids)
+        return data.decode("utf-8", errors="replace")
+
+
 def SenseVoiceTokenizer(**kwargs):
-    """SenseVoice分词器"""
+    """SenseVoice分词器（仅用于一致性校验，需安装funasr）"""
     try:
         from funasr.models.sense_voice.whisper_lib.tokenizer import get_tokenizer
     except ImportError:
@@ -57,6 +93,9 @@ def SenseVoiceTokenizer(**kwargs):
 
 
 # ===================== CTC推理器 =====================
+_PIPELINE_END = object()  # 流水线结束标记
+
+
 class CTCInference:
     """CTC模型推理器（仅加载和推理ONNX模型）"""
 
@@ -65,7 +104,8 @@ class CTCInference:
             encoder_onnx_path: str,
             decoder_onnx_path: str,
             blank_id: int = CONFIG["blank_id_default"],
-            target_seq_len: int = CONFIG["target_seq_len"]
+            target_seq_len: int = CONFIG["target_seq_len"],
+            seq_len_buckets: Optional[List[int]] = None
     ):
         """
         初始化推理器
@@ -74,13 +114,23 @@ class CTCInference:
             encoder_onnx_path: 编码器ONNX路径
             decoder_onnx_path: 解码器ONNX路径
             blank_id: 空白标记ID
-            target_seq_len: 目标序列长度
+            target_seq_len: 目标序列长度（未配置分桶时作为单一分桶）
+            seq_len_buckets: 解码器输入长度分桶，默认取 CONFIG["seq_len_buckets"]
         """
         self.encoder_onnx_path = encoder_onnx_path
         self.decoder_onnx_path = decoder_onnx_path
         self.blank_id = blank_id
         self.target_seq_len = target_seq_len
 
+        # 静态形状分桶：为空时解码器直接使用编码器的动态长度输出
+        if seq_len_buckets is None:
+            seq_len_buckets = CONFIG["seq_len_buckets"]
+        if not seq_len_buckets and target_seq_len > 0:
+            seq_len_buckets = [target_seq_len]
+        self.seq_len_buckets = sorted(set(int(b) for b in seq_len_buckets if int(b) > 0))
+        self.bucket_latency = {bucket: [] for bucket in self.seq_len_buckets}
+        self._warmed_buckets = set()
+
         # 性能统计
         self.inference_stats = {
             "audio_load_time": 0,
@@ -104,6 +154,12 @@ class CTCInference:
         # 初始化音频前端处理
         self.frontend = self._init_frontend()
 
+        # 预热各分桶（解码器特征维度为静态时）
+        feat_dim = self._get_decoder_feat_dim()
+        if feat_dim is not None:
+            for bucket in self.seq_len_buckets:
+                self._warmup_bucket(bucket, feat_dim)
+
     def _load_onnx_model(self, model_path: str, model_type: str = "模型"):
         """加载ONNX模型"""
         if not os.path.exists(model_path):
@@ -140,8 +196,6 @@ class CTCInference:
     def _init_frontend(self):
         """初始化音频前端处理"""
         try:
-            from funasr.register import tables
-
             frontend_conf = {
                 "fs": self.audio_sample_rate,
                 "window": "hamming",
@@ -151,29 +205,114 @@ class CTCInference:
                 "lfr_m": 7,
                 "lfr_n": 6,
                 "dither": 0,
-                "snip_edges": True,
-                "cmvn_file": None
+                "snip_edges": True
             }
 
-            frontend_class = tables.frontend_classes.get("wav_frontend")
-            frontend = frontend_class(**frontend_conf)
+            frontend = WavFrontend(**frontend_conf)
             return frontend
         except Exception as e:
             logging.warning(f"初始化音频前端失败: {e}")
             return None
 
-    def _pad_or_truncate_encoder_output(self, encoder_out_np: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        """调整编码器输出长度到目标长度"""
-        batch_size, seq_len, feat_dim = encoder_out_np.shape
-
-        padded_encoder_out = np.zeros((batch_size, self.target_seq_len, feat_dim), dtype=np.float32)
-        valid_len = min(seq_len, self.target_seq_len)
-        padded_encoder_lens = np.array([valid_len] * batch_size, dtype=np.int64)
+    def _get_decoder_feat_dim(self) -> Optional[int]:
+        """获取解码器输入的特征维度（动态维度时返回None）"""
+        if self.decoder_session is None:
+            return None
+        feat_dim = self.decoder_session.get_inputs()[0].shape[-1]
+        return feat_dim if isinstance(feat_dim, int) else None
+
+    def _select_bucket(self, seq_len: int) -> int:
+        """选择能容纳该长度的最小分桶，超过最大分桶时返回最大分桶"""
+        for bucket in self.seq_len_buckets:
+            if seq_len <= bucket:
+                return bucket
+        return self.seq_len_buckets[-1]
+
+    def _warmup_bucket(self, bucket: int, feat_dim: int):
+        """按分桶形状预热解码器，使ONNX Runtime为该形状建立并复用内存模式"""
+        if bucket in self._warmed_buckets:
+            return
+        dummy_out = np.zeros((1, bucket, feat_dim), dtype=np.float32)
+        dummy_lens = np.array([bucket], dtype=np.int64)
+        for _ in range(max(1, CONFIG["bucket_warmup_runs"])):
+            try:
+                self.decoder_session.run(None, {"encoder_out": dummy_out, "encoder_out_lens": dummy_lens})
+            except Exception as e:
+                logging.warning(f"分桶{bucket}预热出错: {e}")
+                break
+        self._warmed_buckets.add(bucket)
+        logging.info(f"解码器分桶预热完成: {bucket}")
+
+    def _pad_to_bucket(self, encoder_out_np: np.ndarray, valid_len: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """将编码器输出补齐到最小可容纳分桶（valid_len 不得超过最大分桶）"""
+        batch_size, _, feat_dim = encoder_out_np.shape
+        bucket = self._select_bucket(valid_len)
+
+        padded_encoder_out = np.zeros((batch_size, bucket, feat_dim), dtype=np.float32)
         padded_encoder_out[:, :valid_len, :] = encoder_out_np[:, :valid_len, :]
+        padded_encoder_lens = np.array([valid_len] * batch_size, dtype=np.int64)
+
+        return padded_encoder_out, padded_encoder_lens, bucket
 
-        logging.info(f"编码器输出长度调整: {seq_len} -> {valid_len} (目标长度: {self.target_seq_len})")
+    def _run_decoder(self, encoder_out_np: np.ndarray, encoder_out_lens_np: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        运行解码器
 
-        return padded_encoder_out, padded_encoder_lens
+        未配置分桶时直接使用动态形状；配置分桶时按最小可容纳分桶补齐，
+        超过最大分桶的输入按最大分桶切分后逐段解码并拼接，不做截断。
+        """
+        if not self.seq_len_buckets:
+            decoder_inputs = {"encoder_out": encoder_out_np, "encoder_out_lens": encoder_out_lens_np}
+            decoder_outputs = self.decoder_session.run(None, decoder_inputs)
+            return decoder_outputs[0], decoder_outputs[1]
+
+        seq_len = int(min(np.max(encoder_out_lens_np), encoder_out_np.shape[1]))
+        max_bucket = self.seq_len_buckets[-1]
+        logits_chunks = []
+        total_len = 0
+
+        for start in range(0, max(seq_len, 1), max_bucket):
+            valid_len = max(min(max_bucket, seq_len - start), 1)
+            chunk = encoder_out_np[:, start:start + valid_len, :]
+            padded_out, padded_lens, bucket = self._pad_to_bucket(chunk, chunk.shape[1])
+            if bucket not in self._warmed_buckets:
+                self._warmup_bucket(bucket, padded_out.shape[-1])
+
+            dec_start = time.time()
+            decoder_outputs = self.decoder_session.run(
+                None, {"encoder_out": padded_out, "encoder_out_lens": padded_lens})
+            self.bucket_latency[bucket].append(time.time() - dec_start)
+
+            chunk_len = int(min(decoder_outputs[1][0], chunk.shape[1]))
+            logits_chunks.append(decoder_outputs[0][:, :chunk_len, :])
+            total_len += chunk_len
+
+        if len(logits_chunks) > 1:
+            logging.info(f"编码器输出长度 {seq_len} 超过最大分桶 {max_bucket}，切分为 {len(logits_chunks)} 段解码")
+
+        ctc_logits = np.concatenate(logits_chunks, axis=1)
+        output_lengths = np.array([total_len] * ctc_logits.shape[0], dtype=np.int64)
+        return ctc_logits, output_lengths
+
+    def benchmark_buckets(self, runs: int = CONFIG["benchmark_runs"]) -> Dict[int, float]:
+        """基准测试每个分桶的解码器平均耗时（秒）"""
+        feat_dim = self._get_decoder_feat_dim()
+        if feat_dim is None or not self.seq_len_buckets:
+            return {}
+
+        results = {}
+        for bucket in self.seq_len_buckets:
+            self._warmup_bucket(bucket, feat_dim)
+            dummy_out = np.zeros((1, bucket, feat_dim), dtype=np.float32)
+            dummy_lens = np.array([bucket], dtype=np.int64)
+            times = []
+            for _ in range(runs):
+                start = time.time()
+                self.decoder_session.run(None, {"encoder_out": dummy_out, "encoder_out_lens": dummy_lens})
+                times.append(time.time() - start)
+            results[bucket] = float(np.mean(times))
+            logging.info(f"分桶 {bucket}: 平均解码器耗时 {results[bucket] * 1000:.2f}ms")
+        return results
 
     def calculate_rtf(self, infer_time: float, audio_duration: float) -> float:
         """计算实时因子（Real-Time Factor）"""
@@ -184,30 +323,25 @@ class CTCInference:
         logging.info(f"RTF计算: 推理耗时={infer_time:.3f}s, 音频时长={audio_duration:.3f}s, RTF={rtf:.4f}")
         return rtf
 
+    def _extract_features(self, audio_path: str) -> Tuple[np.ndarray, np.ndarray, float, float, float]:
+        """加载音频并提取特征，返回 (特征, 特征长度, 音频时长, 加载耗时, 特征提取耗时)"""
+        # 加载音频
+        load_start = time.time()
+        data_src = load_audio(audio_path, sample_rate=self.audio_sample_rate)
+        audio_duration = len(data_src) / self.audio_sample_rate
+        load_time = time.time() - load_start
+
+        # 提取声学特征
+        feat_start = time.time()
+        speech_np, speech_lengths_np = self.frontend.extract_fbank(data_src)
+        feat_time = time.time() - feat_start
+
+        return speech_np, speech_lengths_np, audio_duration, load_time, feat_time
+
     def _load_and_process_audio(self, audio_path: str) -> Tuple[np.ndarray, np.ndarray, float]:
         """加载并处理音频文件，提取特征"""
         try:
-            from funasr.utils.load_utils import load_audio_text_image_video, extract_fbank
-
-            # 加载音频
-            load_start = time.time()
-            data_src = load_audio_text_image_video(audio_path, fs=self.audio_sample_rate)
-            audio_duration = len(data_src) / self.audio_sample_rate
-            load_time = time.time() - load_start
-
-            # 提取声学特征
-            feat_start = time.time()
-            speech, speech_lengths = extract_fbank(
-                data_src,
-                data_type="sound",
-                frontend=self.frontend,
-                is_final=True,
-            )
-            feat_time = time.time() - feat_start
-
-            # 转换为numpy数组
-            speech_np = speech.cpu().numpy().astype(np.float32)
-            speech_lengths_np = speech_lengths.cpu().numpy().astype(np.int64)
+            speech_np, speech_lengths_np, audio_duration, load_time, feat_time = self._extract_features(audio_path)
 
             # 更新统计信息
             self.inference_stats["audio_load_time"] = load_time
@@ -303,19 +437,18 @@ class CTCInference:
                         encoder_inputs = {"speech": speech_np, "speech_lengths": speech_lengths_np}
                         encoder_outputs = self.encoder_session.run(None, encoder_inputs)
                         encoder_out_np = encoder_outputs[0]
-                        encoder_out_lens_np=encoder_outputs[1]
+                        encoder_out_lens_np = encoder_outputs[1]
 
-                        # 调整长度
-                        if self.target_seq_len>0:
-                            encoder_out_np, encoder_out_lens_np = self._pad_or_truncate_encoder_output(encoder_out_np)
-
-                        # 解码器推理
-                        decoder_inputs = {"encoder_out": encoder_out_np, "encoder_out_lens": encoder_out_lens_np}
-                        self.decoder_session.run(None, decoder_inputs)
+                        # 解码器推理（按分桶补齐）
+                        self._run_decoder(encoder_out_np, encoder_out_lens_np)
                     except Exception as e:
                         logging.warning(f"预热运行出错: {e}")
                 logging.info("预热完成")
 
+            # 分桶耗时只统计基准测试阶段
+            for bucket in self.bucket_latency:
+                self.bucket_latency[bucket].clear()
+
             # 3. 基准测试
             infer_times = []
             encoder_times = []
@@ -336,16 +469,9 @@ class CTCInference:
                 enc_time = time.time() - enc_start
                 encoder_times.append(enc_time)
 
-                # 调整编码器输出长度
-                if self.target_seq_len>0:
-                    encoder_out_np, encoder_out_lens_np = self._pad_or_truncate_encoder_output(encoder_out_np)
-
-                # 解码器推理
+                # 解码器推理（按分桶补齐，超长输入切分）
                 dec_start = time.time()
-                decoder_inputs = {"encoder_out": encoder_out_np, "encoder_out_lens": encoder_out_lens_np}
-                decoder_outputs = self.decoder_session.run(None, decoder_inputs)
-                ctc_logits = decoder_outputs[0]
-                output_lengths = decoder_outputs[1]
+                ctc_logits, output_lengths = self._run_decoder(encoder_out_np, encoder_out_lens_np)
                 dec_time = time.time() - dec_start
                 decoder_times.append(dec_time)
 
@@ -402,6 +528,8 @@ class CTCInference:
                 "batch_size": speech_np.shape[0],
                 "benchmark_runs": benchmark_runs,
                 "infer_time_std": np.std(infer_times),
+                "bucket_latency": {bucket: float(np.mean(times))
+                                   for bucket, times in self.bucket_latency.items() if times},
 
                 # 系统配置
                 "device_type": self.device_type,
@@ -414,23 +542,223 @@ class CTCInference:
             logging.error(traceback.format_exc())
             return {"error": str(e), "audio_path": audio_path}
 
+    def _start_pipeline_stage(
+            self,
+            stage_name: str,
+            stage_func,
+            in_queue: queue.Queue,
+            out_queue: queue.Queue,
+            num_workers: int,
+            stage_time: Dict[str, float],
+            stats_lock: threading.Lock
+    ) -> List[threading.Thread]:
+        """
+        启动一个流水线阶段（独立线程池）
+
+        每个工作线程从 in_queue 取任务、处理后放入 out_queue；单条任务出错时记录错误并继续传递，
+        不影响其他任务。收到结束标记后放回给同阶段其他线程，最后一个退出的线程向下游传递结束标记。
+        """
+        remaining = [num_workers]
+
+        def worker():
+            while True:
+                item = in_queue.get()
+                if item is _PIPELINE_END:
+                    in_queue.put(_PIPELINE_END)
+                    with stats_lock:
+                        remaining[0] -= 1
+                        is_last = remaining[0] == 0
+                    if is_last:
+                        out_queue.put(_PIPELINE_END)
+                    return
+
+                if "error" not in item:
+                    start = time.time()
+                    try:
+                        stage_func(item)
+                    except Exception as e:
+                        logging.error(f"流水线{stage_name}阶段失败 ({item['audio_path']}): {e}")
+                        item["error"] = str(e)
+                    with stats_lock:
+                        stage_time[stage_name] += time.time() - start
+                out_queue.put(item)
+
+        threads = [threading.Thread(target=worker, name=f"ctc-{stage_name}-{i}", daemon=True)
+                   for i in range(max(1, num_workers))]
+        remaining[0] = len(threads)
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def inference_pipelined(self, audio_paths: List[str], tokenizer=None) -> Dict:
+        """
+        流水线批量推理
+
+        音频加载+特征提取、编码器、解码器+CTC解码分别运行在独立线程池上，阶段之间通过有界队列衔接：
+        第N条在解码时，第N+1条在编码、第N+2条在提取特征，混合长度的请求也能让各核心保持忙碌。
+
+        Args:
+            audio_paths: 音频文件路径列表
+            tokenizer: 分词器（可选）
+
+        Returns:
+            推理结果字典（逐条结果按输入顺序排列，并包含整体吞吐统计）
+        """
+        if self.encoder_session is None or self.decoder_session is None:
+            return {"error": "编码器或解码器未加载"}
+
+        stage_time = {"feature": 0.0, "encoder": 0.0, "decoder": 0.0}
+        stats_lock = threading.Lock()
+
+        def feature_stage(item):
+            speech_np, speech_lengths_np, audio_duration, load_time, feat_time = \
+                self._extract_features(item["audio_path"])
+            item.update({
+                "speech": speech_np,
+                "speech_lengths": speech_lengths_np,
+                "audio_duration": audio_duration,
+                "audio_load_time": load_time,
+                "feature_extract_time": feat_time
+            })
+
+        def encoder_stage(item):
+            enc_start = time.time()
+            encoder_inputs = {"speech": item.pop("speech"), "speech_lengths": item.pop("speech_lengths")}
+            encoder_outputs = self.encoder_session.run(None, encoder_inputs)
+            item["encoder_out"], item["encoder_out_lens"] = encoder_outputs[0], encoder_outputs[1]
+            item["encoder_time"] = time.time() - enc_start
+
+        def decoder_stage(item):
+            dec_start = time.time()
+            ctc_logits, output_lengths = self._run_decoder(item.pop("encoder_out"), item.pop("encoder_out_lens"))
+            item["decoder_time"] = time.time() - dec_start
+            decode_start = time.time()
+            item["predictions"] = self._decode_ctc_logits(ctc_logits, output_lengths, tokenizer)
+            item["decode_time"] = time.time() - decode_start
+
+        queue_size = max(1, CONFIG["pipeline_queue_size"])
+        path_queue = queue.Queue(maxsize=queue_size)
+        feature_queue = queue.Queue(maxsize=queue_size)
+        encoder_queue = queue.Queue(maxsize=queue_size)
+        result_queue = queue.Queue()  # 结果队列不限容量，避免主线程投递任务时阻塞整条流水线
+
+        pipeline_start = time.time()
+        threads = []
+        threads += self._start_pipeline_stage("feature", feature_stage, path_queue, feature_queue,
+                                              CONFIG["pipeline_feature_workers"], stage_time, stats_lock)
+        threads += self._start_pipeline_stage("encoder", encoder_stage, feature_queue, encoder_queue,
+                                              CONFIG["pipeline_encoder_workers"], stage_time, stats_lock)
+        threads += self._start_pipeline_stage("decoder", decoder_stage, encoder_queue, result_queue,
+                                              CONFIG["pipeline_decoder_workers"], stage_time, stats_lock)
+
+        for index, audio_path in enumerate(audio_paths):
+            path_queue.put({"index": index, "audio_path": audio_path})
+        path_queue.put(_PIPELINE_END)
+
+        results = [None] * len(audio_paths)
+        while True:
+            item = result_queue.get()
+            if item is _PIPELINE_END:
+                break
+            results[item.pop("index")] = item
+        for thread in threads:
+            thread.join()
+        wall_time = time.time() - pipeline_start
+
+        total_audio_duration = sum(r.get("audio_duration", 0.0) for r in results)
+        num_success = sum(1 for r in results if "error" not in r)
+        logging.info(f"流水线推理完成: {num_success}/{len(results)} 条成功, 总耗时={wall_time:.3f}s, "
+                     f"音频总时长={total_audio_duration:.2f}s")
+
+        return {
+            "results": results,
+            "num_utterances": len(results),
+            "num_success": num_success,
+            "wall_time": wall_time,
+            "total_audio_duration": total_audio_duration,
+            "rtf": self.calculate_rtf(wall_time, total_audio_duration),
+            "stage_busy_time": stage_time,
+
+            # 系统配置
+            "device_type": self.device_type,
+            "intra_op_num_threads": self.intra_op_num_threads,
+            "inter_op_num_threads": self.inter_op_num_threads,
+            "pipeline_workers": {
+                "feature": CONFIG["pipeline_feature_workers"],
+                "encoder": CONFIG["pipeline_encoder_workers"],
+                "decoder": CONFIG["pipeline_decoder_workers"]
+            }
+        }
+
 
 # ===================== 工具函数 =====================
 def get_tokenizer(tokenizer_dir: str) -> Optional[object]:
     """获取tokenizer（用于推理）"""
     try:
         vocab_path = os.path.join(tokenizer_dir, "multilingual.tiktoken")
-        tokenizer = SenseVoiceTokenizer(
-            language="en",
-            task="transcribe",
-            vocab_path=vocab_path
-        )
+        tokenizer = TiktokenDecoder(vocab_path)
         return tokenizer
     except Exception as e:
         logging.warning(f"获取tokenizer失败: {e}")
         return None
 
 
+def verify_parity(audio_path: str, tokenizer_dir: str, num_token_checks: int = 2000) -> Dict:
+    """
+    一致性校验：对比 NumPy 前端与 funasr wav_frontend 的特征，以及轻量解码器与 whisper 分词器的解码结果
+
+    Args:
+        audio_path: 测试音频路径
+        tokenizer_dir: multilingual.tiktoken 所在目录
+        num_token_checks: 参与对比的token id数量
+
+    Returns:
+        校验结果字典
+    """
+    import torch
+    from funasr.register import tables
+
+    sample_rate = CONFIG["audio_sample_rate"]
+    frontend_conf = {
+        "fs": sample_rate,
+        "window": "hamming",
+        "n_mels": 80,
+        "frame_length": 25,
+        "frame_shift": 10,
+        "lfr_m": 7,
+        "lfr_n": 6,
+        "dither": 0,
+        "snip_edges": True,
+    }
+    waveform = load_audio(audio_path, sample_rate=sample_rate)
+
+    # 特征一致性（同一波形分别送入两个前端）
+    funasr_frontend = tables.frontend_classes.get("wav_frontend")(cmvn_file=None, **frontend_conf)
+    ref_feats, _ = funasr_frontend(torch.from_numpy(waveform)[None, :], torch.tensor([len(waveform)]))
+    ref_feats = ref_feats.cpu().numpy()
+    feats, _ = WavFrontend(**frontend_conf).extract_fbank(waveform)
+    shape_match = ref_feats.shape == feats.shape
+    fbank_max_diff = float(np.max(np.abs(ref_feats - feats))) if shape_match else float("inf")
+
+    # 解码一致性（逐段对比词表内的token id）
+    vocab_path = os.path.join(tokenizer_dir, "multilingual.tiktoken")
+    ref_tokenizer = SenseVoiceTokenizer(language="en", task="transcribe", vocab_path=vocab_path)
+    tokenizer = TiktokenDecoder(vocab_path)
+    token_ids = sorted(tokenizer.id2bytes)[:num_token_checks]
+    mismatches = [
+        token_ids[i:i + 20] for i in range(0, len(token_ids), 20)
+        if ref_tokenizer.decode(token_ids[i:i + 20]) != tokenizer.decode(token_ids[i:i + 20])
+    ]
+
+    result = {
+        "feature_shape_match": shape_match,
+        "fbank_max_abs_diff": fbank_max_diff,
+        "tokenizer_mismatches": len(mismatches),
+    }
+    logging.info(f"一致性校验结果: {result}")
+    return result
+
+
 # ===================== 主函数 =====================
 def main():
     """主函数：加载ONNX模型并进行推理测试"""
@@ -464,6 +792,10 @@ def main():
         print(f"\n❌ 错误：音频文件不存在，请检查路径: {CONFIG['audio_test_path']}")
         return
 
+    # 可选：与funasr前端/whisper分词器的一致性校验
+    if CONFIG["verify_parity"]:
+        verify_parity(CONFIG["audio_test_path"], CONFIG["tokenizer_dir"])
+
     # 4. FP32 ONNX模型推理测试
     print("\n" + "=" * 50)
     print("FP32 ONNX模型推理测试")
@@ -494,9 +826,30 @@ def main():
         print(f"  ⏱️  推理耗时: {results_original['inference_time']:.3f}s (±{results_original['infer_time_std']:.3f})")
         print(f"  🚀  RTF: {results_original['rtf']:.4f}")
         print(f"  📝  解码结果: {results_original['predictions'][0]['text']}")
+
+        # 各分桶解码器耗时
+        bucket_latency = inference_original.benchmark_buckets(CONFIG["benchmark_runs"])
+        if bucket_latency:
+            print(f"  🪣  分桶解码器耗时:")
+            for bucket, latency in bucket_latency.items():
+                print(f"      {bucket:>5}帧: {latency * 1000:.2f}ms")
     else:
         print(f"\n❌ FP32 ONNX模型推理失败: {results_original['error']}")
 
+    # 流水线批量推理测试（同一音频重复多次模拟并发请求）
+    pipeline_results = inference_original.inference_pipelined(
+        audio_paths=[CONFIG["audio_test_path"]] * CONFIG["benchmark_runs"],
+        tokenizer=tokenizer
+    )
+    if "error" not in pipeline_results:
+        print(f"\n📊 FP32 流水线批量推理:")
+        print(f"  🧵  阶段线程: {pipeline_results['pipeline_workers']}")
+        print(f"  ⏱️  总耗时: {pipeline_results['wall_time']:.3f}s "
+              f"({pipeline_results['num_success']}/{pipeline_results['num_utterances']} 条成功)")
+        print(f"  🚀  RTF: {pipeline_results['rtf']:.4f}")
+    else:
+        print(f"\n❌ 流水线批量推理失败: {pipeline_results['error']}")
+
     # 5. 量化模型推理测试（如果存在）
     if os.path.exists(encoder_int8_path) and os.path.exists(decoder_int8_path):
         print("\n" + "=" * 50)
@@ -0,0 +1,156 @@
+"""
+Fun-ASR-Nano 音频前端（NumPy实现，无需funasr/torch）
+
+fun_asr_nano_ctc_onnx_inference.py 与 fun_asr_nano_llm_onnx_inference.py 共用，
+使用时与推理脚本放在同一目录下。
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+def load_audio(audio_path: str, sample_rate: int = 16000) -> np.ndarray:
+    """加载音频为单声道float32波形（取值[-1, 1]），采样率不一致时重采样"""
+    import soundfile as sf
+
+    try:
+        waveform, sr = sf.read(audio_path, dtype="float32", always_2d=True)
+        waveform = waveform.mean(axis=1)
+    except Exception:
+        # soundfile 无法解码的格式（如部分mp3）交给 librosa
+        import librosa
+        waveform, sr = librosa.load(audio_path, sr=None, mono=True)
+
+    if sr != sample_rate:
+        import librosa
+        waveform = librosa.resample(waveform, orig_sr=sr, target_sr=sample_rate)
+    return np.ascontiguousarray(waveform, dtype=np.float32)
+
+
+class WavFrontend:
+    """
+    Kaldi fbank + LFR 音频前端（NumPy实现）
+
+    计算流程与 funasr 的 wav_frontend 一致：放大到int16量级 -> 分帧 -> 抖动 -> 去直流 -> 预加重
+    -> 加窗 -> 补零rFFT -> 功率谱 -> mel滤波 -> 取对数 -> LFR拼帧。
+    窗函数和mel滤波器组只在初始化时计算一次，分帧与LFR拼帧均基于步长视图整体向量化计算。
+    """
+
+    def __init__(
+            self,
+            fs: int = 16000,
+            window: str = "hamming",
+            n_mels: int = 80,
+            frame_length: int = 25,
+            frame_shift: int = 10,
+            lfr_m: int = 1,
+            lfr_n: int = 1,
+            dither: float = 0.0,
+            snip_edges: bool = True,
+            preemphasis: float = 0.97,
+            low_freq: float = 20.0,
+            high_freq: float = 0.0
+    ):
+        if not snip_edges:
+            raise ValueError("WavFrontend 仅支持 snip_edges=True")
+        self.fs = fs
+        self.n_mels = n_mels
+        self.lfr_m = lfr_m
+        self.lfr_n = lfr_n
+        self.dither = dither
+        self.preemphasis = preemphasis
+        self.window_size = int(fs * frame_length * 0.001)
+        self.window_shift = int(fs * frame_shift * 0.001)
+        self.padded_window_size = 1 << (self.window_size - 1).bit_length()
+        self.window = self._make_window(window, self.window_size)
+        self.mel_banks = self._make_mel_banks(n_mels, self.padded_window_size, fs, low_freq, high_freq)
+        self.eps = np.finfo(np.float32).eps
+
+    @staticmethod
+    def _make_window(window: str, size: int) -> np.ndarray:
+        """生成与 Kaldi 一致的（非周期）窗函数"""
+        if window == "hamming":
+            win = np.hamming(size)
+        elif window == "hanning":
+            win = np.hanning(size)
+        elif window == "povey":
+            win = np.hanning(size) ** 0.85
+        elif window == "rectangular":
+            win = np.ones(size)
+        else:
+            raise ValueError(f"不支持的窗函数类型: {window}")
+        return win.astype(np.float32)
+
+    @staticmethod
+    def _make_mel_banks(n_mels: int, padded_window_size: int, fs: int,
+                        low_freq: float, high_freq: float) -> np.ndarray:
+        """生成 Kaldi mel 三角滤波器组，shape (n_mels, padded_window_size // 2 + 1)"""
+        num_fft_bins = padded_window_size // 2
+        if high_freq <= 0.0:
+            high_freq += 0.5 * fs
+
+        def mel_scale(freq):
+            return 1127.0 * np.log(1.0 + np.asarray(freq) / 700.0)
+
+        mel_low, mel_high = mel_scale(low_freq), mel_scale(high_freq)
+        mel_delta = (mel_high - mel_low) / (n_mels + 1)
+        bins = np.arange(n_mels, dtype=np.float64)[:, None]
+        left_mel = mel_low + bins * mel_delta
+        center_mel = mel_low + (bins + 1.0) * mel_delta
+        right_mel = mel_low + (bins + 2.0) * mel_delta
+
+        mel = mel_scale(fs / padded_window_size * np.arange(num_fft_bins, dtype=np.float64))[None, :]
+        up_slope = (mel - left_mel) / (center_mel - left_mel)
+        down_slope = (right_mel - mel) / (right_mel - center_mel)
+        banks = np.maximum(0.0, np.minimum(up_slope, down_slope))
+        # 奈奎斯特频点不参与mel滤波
+        return np.pad(banks, ((0, 0), (0, 1))).astype(np.float32)
+
+    def fbank(self, waveform: np.ndarray) -> np.ndarray:
+        """计算 log-mel fbank，输入为[-1, 1]的float波形，返回 (T, n_mels)"""
+        waveform = np.asarray(waveform, dtype=np.float32) * (1 << 15)
+        if waveform.shape[0] < self.window_size:
+            return np.zeros((0, self.n_mels), dtype=np.float32)
+
+        frames = np.lib.stride_tricks.sliding_window_view(waveform, self.window_size)[::self.window_shift]
+        frames = frames.astype(np.float32)
+        if self.dither != 0.0:
+            frames += np.random.standard_normal(frames.shape).astype(np.float32) * self.dither
+        frames -= frames.mean(axis=1, keepdims=True)
+        if self.preemphasis != 0.0:
+            frames = np.concatenate([
+                frames[:, :1] * (1.0 - self.preemphasis),
+                frames[:, 1:] - self.preemphasis * frames[:, :-1]
+            ], axis=1)
+        frames *= self.window
+
+        spectrum = np.abs(np.fft.rfft(frames, n=self.padded_window_size)) ** 2
+        mel_energies = spectrum.astype(np.float32) @ self.mel_banks.T
+        return np.log(np.maximum(mel_energies, self.eps)).astype(np.float32)
+
+    def apply_lfr(self, feats: np.ndarray) -> np.ndarray:
+        """LFR拼帧：每 lfr_n 帧取一次、拼接 lfr_m 帧，首尾用边界帧补齐"""
+        lfr_m, lfr_n = self.lfr_m, self.lfr_n
+        if lfr_m == 1 and lfr_n == 1:
+            return feats
+        num_frames, dim = feats.shape
+        if num_frames == 0:
+            return np.zeros((0, dim * lfr_m), dtype=np.float32)
+
+        num_lfr_frames = int(np.ceil(num_frames / lfr_n))
+        left_padding = (lfr_m - 1) // 2
+        right_padding = max(0, (num_lfr_frames - 1) * lfr_n + lfr_m - (num_frames + left_padding))
+        padded = np.concatenate([
+            np.repeat(feats[:1], left_padding, axis=0),
+            feats,
+            np.repeat(feats[-1:], right_padding, axis=0)
+        ], axis=0)
+
+        # (num_windows, dim, lfr_m) -> (num_lfr_frames, lfr_m, dim) -> (num_lfr_frames, lfr_m * dim)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, lfr_m, axis=0)[::lfr_n][:num_lfr_frames]
+        return np.ascontiguousarray(windows.transpose(0, 2, 1)).reshape(num_lfr_frames, lfr_m * dim)
+
+    def extract_fbank(self, waveform: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """提取模型输入特征，返回 (1, T, D) 特征和 (1,) 长度"""
+        feats = self.apply_lfr(self.fbank(waveform)).astype(np.float32)
+        return feats[np.newaxis, :, :], np.array([feats.shape[0]], dtype=np.int64)
@@ -1,22 +1,349 @@
+import os
 import time
+import queue
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import numpy as np
 import onnxruntime
 from transformers import AutoTokenizer
 import warnings
-from funasr.register import tables
-from funasr.utils.load_utils import load_audio_text_image_video, extract_fbank
+
+from fun_asr_nano_frontend import WavFrontend, load_audio
 
 warnings.filterwarnings('ignore')
 
 
+def last_position_logits(logits):
+    """decoder 导出为逐位置 logits (B, S, V) 时取最后一个位置，(B, V) 时原样返回"""
+    return logits[:, -1] if logits.ndim == 3 else logits
+
+
+class PrefixKVCache:
+    """提示前缀 decoder KV 状态的 LRU 缓存，按占用字节数限制容量"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            state = self.entries.get(key)
+            if state is not None:
+                self.entries.move_to_end(key)
+            return state
+
+    def put(self, key, state):
+        if state['nbytes'] > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)['nbytes']
+            self.entries[key] = state
+            self.total_bytes += state['nbytes']
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted['nbytes']
+
+
+class RepetitionDetector:
+    """
+    基于滚动哈希的重复循环检测
+
+    维护已生成 token 的前缀多项式哈希，每步对 n = 1..max_ngram 比较末尾 n-gram 与其前一个 n-gram 的哈希，
+    记录连续相等的步数，因此每步的开销只与 max_ngram 有关，与已生成长度无关。
+    末尾以 n 为周期重复了至少 min_repeats 次、且重复部分不少于 min_tokens 个 token 时判定为循环。
+    """
+    MOD = (1 << 61) - 1
+    BASE = 1000003
+
+    def __init__(self, max_ngram=8, min_repeats=3, min_tokens=16):
+        self.max_ngram = max_ngram
+        self.min_repeats = min_repeats
+        self.min_tokens = min_tokens
+        self.powers = [pow(self.BASE, n, self.MOD) for n in range(max_ngram + 1)]
+        self.prefix = [0]
+        self.runs = [0] * (max_ngram + 1)
+
+    def _hash(self, end, n):
+        return (self.prefix[end] - self.prefix[end - n] * self.powers[n]) % self.MOD
+
+    def update(self, token_id):
+        """加入一个 token，检测到循环时返回 True"""
+        self.prefix.append((self.prefix[-1] * self.BASE + token_id + 1) % self.MOD)
+        length = len(self.prefix) - 1
+        for n in range(1, min(self.max_ngram, length // 2) + 1):
+            if self._hash(length, n) != self._hash(length - n, n):
+                self.runs[n] = 0
+                continue
+            self.runs[n] += 1
+            # 连续 runs 步末尾两个 n-gram 相同，即末尾 2n + runs - 1 个 token 以 n 为周期
+            span = 2 * n + self.runs[n] - 1
+            if span >= n * self.min_repeats and span >= self.min_tokens:
+                return True
+        return False
+
+
+class RepetitionPenalty:
+    """
+    重复惩罚状态：每行已生成 token 的 logits 乘以 repeat_penalty^出现次数
+
+    rows 记录每行被惩罚 token 的乘数；主机端选词时另外维护稠密的 scale (B, V) 与 logits 相乘，
+    decoder 融合了惩罚与 ArgMax 时不需要稠密表，只把 rows 转成 penalty_ids / penalty_scale 输入。
+    """
+
+    def __init__(self, batch_size, vocab_size, repeat_penalty, dense=True):
+        self.repeat_penalty = np.float32(repeat_penalty)
+        self.rows = [{} for _ in range(batch_size)]
+        self.scale = np.ones((batch_size, vocab_size), dtype=np.float32) if dense else None
+
+    def update(self, row, token_id):
+        value = self.rows[row].get(token_id, np.float32(1.0)) * self.repeat_penalty
+        self.rows[row][token_id] = value
+        if self.scale is not None:
+            self.scale[row, token_id] = value
+
+    @staticmethod
+    def feed(rows):
+        """把每行的 {token_id: 乘数} 转成 (B, K) 的 penalty_ids / penalty_scale，条目不足 K 的行重复第一个条目补齐"""
+        width = max([len(row) for row in rows] + [1])
+        ids = np.zeros((len(rows), width), dtype=np.int64)
+        scale = np.ones((len(rows), width), dtype=np.float32)
+        for i, row in enumerate(rows):
+            if row:
+                items = list(row.items())
+                items += [items[0]] * (width - len(items))
+                ids[i] = [token_id for token_id, _ in items]
+                scale[i] = [value for _, value in items]
+        return {'penalty_ids': ids, 'penalty_scale': scale}
+
+
+class KVCacheManager:
+    """
+    decoder KV 缓存管理
+
+    开启 IOBinding 时，按 前缀长度 + 预填充长度 + max_new_tokens 预先为每层 key/value 各分配两块连续缓冲区，
+    相邻两步交替作为输入/输出并通过 IOBinding 直接绑定给 decoder，KV 始终留在同一组缓冲区中，
+    每步只把 logits（融合了 ArgMax 的 decoder 为 next_token）读回主机。
+    decoder 图内部的 Concat 仍会把历史 KV 写入输出缓冲区，这部分按步计入 kv_bytes。
+    未开启时退化为 session.run，每步输出的全部 KV 都会转换为新的 numpy 数组。
+    """
+
+    def __init__(self, session, num_layers, num_heads, head_dim, use_io_binding=True):
+        self.session = session
+        self.num_layers = num_layers
+        self.num_heads = num_heads
+        self.head_dim = head_dim
+        self.use_io_binding = use_io_binding
+        self.output_names = [out.name for out in session.get_outputs()]
+        self.logits_name = self.output_names[num_layers * 2]
+        self.kv_len_name = self.output_names[-1]
+
+        self.batch_size = 1
+        self.capacity = 0
+        self.buffers = None
+        self.slot = 0
+        self.length = 0
+        self.keys, self.values = [], []
+        self.stats = {'steps': 0, 'kv_bytes': 0, 'host_bytes': 0}
+
+    def _shape(self, idx, length):
+        if idx < self.num_layers:
+            return (self.batch_size, self.num_heads, 1, self.head_dim, length)
+        return (self.batch_size, self.num_heads, 1, length, self.head_dim)
+
+    def _view(self, idx, slot, length):
+        shape = self._shape(idx, length)
+        return self.buffers[idx][slot][:int(np.prod(shape))].reshape(shape)
+
+    def reserve(self, capacity, batch_size=1):
+        """预留可容纳 capacity 个位置的缓冲区，已有容量足够时直接复用"""
+        if not self.use_io_binding:
+            return
+        if self.buffers is not None and capacity <= self.capacity and batch_size == self.batch_size:
+            return
+        old_views = None
+        if self.buffers is not None and batch_size == self.batch_size and self.length > 0:
+            old_views = [self._view(idx, self.slot, self.length).copy() for idx in range(self.num_layers * 2)]
+        self.batch_size = batch_size
+        self.capacity = capacity
+        elems = batch_size * self.num_heads * self.head_dim * capacity
+        self.buffers = [[np.empty(elems, dtype=np.float32), np.empty(elems, dtype=np.float32)]
+                        for _ in range(self.num_layers * 2)]
+        self.slot = 0
+        if old_views is not None:
+            for idx, old in enumerate(old_views):
+                self._view(idx, 0, self.length)[...] = old
+
+    def reset(self, prefix_state, capacity):
+        """以前缀 KV 状态开始新的序列"""
+        self.length = prefix_state['length']
+        self.stats = {'steps': 0, 'kv_bytes': 0, 'host_bytes': 0}
+        batch_size = prefix_state['keys'][0].shape[0]
+        if not self.use_io_binding:
+            self.batch_size = batch_size
+            self.keys = list(prefix_state['keys'])
+            self.values = list(prefix_state['values'])
+            return
+        self.length = 0
+        self.reserve(capacity, batch_size)
+        self.length = prefix_state['length']
+        self.slot = 0
+        for i in range(self.num_layers):
+            self._view(i, 0, self.length)[...] = prefix_state['keys'][i]
+            self._view(i + self.num_layers, 0, self.length)[...] = prefix_state['values'][i]
+
+    def step(self, hidden, attention_mask, all_positions=False, feeds=None):
+        """
+        以当前 KV 为历史运行一步 decoder，返回 logits；all_positions 为 True 时保留逐位置 logits。
+        feeds 为额外输入（如融合图的 penalty_ids / penalty_scale）
+        """
+        hidden = np.ascontiguousarray(hidden, dtype=np.float32)
+        ids_len = hidden.shape[1]
+        new_len = self.length + ids_len
+        scalars = {
+            'history_len': np.array([self.length], dtype=np.int64),
+            'ids_len': np.array([ids_len], dtype=np.int64),
+            'attention_mask': np.array([attention_mask], dtype=np.int8),
+        }
+        if feeds:
+            scalars.update(feeds)
+
+        if not self.use_io_binding:
+            inputs = {'hidden_states': hidden, **scalars}
+            for i in range(self.num_layers):
+                inputs[f'in_key_{i}'] = self.keys[i]
+                inputs[f'in_value_{i}'] = self.values[i]
+            outputs = self.session.run(None, inputs)
+            self.keys = list(outputs[:self.num_layers])
+            self.values = list(outputs[self.num_layers:self.num_layers * 2])
+            logits = outputs[self.num_layers * 2]
+            kv_bytes = sum(k.nbytes for k in self.keys) + sum(v.nbytes for v in self.values)
+            self._record(kv_bytes, kv_bytes + logits.nbytes)
+            self.length = new_len
+            return logits if all_positions else last_position_logits(logits)
+
+        if new_len > self.capacity:
+            self.reserve(new_len + 64, self.batch_size)
+        src, dst = self.slot, 1 - self.slot
+        binding = self.session.io_binding()
+        kv_bytes = 0
+        for idx in range(self.num_layers * 2):
+            in_name = f'in_key_{idx}' if idx < self.num_layers else f'in_value_{idx - self.num_layers}'
+            in_view = self._view(idx, src, self.length)
+            out_view = self._view(idx, dst, new_len)
+            binding.bind_input(in_name, 'cpu', 0, np.float32, in_view.shape, in_view.ctypes.data)
+            binding.bind_output(self.output_names[idx], 'cpu', 0, np.float32, out_view.shape, out_view.ctypes.data)
+            kv_bytes += out_view.nbytes
+        binding.bind_cpu_input('hidden_states', hidden)
+        for name, value in scalars.items():
+            binding.bind_cpu_input(name, value)
+        binding.bind_output(self.logits_name, 'cpu')
+        binding.bind_output(self.kv_len_name, 'cpu')
+        self.session.run_with_iobinding(binding)
+
+        logits = binding.get_outputs()[self.num_layers * 2].numpy()
+        self._record(kv_bytes, logits.nbytes)
+        self.slot = dst
+        self.length = new_len
+        return logits if all_positions else last_position_logits(logits)
+
+    def select_rows(self, rows):
+        """只保留 batch 中 rows 指定的行（批量解码中部分序列结束后收缩 batch，不再为已结束的行计算）"""
+        rows = list(rows)
+        if len(rows) == self.batch_size:
+            return
+        if not self.use_io_binding:
+            self.keys = [k[rows] for k in self.keys]
+            self.values = [v[rows] for v in self.values]
+            self.batch_size = len(rows)
+            return
+        # 缓冲区按原 batch 分配，收缩后的视图可以直接放在另一块缓冲区中
+        kept = [self._view(idx, self.slot, self.length)[rows] for idx in range(self.num_layers * 2)]
+        self.batch_size = len(rows)
+        self.slot = 1 - self.slot
+        for idx, old in enumerate(kept):
+            self._view(idx, self.slot, self.length)[...] = old
+
+    def rollback(self, length):
+        """丢弃 length 之后的 KV（投机解码校验失败时回退到已接受的位置）"""
+        if length >= self.length:
+            return
+        if not self.use_io_binding:
+            self.keys = [np.ascontiguousarray(k[..., :length]) for k in self.keys]
+            self.values = [np.ascontiguousarray(v[..., :length, :]) for v in self.values]
+            self.length = length
+            return
+        # 时间维不是最外层维度，截断后布局改变，需要拷贝到另一块缓冲区
+        src, dst = self.slot, 1 - self.slot
+        for idx in range(self.num_layers * 2):
+            old = self._view(idx, src, self.length)
+            new = self._view(idx, dst, length)
+            new[...] = old[..., :length] if idx < self.num_layers else old[..., :length, :]
+        self.slot = dst
+        self.length = length
+
+    def _record(self, kv_bytes, host_bytes):
+        self.stats['steps'] += 1
+        self.stats['kv_bytes'] += kv_bytes
+        self.stats['host_bytes'] += host_bytes
+
+    def report(self):
+        """每步平均拷贝字节数：kv_bytes 为写入 KV 缓冲区的字节，host_bytes 为读回主机的字节"""
+        steps = max(self.stats['steps'], 1)
+        return {
+            'steps': self.stats['steps'],
+            'kv_bytes_per_step': self.stats['kv_bytes'] / steps,
+            'host_bytes_per_step': self.stats['host_bytes'] / steps,
+        }
+
+
+class KVCachePool:
+    """
+    KVCacheManager 对象池
+
+    每次解码取出一个独立的管理器，结束后归还，预分配的缓冲区在后续解码中复用。
+    transcribe、transcribe_stream（生成器）、transcribe_multi 交错执行或从多个线程调用时各自持有自己的 KV，互不覆盖。
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.free = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+        return self.factory()
+
+    def release(self, manager):
+        with self.lock:
+            self.free.append(manager)
+
+
 class FunASRNanoONNX:
     def __init__(self, model_path, sample_rate=16000, n_mels=80,
                  window_length=400, hop_length=160, pre_emphasize=0.97,
                  lfr_m=7, lfr_n=6, stop_tokens=None,
                  max_new_tokens=200, repeat_penalty=1.0, max_audio_len=512000,
-                 num_threads=4):
+                 num_threads=4, prefix_cache_max_bytes=256 * 1024 * 1024,
+                 use_embed_table=False, embed_cache_path=None, use_io_binding=True,
+                 loop_max_ngram=8, loop_min_repeats=3, loop_min_tokens=16,
+                 max_tokens_per_second=0.0, min_duration_tokens=16):
         self.sample_rate = sample_rate
         self.max_new_tokens = max_new_tokens
+        # 提前停止：重复循环检测（loop_max_ngram=0 关闭）与按音频时长限制生成长度（max_tokens_per_second > 0 时开启，默认关闭）
+        self.loop_max_ngram = loop_max_ngram
+        self.loop_min_repeats = loop_min_repeats
+        self.loop_min_tokens = loop_min_tokens
+        self.max_tokens_per_second = max_tokens_per_second
+        self.min_duration_tokens = min_duration_tokens
+        # 结束原因、投机解码统计、KV 拷贝统计按线程保存，多个线程共用一个实例时互不覆盖
+        self._local = threading.local()
         self.repeat_penalty = repeat_penalty
         self.max_audio_len = max_audio_len
         self.stop_tokens = stop_tokens if stop_tokens else [151643, 151645]
@@ -32,25 +359,47 @@ class FunASRNanoONNX:
             f'{model_path}/encoder_adaptor.int8.onnx', opts, providers=providers)
         self.ort_embed = onnxruntime.InferenceSession(
             f'{model_path}/embed.int8.onnx', opts, providers=providers)
-        self.ort_decoder = onnxruntime.InferenceSession(
-            f'{model_path}/decoder.int8.onnx', opts, providers=providers)
+        # 存在 fuse_decoder_argmax.py 生成的融合 decoder 时优先使用
+        decoder_path = f'{model_path}/decoder.argmax.int8.onnx'
+        if not os.path.exists(decoder_path):
+            decoder_path = f'{model_path}/decoder.int8.onnx'
+        self.ort_decoder = onnxruntime.InferenceSession(decoder_path, opts, providers=providers)
 
         # 解析 decoder 结构
         decoder_inputs = self.ort_decoder.get_inputs()
         self.num_layers = sum(1 for inp in decoder_inputs if 'in_key' in inp.name)
         offset = self.num_layers * 2
         self.idx_hidden = offset
-        self.vocab_size = self.ort_decoder.get_outputs()[self.idx_hidden].shape[-1]
+        logits_output = self.ort_decoder.get_outputs()[self.idx_hidden]
+        # 融合了重复惩罚与 ArgMax 的 decoder 在 logits 的位置输出 next_token，每步只读回 token id
+        self.fused_argmax = logits_output.name == 'next_token'
+        if self.fused_argmax:
+            vocab_size = self.ort_decoder.get_modelmeta().custom_metadata_map.get('vocab_size')
+            self.vocab_size = int(vocab_size) if vocab_size else None
+            self.per_position_logits = False
+        else:
+            self.vocab_size = logits_output.shape[-1]
+            # 投机解码一次校验多个草稿 token，需要 decoder 输出每个位置的 logits (B, S, V)
+            self.per_position_logits = len(logits_output.shape) == 3
         sample_key = decoder_inputs[0]
         self.num_heads = sample_key.shape[1]
         self.head_dim = sample_key.shape[3]
         self.embed_in_name = self.ort_embed.get_inputs()[0].name
         self.embed_out_name = self.ort_embed.get_outputs()[0].name
+        self.kv_pool = KVCachePool(lambda: KVCacheManager(self.ort_decoder, self.num_layers, self.num_heads,
+                                                          self.head_dim, use_io_binding=use_io_binding))
+
+        # 嵌入表（可选）：加载时一次性取出反量化后的嵌入矩阵，逐 token 查表代替 embed 会话调用；
+        # decoder 直接以 input_ids 为输入时不需要主机端嵌入，不构建
+        decoder_takes_ids = any(inp.name == 'input_ids' for inp in decoder_inputs)
+        self.embed_table = None
+        if use_embed_table and not decoder_takes_ids:
+            self.embed_table = self._load_embed_table(embed_cache_path)
 
         # 加载 tokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
 
-        # 初始化 FunASR 前端（包含 LFR）
+        # 初始化音频前端（NumPy实现，包含 LFR）
         frontend_conf = {
             "fs": sample_rate,
             "window": "hamming",
@@ -61,10 +410,8 @@ class FunASRNanoONNX:
             "lfr_n": lfr_n,
             "dither": 1.0,
             "snip_edges": True,
-            "cmvn_file": None,
         }
-        frontend_class = tables.frontend_classes.get("wav_frontend")
-        self.frontend = frontend_class(**frontend_conf)
+        self.frontend = WavFrontend(**frontend_conf)
 
         # 预计算系统提示嵌入
         sys_ids = self.tokenizer.encode("<|im_start|>system\nYou are a helpful assistant.<|im_end|>\n",
@@ -72,39 +419,72 @@ class FunASRNanoONNX:
         user_ids = self.tokenizer.encode("<|im_start|>user\n", return_tensors='np').astype(np.int64)
         asst_ids = self.tokenizer.encode("<|im_end|>\n<|im_start|>assistant\n",
                                           return_tensors='np').astype(np.int64)
-        self.system_embed = self.ort_embed.run([self.embed_out_name], {self.embed_in_name: sys_ids})[0]
-        self.user_prefix_embed = self.ort_embed.run([self.embed_out_name], {self.embed_in_name: user_ids})[0]
-        self.assistant_prefix_embed = self.ort_embed.run([self.embed_out_name], {self.embed_in_name: asst_ids})[0]
+        self.system_embed = self._embed(sys_ids)
+        self.user_prefix_embed = self._embed(user_ids)
+        self.assistant_prefix_embed = self._embed(asst_ids)
+
+        # 固定前缀（system + user 前缀）的 KV 状态只计算一次，按提示词扩展的前缀状态放入 LRU 缓存
+        self.prefix_cache = PrefixKVCache(prefix_cache_max_bytes)
+        fixed_prefix = np.concatenate([self.system_embed, self.user_prefix_embed], axis=1)
+        self.fixed_prefix_state = self._prefill(fixed_prefix, self._empty_prefix_state())
+        self.use_prefix_cache = self._verify_prefix_cache()
 
     def _load_and_process_audio(self, audio_path: str):
         """加载音频并提取 fbank 特征"""
         try:
             # 加载音频（自动重采样至 self.sample_rate）
-            data_src = load_audio_text_image_video(audio_path, fs=self.sample_rate)
+            data_src = load_audio(audio_path, sample_rate=self.sample_rate)
             if len(data_src) > self.max_audio_len:
                 data_src = data_src[:self.max_audio_len]
             audio_duration = len(data_src) / self.sample_rate
 
             # 提取 fbank 特征
-            speech, speech_lengths = extract_fbank(
-                data_src,
-                data_type="sound",
-                frontend=self.frontend,
-                is_final=True,
-            )
-
-            # 转换为 numpy 数组
-            speech_np = speech.cpu().numpy().astype(np.float32)
-            speech_lengths_np = speech_lengths.cpu().numpy().astype(np.int64)
+            speech_np, speech_lengths_np = self.frontend.extract_fbank(data_src)
 
             return speech_np, speech_lengths_np, audio_duration
 
         except Exception as e:
             raise RuntimeError(f"音频处理失败: {e}")
 
+    def _load_embed_table(self, cache_path=None, chunk_size=4096):
+        """
+        取出反量化后的嵌入矩阵 (vocab_size, hidden_size)，以 float16 保存在内存中
+
+        通过 embed 会话按块查询全部 token id 得到。float16 存储使内存占用减半（约 300 MB），
+        查表结果与 embed 会话输出的相对误差不超过 2^-11（约 4.9e-4，float16 舍入），
+        需要与导出的 embed 模型逐位一致时不要开启 use_embed_table。
+        指定 cache_path 时保存为 .npy 文件并以内存映射方式加载，多进程可共享同一份页缓存。
+        """
+        if not isinstance(self.vocab_size, int):
+            return None
+        if cache_path and os.path.exists(cache_path):
+            table = np.load(cache_path, mmap_mode='r')
+            if table.shape[0] == self.vocab_size:
+                return table
+            print(f"警告: 嵌入缓存文件行数 {table.shape[0]} 与词表大小 {self.vocab_size} 不一致，重新生成")
+
+        chunks = []
+        for start in range(0, self.vocab_size, chunk_size):
+            ids = np.arange(start, min(start + chunk_size, self.vocab_size), dtype=np.int64)[np.newaxis, :]
+            chunks.append(self.ort_embed.run([self.embed_out_name], {self.embed_in_name: ids})[0][0]
+                          .astype(np.float16))
+        table = np.concatenate(chunks, axis=0)
+
+        if cache_path:
+            np.save(cache_path, table)
+            return np.load(cache_path, mmap_mode='r')
+        return table
+
+    def _embed(self, ids):
+        """token id -> 嵌入，优先查表，超出嵌入表范围时回退到 embed 会话"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.embed_table is not None and ids.size and 0 <= ids.min() and ids.max() < self.embed_table.shape[0]:
+            return self.embed_table[ids].astype(np.float32)
+        return self.ort_embed.run([self.embed_out_name], {self.embed_in_name: ids})[0]
+
     def _encode_prompt(self, prompt):
         ids = self.tokenizer.encode(prompt, return_tensors='np').astype(np.int64)
-        return self.ort_embed.run([self.embed_out_name], {self.embed_in_name: ids})[0]
+        return self._embed(ids)
 
     def _encode_audio(self, audio_path):
         feat, feat_len, audio_duration = self._load_and_process_audio(audio_path)
@@ -114,58 +494,175 @@ class FunASRNanoONNX:
         )[0]
         return audio_embed, audio_duration
 
-    def _decode(self, init_hidden, init_len):
-        batch_size = 1
+    def _empty_prefix_state(self, batch_size=1):
+        keys = [np.zeros((batch_size, self.num_heads, 1, self.head_dim, 0), dtype=np.float32)
+                for _ in range(self.num_layers)]
+        values = [np.zeros((batch_size, self.num_heads, 1, 0, self.head_dim), dtype=np.float32)
+                  for _ in range(self.num_layers)]
+        return {'keys': keys, 'values': values, 'length': 0, 'nbytes': 0}
+
+    def _prefill(self, hidden, state, return_logits=False):
+        """在已有 KV 状态之后预填充一段嵌入，返回扩展后的 KV 状态"""
         inputs = {}
         for i in range(self.num_layers):
-            inputs[f'in_key_{i}'] = np.zeros((batch_size, self.num_heads, 1, self.head_dim, 0), dtype=np.float32)
-            inputs[f'in_value_{i}'] = np.zeros((batch_size, self.num_heads, 1, 0, self.head_dim), dtype=np.float32)
-
-        inputs['hidden_states'] = init_hidden.astype(np.float32)
-        inputs['history_len'] = np.array([0], dtype=np.int64)
-        inputs['ids_len'] = np.array([init_len], dtype=np.int64)
+            inputs[f'in_key_{i}'] = state['keys'][i]
+            inputs[f'in_value_{i}'] = state['values'][i]
+        inputs['hidden_states'] = hidden.astype(np.float32)
+        inputs['history_len'] = np.array([state['length']], dtype=np.int64)
+        inputs['ids_len'] = np.array([hidden.shape[1]], dtype=np.int64)
         inputs['attention_mask'] = np.array([1], dtype=np.int8)
+        inputs.update(self._decoder_feeds([{}] * hidden.shape[0]))
+        outputs = self.ort_decoder.run(None, inputs)
 
-        generated = []
-        penalty = np.ones((1, self.vocab_size), dtype=np.float32)
-        step = 0
+        keys = list(outputs[:self.num_layers])
+        values = list(outputs[self.num_layers:self.num_layers * 2])
+        new_state = {
+            'keys': keys,
+            'values': values,
+            'length': state['length'] + hidden.shape[1],
+            'nbytes': sum(k.nbytes for k in keys) + sum(v.nbytes for v in values),
+        }
+        if return_logits:
+            return new_state, last_position_logits(outputs[self.idx_hidden])
+        return new_state
 
-        while step < self.max_new_tokens:
-            outputs = self.ort_decoder.run(None, inputs)
-            logits = outputs[self.idx_hidden]
+    def _verify_prefix_cache(self):
+        """校验分段预填充与整段预填充的首个 token 是否一致，不一致时关闭前缀缓存"""
+        probe_embed = self._encode_prompt("语音转写：")
+        probe = np.concatenate([probe_embed, self.assistant_prefix_embed], axis=1)
+        full = np.concatenate([self.system_embed, self.user_prefix_embed, probe], axis=1)
+        _, full_logits = self._prefill(full, self._empty_prefix_state(), return_logits=True)
+        _, cached_logits = self._prefill(probe, self.fixed_prefix_state, return_logits=True)
+        if self._select_tokens(full_logits)[0] != self._select_tokens(cached_logits)[0]:
+            print("警告: decoder 不支持带历史的分段预填充，已关闭前缀 KV 缓存")
+            return False
+        return True
 
-            penalized = logits * penalty
-            next_token = np.argmax(penalized, axis=-1, keepdims=True).astype(np.int64)
-            token_id = int(next_token[0, 0])
-            if token_id in self.stop_tokens:
-                break
-            generated.append(token_id)
-            penalty[0, token_id] *= self.repeat_penalty
+    def _get_prompt_prefix_state(self, prompt):
+        """获取 system + user 前缀 + 提示词的 KV 状态（按提示词 LRU 缓存）"""
+        state = self.prefix_cache.get(prompt)
+        if state is None:
+            state = self._prefill(self._encode_prompt(prompt), self.fixed_prefix_state)
+            self.prefix_cache.put(prompt, state)
+        return state
 
-            for i in range(self.num_layers):
-                inputs[f'in_key_{i}'] = outputs[i]
-                inputs[f'in_value_{i}'] = outputs[i + self.num_layers]
+    def _token_limit(self, audio_duration=None):
+        """按音频时长估计生成长度上限：时长 × max_tokens_per_second + min_duration_tokens，不超过 max_new_tokens"""
+        if audio_duration is None or not self.max_tokens_per_second:
+            return self.max_new_tokens
+        limit = int(np.ceil(audio_duration * self.max_tokens_per_second)) + self.min_duration_tokens
+        return min(self.max_new_tokens, limit)
 
-            token_embed = self.ort_embed.run(
-                [self.embed_out_name],
-                {self.embed_in_name: next_token.astype(np.int64)}
-            )[0]
-            inputs['hidden_states'] = token_embed
+    def _new_loop_detector(self):
+        if self.loop_max_ngram <= 0:
+            return None
+        return RepetitionDetector(self.loop_max_ngram, self.loop_min_repeats, self.loop_min_tokens)
 
-            kv_len = outputs[-1]
-            if isinstance(kv_len, np.ndarray):
-                kv_len = kv_len[0]
-            inputs['history_len'] = np.array([kv_len], dtype=np.int64)
-            inputs['ids_len'] = np.array([1], dtype=np.int64)
-            inputs['attention_mask'] = np.array([0], dtype=np.int8)
-            step += 1
+    def _new_penalty(self, batch_size):
+        return RepetitionPenalty(batch_size, self.vocab_size, self.repeat_penalty, dense=not self.fused_argmax)
 
-        return generated
+    def _decoder_feeds(self, penalty_rows):
+        """融合 decoder 需要的重复惩罚输入，普通 decoder 返回空字典"""
+        return RepetitionPenalty.feed(penalty_rows) if self.fused_argmax else {}
 
-    def transcribe(self, audio_path, prompt):
-        audio_embed, audio_duration = self._encode_audio(audio_path)
-        prompt_embed = self._encode_prompt(prompt)
+    def _select_tokens(self, logits, penalty=None):
+        """由 decoder 输出选出每行的下一个 token：融合 decoder 已在图内完成惩罚与 argmax，否则在主机端计算"""
+        if self.fused_argmax:
+            return np.asarray(logits, dtype=np.int64).reshape(-1)
+        if penalty is not None:
+            logits = logits * penalty.scale
+        return np.argmax(logits, axis=-1).astype(np.int64)
+
+    def _accept_token(self, token_id, generated, penalty, row, detector, max_tokens):
+        """
+        记录新生成的 token 并更新该行的重复惩罚，需要停止时返回结束原因：
+        'repetition'（检测到重复循环）、'duration_limit'（达到按音频时长估计的上限）、'max_new_tokens'
+        """
+        generated.append(token_id)
+        penalty.update(row, token_id)
+        if detector is not None and detector.update(token_id):
+            return 'repetition'
+        if len(generated) >= max_tokens:
+            return 'max_new_tokens' if max_tokens >= self.max_new_tokens else 'duration_limit'
+        return None
+
+    @property
+    def last_stop_reason(self):
+        """当前线程最近一次解码的结束原因"""
+        return getattr(self._local, 'stop_reason', None)
+
+    @property
+    def last_stop_reasons(self):
+        """当前线程最近一次 transcribe_multi 各提示词的结束原因，顺序与 prompts 一致"""
+        return getattr(self._local, 'stop_reasons', None)
+
+    @property
+    def last_kv_report(self):
+        """当前线程最近一次解码的 KV 拷贝统计，见 KVCacheManager.report"""
+        return getattr(self._local, 'kv_report', None)
+
+    @property
+    def spec_stats(self):
+        """当前线程最近一次投机解码的调用统计"""
+        return getattr(self._local, 'spec_stats', {'decoder_calls': 0, 'draft_tokens': 0, 'accepted_tokens': 0})
+
+    def _release_kv_cache(self, kv_cache, stop_reason, result=None):
+        """归还 KV 管理器，并记录本次解码的结束原因与 KV 拷贝统计"""
+        kv_report = kv_cache.report()
+        self.kv_pool.release(kv_cache)
+        self._local.stop_reason = stop_reason
+        self._local.kv_report = kv_report
+        if result is not None:
+            result['stop_reason'] = stop_reason
+            result['kv_report'] = kv_report
+
+    def _generate(self, init_hidden, init_len, prefix_state=None, max_tokens=None, result=None):
+        """
+        贪心解码生成器，每生成一个 token 立即产出其 id。
+        结束原因与 KV 拷贝统计写入 result 字典（若提供），同时记录在当前线程的 last_stop_reason / last_kv_report
+        """
+        if prefix_state is None:
+            prefix_state = self._empty_prefix_state()
+        if max_tokens is None:
+            max_tokens = self.max_new_tokens
+        kv_cache = self.kv_pool.acquire()
+        stop_reason = 'max_new_tokens' if max_tokens >= self.max_new_tokens else 'duration_limit'
+        try:
+            kv_cache.reset(prefix_state, prefix_state['length'] + init_len + max_tokens)
+            generated = []
+            penalty = self._new_penalty(1)
+            detector = self._new_loop_detector()
+            logits = kv_cache.step(init_hidden, attention_mask=1, feeds=self._decoder_feeds(penalty.rows))
+
+            while len(generated) < max_tokens:
+                token_id = int(self._select_tokens(logits, penalty)[0])
+                if token_id in self.stop_tokens:
+                    stop_reason = 'stop_token'
+                    break
+                reason = self._accept_token(token_id, generated, penalty, 0, detector, max_tokens)
+                yield token_id
+                if reason is not None:
+                    stop_reason = reason
+                    break
+
+                next_token = np.array([[token_id]], dtype=np.int64)
+                logits = kv_cache.step(self._embed(next_token), attention_mask=0,
+                                       feeds=self._decoder_feeds(penalty.rows))
+        finally:
+            self._release_kv_cache(kv_cache, stop_reason, result)
 
+    def _decode(self, init_hidden, init_len, prefix_state=None, max_tokens=None):
+        return list(self._generate(init_hidden, init_len, prefix_state, max_tokens))
+
+    def _build_decoder_input(self, audio_embed, prompt):
+        """构造预填充输入，返回 (拼接后的嵌入, 前缀 KV 状态)"""
+        if self.use_prefix_cache:
+            # system + user 前缀 + 提示词已缓存为 KV 状态，只需预填充音频和 assistant 前缀
+            prefix_state = self._get_prompt_prefix_state(prompt)
+            concat = np.concatenate([audio_embed, self.assistant_prefix_embed], axis=1)
+            return concat, prefix_state
+
+        prompt_embed = self._encode_prompt(prompt)
         concat = np.concatenate([
             self.system_embed,
             self.user_prefix_embed,
@@ -173,9 +670,105 @@ class FunASRNanoONNX:
             audio_embed,
             self.assistant_prefix_embed
         ], axis=1)
+        return concat, None
+
+    @staticmethod
+    def _propose_draft(generated, draft_ids, num_tokens, max_ngram=3):
+        """
+        在草稿中查找与已生成内容末尾 n-gram 相同的位置，取其后 num_tokens 个 token 作为候选
+        （按 n 从大到小匹配，同一 n-gram 多次出现时取最后一次，CTC 与 LLM 分词或用字不一致时可自动重新对齐）
+        """
+        for n in range(min(max_ngram, len(generated)), 0, -1):
+            suffix = generated[-n:]
+            for start in range(len(draft_ids) - n, -1, -1):
+                if draft_ids[start:start + n] == suffix:
+                    return draft_ids[start + n:start + n + num_tokens]
+        return []
+
+    def _generate_speculative(self, init_hidden, init_len, prefix_state, draft_ids, num_draft_tokens,
+                              max_tokens=None):
+        """
+        以 CTC 转写为草稿的投机贪心解码，输出与 _generate 相同
+
+        每次把待写入的 token 与至多 num_draft_tokens 个草稿 token 一起送入 decoder，
+        逐位置取 argmax 与草稿比较：一致则接受并继续，首个不一致的位置上模型自己的预测即为下一个 token，
+        随后把 KV 回退到已接受的位置。草稿正确率高时，一次 decoder 调用可产出多个 token。
+        校验多个草稿 token 需要逐位置 logits，并依赖在已有 KV 之后续接多 token 输入（与前缀缓存的前提相同）；
+        decoder 不输出逐位置 logits 或前缀缓存自检未通过（use_prefix_cache 为 False）时退回 _decode 逐 token 解码。
+        """
+        if not (self.per_position_logits and self.use_prefix_cache):
+            self._local.spec_stats = {'decoder_calls': 0, 'draft_tokens': 0, 'accepted_tokens': 0}
+            return self._decode(init_hidden, init_len, prefix_state, max_tokens)
+        if prefix_state is None:
+            prefix_state = self._empty_prefix_state()
+        if max_tokens is None:
+            max_tokens = self.max_new_tokens
+        stats = {'decoder_calls': 1, 'draft_tokens': 0, 'accepted_tokens': 0}
+        self._local.spec_stats = stats
+        kv_cache = self.kv_pool.acquire()
+        stop_reason = 'stop_token'
+        try:
+            kv_cache.reset(prefix_state, prefix_state['length'] + init_len + max_tokens + num_draft_tokens)
+            logits = kv_cache.step(init_hidden, attention_mask=1)
+
+            generated = []
+            penalty = self._new_penalty(1)
+            detector = self._new_loop_detector()
+            token_id = int(self._select_tokens(logits, penalty)[0])
+            while token_id not in self.stop_tokens:
+                reason = self._accept_token(token_id, generated, penalty, 0, detector, max_tokens)
+                if reason is not None:
+                    stop_reason = reason
+                    break
+
+                draft = self._propose_draft(generated, draft_ids,
+                                            min(num_draft_tokens, max_tokens - len(generated)))
+                history_len = kv_cache.length
+                inputs = np.array([[token_id] + draft], dtype=np.int64)
+                logits = kv_cache.step(self._embed(inputs), attention_mask=1 if draft else 0, all_positions=True)
+                if logits.ndim == 2:
+                    logits = logits[:, np.newaxis, :]
+                stats['decoder_calls'] += 1
+                stats['draft_tokens'] += len(draft)
+
+                for pos in range(len(draft) + 1):
+                    token_id = int(np.argmax(logits[0, pos] * penalty.scale[0]))
+                    if pos == len(draft) or token_id != draft[pos]:
+                        # 首个不一致的位置：保留到该位置为止的 KV，token_id 作为下一步的输入
+                        kv_cache.rollback(history_len + pos + 1)
+                        break
+                    if token_id in self.stop_tokens:
+                        break
+                    stats['accepted_tokens'] += 1
+                    reason = self._accept_token(token_id, generated, penalty, 0, detector, max_tokens)
+                    if reason is not None:
+                        stop_reason = reason
+                        return generated
+            return generated
+        finally:
+            self._release_kv_cache(kv_cache, stop_reason)
+
+    def transcribe_speculative(self, audio_path, prompt, draft_text, num_draft_tokens=8):
+        """
+        以 CTC 模型的转写结果 draft_text 作为草稿进行投机解码，结果与 transcribe 相同，decoder 调用次数更少。
+        decoder 只输出最后一个位置的 logits 时无法一次校验多个草稿 token，
+        前缀缓存自检未通过时无法在已有 KV 之后续接多 token 输入，这两种情况都退回 transcribe 逐 token 解码。
+        调用统计见 self.spec_stats。
+        """
+        if not self.per_position_logits:
+            print("警告: decoder 只输出最后一个位置的 logits，投机解码需要导出逐位置 logits，已退回逐 token 解码")
+            return self.transcribe(audio_path, prompt)
+        if not self.use_prefix_cache:
+            print("警告: 前缀缓存自检未通过，decoder 不支持续接多 token 输入，已退回逐 token 解码")
+            return self.transcribe(audio_path, prompt)
+
+        audio_embed, audio_duration = self._encode_audio(audio_path)
 
         start = time.time()
-        token_ids = self._decode(concat, concat.shape[1])
+        concat, prefix_state = self._build_decoder_input(audio_embed, prompt)
+        draft_ids = [int(i) for i in self.tokenizer.encode(draft_text)] if draft_text else []
+        token_ids = self._generate_speculative(concat, concat.shape[1], prefix_state, draft_ids, num_draft_tokens,
+                                               self._token_limit(audio_duration))
         elapsed = time.time() - start
 
         if token_ids:
@@ -184,6 +777,412 @@ class FunASRNanoONNX:
             text = ""
         return text, len(token_ids), elapsed, audio_duration
 
+    def verify_speculative(self, audio_path, prompt, draft_text, num_draft_tokens=8):
+        """
+        一致性校验：同一输入分别做逐 token 贪心解码与投机解码，比较两者的 token id 序列。
+        额外检查一个错误草稿（草稿整体后移一位），确保拒绝路径同样与贪心解码一致。返回是否全部一致。
+        """
+        audio_embed, audio_duration = self._encode_audio(audio_path)
+        concat, prefix_state = self._build_decoder_input(audio_embed, prompt)
+        max_tokens = self._token_limit(audio_duration)
+        reference = self._decode(concat, concat.shape[1], prefix_state, max_tokens)
+        draft_ids = [int(i) for i in self.tokenizer.encode(draft_text)] if draft_text else []
+
+        consistent = True
+        for name, draft in (('CTC 草稿', draft_ids), ('错位草稿', reference[1:] + reference[:1])):
+            token_ids = self._generate_speculative(concat, concat.shape[1], prefix_state, draft, num_draft_tokens,
+                                                   max_tokens)
+            if token_ids != reference:
+                mismatch = next((i for i, (a, b) in enumerate(zip(token_ids, reference)) if a != b),
+                                min(len(token_ids), len(reference)))
+                print(f"[投机解码校验] {name}: 与贪心解码在第 {mismatch} 个 token 处不一致")
+                consistent = False
+        if consistent:
+            print(f"[投机解码校验] 与贪心解码逐 token 一致（{len(reference)} tokens）")
+        return consistent
+
+    def _stack_prefix_states(self, states):
+        """把长度相同的多个前缀 KV 状态沿 batch 维拼接"""
+        keys = [np.concatenate([st['keys'][i] for st in states], axis=0) for i in range(self.num_layers)]
+        values = [np.concatenate([st['values'][i] for st in states], axis=0) for i in range(self.num_layers)]
+        return {
+            'keys': keys,
+            'values': values,
+            'length': states[0]['length'],
+            'nbytes': sum(k.nbytes for k in keys) + sum(v.nbytes for v in values),
+        }
+
+    def _decode_batch(self, init_hidden, prefix_state, max_tokens=None):
+        """
+        整批贪心解码，init_hidden 为 (B, T, D)，prefix_state 为 batch 为 B 的前缀 KV 状态。
+        已结束的行继续以 stop token 填充参与计算（结果丢弃），直到整批结束或达到 max_tokens。
+        返回 (各行 token 列表, 各行结束原因)。
+        """
+        batch_size, init_len = init_hidden.shape[:2]
+        if max_tokens is None:
+            max_tokens = self.max_new_tokens
+        generated = [[] for _ in range(batch_size)]
+        reasons = [None] * batch_size
+        detectors = [self._new_loop_detector() for _ in range(batch_size)]
+        penalty = self._new_penalty(batch_size)
+        pad_token = self.stop_tokens[0]
+        kv_cache = self.kv_pool.acquire()
+        try:
+            kv_cache.reset(prefix_state, prefix_state['length'] + init_len + max_tokens)
+            logits = kv_cache.step(init_hidden, attention_mask=1, feeds=self._decoder_feeds(penalty.rows))
+
+            for _ in range(max_tokens):
+                next_tokens = self._select_tokens(logits, penalty)
+                for row in range(batch_size):
+                    if reasons[row] is not None:
+                        next_tokens[row] = pad_token
+                        continue
+                    token_id = int(next_tokens[row])
+                    if token_id in self.stop_tokens:
+                        reasons[row] = 'stop_token'
+                        continue
+                    reasons[row] = self._accept_token(token_id, generated[row], penalty, row, detectors[row],
+                                                      max_tokens)
+                if all(reason is not None for reason in reasons):
+                    break
+                logits = kv_cache.step(self._embed(next_tokens[:, np.newaxis]), attention_mask=0,
+                                       feeds=self._decoder_feeds(penalty.rows))
+        finally:
+            self.kv_pool.release(kv_cache)
+        return generated, reasons
+
+    def transcribe_multi(self, audio_path, prompts):
+        """
+        同一段音频按多个提示词转写：音频只加载、提取特征并编码一次，各提示词合成批次预填充和解码
+
+        导出的 decoder 中 history_len / attention_mask 为整批共用的标量，填充位置无法被屏蔽，
+        因此按拼接后的输入 token 长度把提示词分组，只有 token 数完全相同的提示词（如只差一个等长语种名）才会合成一批；
+        带或不带“不进行文本规整”等长度不同的提示词落在不同分组，各自解码。
+        返回 (文本列表, token 数列表, 耗时, 音频时长)，顺序与 prompts 一致，各提示词的结束原因见 last_stop_reasons。
+        """
+        audio_embed, audio_duration = self._encode_audio(audio_path)
+
+        start = time.time()
+        groups = defaultdict(list)
+        for idx, prompt in enumerate(prompts):
+            concat, prefix_state = self._build_decoder_input(audio_embed, prompt)
+            if prefix_state is None:
+                prefix_state = self._empty_prefix_state()
+            groups[(prefix_state['length'], concat.shape[1])].append((idx, concat, prefix_state))
+
+        texts = [""] * len(prompts)
+        num_tokens = [0] * len(prompts)
+        stop_reasons = [None] * len(prompts)
+        max_tokens = self._token_limit(audio_duration)
+        for group in groups.values():
+            hidden = np.concatenate([concat for _, concat, _ in group], axis=0)
+            batch_state = self._stack_prefix_states([state for _, _, state in group])
+            generated, reasons = self._decode_batch(hidden, batch_state, max_tokens)
+            for (idx, _, _), token_ids, reason in zip(group, generated, reasons):
+                num_tokens[idx] = len(token_ids)
+                stop_reasons[idx] = reason
+                if token_ids:
+                    texts[idx] = self.tokenizer.decode(token_ids, skip_special_tokens=True).strip()
+        elapsed = time.time() - start
+        self._local.stop_reasons = stop_reasons
+        return texts, num_tokens, elapsed, audio_duration
+
+    def _detokenize_incremental(self, token_ids, prefix_offset, read_offset):
+        """
+        增量解码：对比 [prefix_offset, read_offset) 与 [prefix_offset, 末尾) 两段的解码结果，只输出新增文本。
+        末尾是不完整的多字节字符（解码为 U+FFFD）时暂不输出，等后续 token 补全后再一起输出。
+        """
+        prefix_text = self.tokenizer.decode(token_ids[prefix_offset:read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(token_ids[prefix_offset:], skip_special_tokens=True)
+        if len(new_text) > len(prefix_text) and not new_text.endswith('\ufffd'):
+            return new_text[len(prefix_text):], read_offset, len(token_ids)
+        return '', prefix_offset, read_offset
+
+    def transcribe(self, audio_path, prompt):
+        """返回 (文本, token 数, 耗时, 音频时长)；结束原因见 last_stop_reason（取值见 _accept_token，正常结束为 'stop_token'）"""
+        audio_embed, audio_duration = self._encode_audio(audio_path)
+
+        start = time.time()
+        concat, prefix_state = self._build_decoder_input(audio_embed, prompt)
+        token_ids = self._decode(concat, concat.shape[1], prefix_state, self._token_limit(audio_duration))
+        elapsed = time.time() - start
+
+        if token_ids:
+            text = self.tokenizer.decode(token_ids, skip_special_tokens=True).strip()
+        else:
+            text = ""
+        return text, len(token_ids), elapsed, audio_duration
+
+    def transcribe_stream(self, audio_path, prompt):
+        """
+        流式转写：边生成边产出增量文本
+
+        每次产出 {'delta': 新增文本, 'text': 当前完整文本, 'finished': False}；
+        结束时产出 {'text': 最终文本, 'finished': True, 'num_tokens', 'ttft', 'inter_token_latency',
+        'audio_duration', 'stop_reason'}，其中 ttft 为从开始处理音频到产出首段文本的耗时（秒），
+        inter_token_latency 为相邻 token 间的平均间隔（秒）。
+        """
+        start = time.time()
+        audio_embed, audio_duration = self._encode_audio(audio_path)
+        concat, prefix_state = self._build_decoder_input(audio_embed, prompt)
+
+        token_ids = []
+        text = ''
+        prefix_offset = read_offset = 0
+        ttft = None
+        token_times = []
+        result = {}
+        for token_id in self._generate(concat, concat.shape[1], prefix_state, self._token_limit(audio_duration),
+                                       result):
+            token_times.append(time.time())
+            token_ids.append(token_id)
+            delta, prefix_offset, read_offset = self._detokenize_incremental(token_ids, prefix_offset, read_offset)
+            if not text:
+                delta = delta.lstrip()
+            if delta:
+                if ttft is None:
+                    ttft = time.time() - start
+                text += delta
+                yield {'delta': delta, 'text': text, 'finished': False}
+
+        intervals = np.diff(token_times) if len(token_times) > 1 else np.zeros(0)
+        yield {
+            'text': text.strip(),
+            'finished': True,
+            'num_tokens': len(token_ids),
+            'ttft': ttft if ttft is not None else time.time() - start,
+            'inter_token_latency': float(intervals.mean()) if intervals.size else 0.0,
+            'audio_duration': audio_duration,
+            'stop_reason': result['stop_reason'],
+        }
+
+
+class CohortBatchScheduler:
+    """
+    Fun-ASR-Nano LLM decoder 的并发解码调度器
+
+    请求先在预填充线程中完成音频编码，解码线程在每一步之间接纳就绪的请求：提示词前缀长度与输入长度都相同的请求
+    合成一个批次（cohort）预填充，此后它们的 KV 长度始终一致，整批共用一个 KVCacheManager 逐步解码；
+    序列遇到 stop token、检测到重复循环或达到生成长度上限后立即离开，批次随之收缩，不阻塞其他序列。
+
+    这不是真正的连续批处理：导出的 decoder 中 history_len / attention_mask 是整批共用的标量，没有逐行的注意力掩码，
+    KV 长度不同的序列无法拼进同一次 decoder 调用，要做到这一点需要重新导出带逐行 history_len 与掩码的 decoder。
+    因此每个批次每步各自运行一次 decoder，时长各异的请求各成一批，聚合吞吐不会随并发数增长，
+    调度器只提供并发提交、预填充与解码的重叠，以及等长请求（如等长切分的音频片段）的合批。
+    解码线程中的任何异常只会让受影响的请求以该异常结束，不会使线程退出。
+    """
+
+    def __init__(self, asr, max_active=8, num_prefill_workers=1):
+        self.asr = asr
+        self.max_active = max_active
+        self.prefill_pool = ThreadPoolExecutor(max_workers=num_prefill_workers)
+        self.ready = queue.Queue()
+        self.cohorts = []
+        self.stopped = False
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        self.stats = {'tokens': 0, 'decoder_calls': 0, 'batched_rows': 0, 'start': None}
+        self.thread = threading.Thread(target=self._loop, name='llm-decode-loop', daemon=True)
+        self.thread.start()
+
+    def submit(self, audio_path, prompt):
+        """
+        提交一条转写请求，返回 Future，结果与 transcribe 相同：(text, num_tokens, elapsed, audio_duration)，
+        结束原因见 future.stop_reason
+        """
+        future = Future()
+        with self.pending_lock:
+            self.pending += 1
+            if self.stats['start'] is None:
+                self.stats['start'] = time.time()
+        self.prefill_pool.submit(self._encode_request, audio_path, prompt, future, time.time())
+        return future
+
+    def close(self):
+        """等待所有请求完成后停止调度器"""
+        self.stopped = True
+        self.thread.join()
+        self.prefill_pool.shutdown()
+
+    def throughput(self):
+        """聚合吞吐：生成 token 总数 / 总耗时"""
+        elapsed = time.time() - self.stats['start'] if self.stats['start'] else 0.0
+        calls = max(self.stats['decoder_calls'], 1)
+        return {
+            'tokens': self.stats['tokens'],
+            'tokens_per_second': self.stats['tokens'] / elapsed if elapsed > 0 else 0.0,
+            'avg_batch_size': self.stats['batched_rows'] / calls,
+        }
+
+    def _num_active(self):
+        return sum(len(cohort['seqs']) for cohort in self.cohorts)
+
+    def _encode_request(self, audio_path, prompt, future, submit_time):
+        """预填充线程：编码音频并取得提示词前缀 KV 状态，放入就绪队列等待解码线程合批预填充"""
+        asr = self.asr
+        try:
+            audio_embed, audio_duration = asr._encode_audio(audio_path)
+            if asr.use_prefix_cache:
+                prefix_state = asr._get_prompt_prefix_state(prompt)
+                hidden = np.concatenate([audio_embed, asr.assistant_prefix_embed], axis=1)
+            else:
+                prefix_state = asr._empty_prefix_state()
+                hidden = np.concatenate([asr.system_embed, asr.user_prefix_embed, asr._encode_prompt(prompt),
+                                         audio_embed, asr.assistant_prefix_embed], axis=1)
+            self.ready.put({
+                'future': future,
+                'submit_time': submit_time,
+                'audio_duration': audio_duration,
+                'prefix_state': prefix_state,
+                'hidden': hidden,
+            })
+        except Exception as e:
+            self._fail([{'future': future}], e)
+
+    def _admit(self, requests):
+        """前缀长度与输入长度都相同的请求合成一个批次，在同一个 KVCacheManager 中预填充"""
+        asr = self.asr
+        num_layers = asr.num_layers
+        groups = defaultdict(list)
+        for request in requests:
+            groups[(request['prefix_state']['length'], request['hidden'].shape[1])].append(request)
+
+        for (prefix_len, hidden_len), group in groups.items():
+            seqs = [{
+                'future': request['future'],
+                'submit_time': request['submit_time'],
+                'audio_duration': request['audio_duration'],
+                'generated': [],
+                'max_tokens': asr._token_limit(request['audio_duration']),
+                'detector': asr._new_loop_detector(),
+                'penalty': asr._new_penalty(1),
+            } for request in group]
+            kv_cache = asr.kv_pool.acquire()
+            try:
+                batch_state = {
+                    'keys': [np.concatenate([r['prefix_state']['keys'][i] for r in group], axis=0)
+                             for i in range(num_layers)],
+                    'values': [np.concatenate([r['prefix_state']['values'][i] for r in group], axis=0)
+                               for i in range(num_layers)],
+                    'length': prefix_len,
+                }
+                hidden = np.concatenate([r['hidden'] for r in group], axis=0)
+                kv_cache.reset(batch_state, prefix_len + hidden_len + max(seq['max_tokens'] for seq in seqs))
+                logits = kv_cache.step(hidden, attention_mask=1,
+                                       feeds=asr._decoder_feeds([seq['penalty'].rows[0] for seq in seqs]))
+            except Exception as e:
+                asr.kv_pool.release(kv_cache)
+                self._fail(group, e)
+                continue
+            self.cohorts.append({'kv_cache': kv_cache, 'seqs': seqs, 'logits': logits})
+
+    def _release(self, cohort):
+        if cohort['kv_cache'] is not None:
+            self.asr.kv_pool.release(cohort['kv_cache'])
+            cohort['kv_cache'] = None
+
+    def _finish(self, seq, stop_reason):
+        asr = self.asr
+        token_ids = seq['generated']
+        text = asr.tokenizer.decode(token_ids, skip_special_tokens=True).strip() if token_ids else ""
+        seq['future'].stop_reason = stop_reason
+        seq['future'].set_result((text, len(token_ids), time.time() - seq['submit_time'], seq['audio_duration']))
+        with self.pending_lock:
+            self.pending -= 1
+
+    def _fail(self, requests, error):
+        """以异常结束一组请求，已经有结果的 Future 跳过，保证每条请求只计数一次"""
+        for request in requests:
+            future = request['future']
+            if future.done():
+                continue
+            future.set_exception(error)
+            with self.pending_lock:
+                self.pending -= 1
+
+    def _loop(self):
+        while True:
+            requests = []
+            try:
+                if not self._step(requests):
+                    return
+            except Exception as e:
+                # 接纳、预填充、_finish 等任一环节出错都不能让解码线程退出，否则未完成的 Future 永远等待
+                self._fail([seq for cohort in self.cohorts for seq in cohort['seqs']] + requests, e)
+                for cohort in self.cohorts:
+                    self._release(cohort)
+                self.cohorts = []
+
+    def _step(self, requests):
+        """
+        解码线程的一步：接纳就绪请求并为所有活动序列各生成一个 token。
+        接纳的请求追加到 requests 中，出错时由 _loop 一并结束；调度器已停止且没有待处理请求时返回 False
+        """
+        # 在步边界接纳已完成音频编码的请求（合批预填充）
+        num_active = self._num_active()
+        while num_active + len(requests) < self.max_active:
+            try:
+                requests.append(self.ready.get_nowait())
+            except queue.Empty:
+                break
+        if not self.cohorts and not requests:
+            with self.pending_lock:
+                idle = self.pending == 0
+            if self.stopped and idle:
+                return False
+            try:
+                requests.append(self.ready.get(timeout=0.01))
+            except queue.Empty:
+                return True
+        if requests:
+            self._admit(requests)
+
+        # 每个批次各运行一次 decoder，出错的批次只结束自己的请求
+        running = []
+        for cohort in self.cohorts:
+            try:
+                if self._step_cohort(cohort):
+                    running.append(cohort)
+                    continue
+            except Exception as e:
+                self._fail(cohort['seqs'], e)
+            self._release(cohort)
+        self.cohorts = running
+        return True
+
+    def _step_cohort(self, cohort):
+        """
+        为批次中每个序列选出下一个 token，结束的序列离开批次（KV 缓冲区按行收缩），
+        其余序列在预分配的 KV 缓冲区上运行一步 decoder；批次中没有剩余序列时返回 False
+        """
+        asr = self.asr
+        keep = []
+        for row, seq in enumerate(cohort['seqs']):
+            token_id = int(asr._select_tokens(cohort['logits'][row:row + 1], seq['penalty'])[0])
+            if token_id in asr.stop_tokens:
+                self._finish(seq, 'stop_token')
+                continue
+            reason = asr._accept_token(token_id, seq['generated'], seq['penalty'], 0, seq['detector'],
+                                       seq['max_tokens'])
+            self.stats['tokens'] += 1
+            if reason is not None:
+                self._finish(seq, reason)
+                continue
+            keep.append(row)
+        if not keep:
+            return False
+
+        seqs = [cohort['seqs'][row] for row in keep]
+        cohort['seqs'] = seqs
+        kv_cache = cohort['kv_cache']
+        kv_cache.select_rows(keep)
+        token_ids = np.array([[seq['generated'][-1]] for seq in seqs], dtype=np.int64)
+        cohort['logits'] = kv_cache.step(asr._embed(token_ids), attention_mask=0,
+                                         feeds=asr._decoder_feeds([seq['penalty'].rows[0] for seq in seqs]))
+        self.stats['decoder_calls'] += 1
+        self.stats['batched_rows'] += len(seqs)
+        return True
+
 
 if __name__ == "__main__":
     # 请将以下路径替换为实际的模型路径
@@ -222,9 +1221,49 @@ if __name__ == "__main__":
     for idx, (path, prompt) in enumerate(zip(test_audio, prompts)):
         print(f"\n--- 测试 {idx+1}: {path} ---")
         text, num_tokens, elapsed, audio_len = asr.transcribe(path, prompt)
+        stop_reason = asr.last_stop_reason
         if text:
             print(f"音频时长: {audio_len:.2f}s")
             print(f"转写结果: {text}")
-            print(f"生成 {num_tokens} tokens, 耗时 {elapsed:.2f}s, RTF={elapsed/audio_len:.3f}")
+            print(f"生成 {num_tokens} tokens, 耗时 {elapsed:.2f}s, RTF={elapsed/audio_len:.3f}, 结束原因: {stop_reason}")
+            kv_report = asr.last_kv_report
+            print(f"KV 写入 {kv_report['kv_bytes_per_step'] / 1024:.1f} KB/步, "
+                  f"读回主机 {kv_report['host_bytes_per_step'] / 1024:.1f} KB/步")
         else:
-            print("未生成任何文本")
\ No newline at end of file
+            print("未生成任何文本")
+
+    # 同一段音频多提示词：音频只编码一次，各提示词合批解码
+    print(f"\n--- 多提示词转写: {test_audio[1]} ---")
+    texts, num_tokens, elapsed, audio_len = asr.transcribe_multi(test_audio[1], prompts)
+    for lang, text in zip(languages, texts):
+        print(f"[{lang}] {text}")
+    print(f"生成 {sum(num_tokens)} tokens, 耗时 {elapsed:.2f}s")
+
+    # CTC 草稿投机解码：ctc_draft 替换为 fun_asr_nano_ctc_onnx_inference.py 对同一音频的转写结果
+    ctc_draft = '请替换为CTC模型的转写结果'
+    text, num_tokens, elapsed, audio_len = asr.transcribe_speculative(test_audio[0], prompts[0], ctc_draft)
+    print(f"\n--- 投机解码: {test_audio[0]} ---")
+    print(f"转写结果: {text}")
+    print(f"生成 {num_tokens} tokens, decoder 调用 {asr.spec_stats['decoder_calls']} 次, "
+          f"草稿接受 {asr.spec_stats['accepted_tokens']}/{asr.spec_stats['draft_tokens']}")
+    asr.verify_speculative(test_audio[0], prompts[0], ctc_draft)
+
+    # 流式转写：逐段输出增量文本
+    print(f"\n--- 流式转写: {test_audio[0]} ---")
+    for event in asr.transcribe_stream(test_audio[0], prompts[0]):
+        if not event['finished']:
+            print(event['delta'], end='', flush=True)
+        else:
+            print(f"\n首字延迟 {event['ttft'] * 1000:.0f}ms, "
+                  f"平均 token 间隔 {event['inter_token_latency'] * 1000:.1f}ms")
+
+    # 并发解码：同时提交全部请求，等长的请求合批，其余请求各自运行 decoder
+    scheduler = CohortBatchScheduler(asr, max_active=8)
+    futures = [scheduler.submit(path, prompt) for path, prompt in zip(test_audio, prompts)]
+    print("\n--- 并发解码 ---")
+    for path, future in zip(test_audio, futures):
+        text, num_tokens, latency, audio_len = future.result()
+        print(f"{path}: {text} ({num_tokens} tokens, 延迟 {latency:.2f}s)")
+    scheduler.close()
+    report = scheduler.throughput()
+    print(f"聚合吞吐: {report['tokens_per_second']:.1f} tokens/s, 平均批大小 {report['avg_batch_size']:.2f}")
\ No newline at end of file
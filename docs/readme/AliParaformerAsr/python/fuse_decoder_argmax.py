@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+decoder 输出融合工具：在 decoder ONNX 图的 logits 之后追加 重复惩罚 + ArgMax（可选 TopK），
+每步只输出选中的 token id（或 top-k 的 id 与分数），不再把整个词表的 logits 拷回主机再做 argmax。
+
+用法：
+    # Fun-ASR-Nano LLM decoder（带重复惩罚输入）
+    python fuse_decoder_argmax.py --input decoder.int8.onnx --output decoder.argmax.int8.onnx --penalty
+    # FireRedASR decoder（fireredasr-aed 的 logits 输出名为 output，fireredasr2-aed 为 logits）
+    python fuse_decoder_argmax.py --input decoder.int8.onnx --output decoder.argmax.int8.onnx --logits-name output
+    python fuse_decoder_argmax.py --input decoder.int8.onnx --output decoder.argmax.int8.onnx --logits-name logits
+    # 附带 top-5 的 id 与分数便于调试（会使 logits 之后的输出索引后移，见下）
+    python fuse_decoder_argmax.py --input decoder.int8.onnx --output decoder.argmax.int8.onnx \\
+        --logits-name output --top-k 5
+
+融合后的图：
+    新增输入（--penalty）:
+        penalty_ids    (B, K) int64    被惩罚的 token id
+        penalty_scale  (B, K) float32  对应 logits 的乘数（repeat_penalty^出现次数）；补齐时重复已有条目即可
+    输出（next_token 替换原 logits 所在位置，其余输出的相对顺序不变）:
+        next_token     (B,)   int64    惩罚后 logits 的 argmax
+        topk_scores / topk_ids (B, k)  --top-k > 0 时紧跟在 next_token 之后插入，
+                                       原 logits 之后的输出索引整体加 2，按索引取 KV 输出的推理代码需相应调整；
+                                       不加 --top-k 时所有输出的索引与原图一致
+    原 logits 的词表大小写入模型元数据 vocab_size。
+"""
+
+import argparse
+
+import onnx
+from onnx import TensorProto, helper
+
+
+def find_logits_output(graph, logits_name=None):
+    """按名称查找 logits 输出；未指定时取最后一维为静态且最大的输出（即词表维）"""
+    if logits_name:
+        for idx, out in enumerate(graph.output):
+            if out.name == logits_name:
+                return idx
+        raise ValueError(f"图中没有名为 {logits_name} 的输出: {[out.name for out in graph.output]}")
+
+    best_idx, best_dim = None, 0
+    for idx, out in enumerate(graph.output):
+        dims = out.type.tensor_type.shape.dim
+        if len(dims) in (2, 3) and dims[-1].HasField('dim_value') and dims[-1].dim_value > best_dim:
+            best_idx, best_dim = idx, dims[-1].dim_value
+    if best_idx is None:
+        raise ValueError("无法自动识别 logits 输出，请通过 --logits-name 指定")
+    return best_idx
+
+
+def fuse_argmax(model, logits_name=None, penalty=False, top_k=0, vocab_size=None):
+    graph = model.graph
+    opset = next((op.version for op in model.opset_import if op.domain in ('', 'ai.onnx')), 0)
+    if opset < 11:
+        raise ValueError(f"需要 opset >= 11（ScatterElements / TopK），当前为 {opset}")
+
+    out_idx = find_logits_output(graph, logits_name)
+    logits_info = graph.output[out_idx]
+    logits = logits_info.name
+    elem_type = logits_info.type.tensor_type.elem_type
+    dims = logits_info.type.tensor_type.shape.dim
+    if vocab_size is None and dims[-1].HasField('dim_value'):
+        vocab_size = dims[-1].dim_value
+    batch_dim = dims[0].dim_param or dims[0].dim_value or 'batch'
+
+    nodes = []
+    scores = logits
+    if penalty:
+        if len(dims) != 2:
+            raise ValueError("重复惩罚只支持 (B, V) 形状的 logits")
+        graph.input.extend([
+            helper.make_tensor_value_info('penalty_ids', TensorProto.INT64, [batch_dim, 'num_penalty']),
+            helper.make_tensor_value_info('penalty_scale', elem_type, [batch_dim, 'num_penalty']),
+        ])
+        # ones(B, V) 上按 penalty_ids 写入 penalty_scale，再与 logits 相乘，等价于主机端的 logits * penalty
+        nodes += [
+            helper.make_node('Shape', [logits], ['fused_logits_shape']),
+            helper.make_node('ConstantOfShape', ['fused_logits_shape'], ['fused_penalty_ones'],
+                             value=helper.make_tensor('one', elem_type, [1], [1.0])),
+            helper.make_node('ScatterElements', ['fused_penalty_ones', 'penalty_ids', 'penalty_scale'],
+                             ['fused_penalty'], axis=1),
+            helper.make_node('Mul', [logits, 'fused_penalty'], ['fused_scores']),
+        ]
+        scores = 'fused_scores'
+
+    nodes.append(helper.make_node('ArgMax', [scores], ['next_token'], axis=-1, keepdims=0))
+    new_outputs = [helper.make_tensor_value_info('next_token', TensorProto.INT64, [d.dim_param or d.dim_value
+                                                                                  for d in dims[:-1]])]
+    if top_k > 0:
+        graph.initializer.append(helper.make_tensor('fused_top_k', TensorProto.INT64, [1], [top_k]))
+        nodes.append(helper.make_node('TopK', [scores, 'fused_top_k'], ['topk_scores', 'topk_ids'], axis=-1))
+        topk_shape = [d.dim_param or d.dim_value for d in dims[:-1]] + [top_k]
+        new_outputs += [helper.make_tensor_value_info('topk_scores', elem_type, topk_shape),
+                        helper.make_tensor_value_info('topk_ids', TensorProto.INT64, topk_shape)]
+    graph.node.extend(nodes)
+
+    # 用新输出替换 logits 输出；只有 next_token 时其余输出索引不变，附带 top-k 时其后的输出索引后移
+    outputs = list(graph.output)
+    outputs[out_idx:out_idx + 1] = new_outputs
+    del graph.output[:]
+    graph.output.extend(outputs)
+
+    if vocab_size:
+        helper.set_model_props(model, {**{p.key: p.value for p in model.metadata_props},
+                                       'vocab_size': str(vocab_size)})
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在 decoder ONNX 图中融合重复惩罚与 ArgMax/TopK")
+    parser.add_argument('--input', required=True, help="原 decoder ONNX 路径")
+    parser.add_argument('--output', required=True, help="融合后 ONNX 保存路径")
+    parser.add_argument('--logits-name', default=None, help="logits 输出名，默认自动识别")
+    parser.add_argument('--penalty', action='store_true', help="增加 penalty_ids / penalty_scale 输入")
+    parser.add_argument('--top-k', type=int, default=0, help="额外输出 top-k 的 id 与分数")
+    parser.add_argument('--vocab-size', type=int, default=None, help="logits 最后一维为动态时手动指定词表大小")
+    parser.add_argument('--external-data', action='store_true', help="权重另存为外部数据（模型超过 2GB 时需要）")
+    args = parser.parse_args()
+
+    model = onnx.load(args.input)
+    model = fuse_argmax(model, args.logits_name, args.penalty, args.top_k, args.vocab_size)
+    onnx.save(model, args.output, save_as_external_data=args.external_data)
+    onnx.checker.check_model(args.output)
+    print(f"已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
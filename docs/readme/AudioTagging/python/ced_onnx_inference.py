@@ -1,10 +1,19 @@
-import torch
-import torchaudio
+import math
+import wave
+from functools import lru_cache
 import numpy as np
 import onnxruntime as ort
 from pathlib import Path
 import sys
 
+from log_mel import mel_spectrogram
+
+# 可选：soundfile 支持 flac/ogg/mp3 等格式，未安装时只能读取 PCM WAV
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
 # 音频预处理配置
 SR = 16000  # 采样率
 N_MELS = 64  # mel频谱维度
@@ -41,47 +50,94 @@ class TokenConverter:
         return self.token2id_dict.get(token)
 
 # ===================== 音频预处理 =====================
+@lru_cache(maxsize=None)
+def sinc_resample_kernel(orig_freq, new_freq, lowpass_filter_width=6, rolloff=0.99):
+    """Hann 窗 sinc 插值重采样核 (new_freq, 2 * width + orig_freq)，同 torchaudio.functional.resample 的默认设置"""
+    base_freq = min(orig_freq, new_freq) * rolloff
+    width = math.ceil(lowpass_filter_width * orig_freq / base_freq)
+    idx = np.arange(-width, width + orig_freq, dtype=np.float64)[None, :] / orig_freq
+    t = (np.arange(0, -new_freq, -1, dtype=np.float64)[:, None] / new_freq + idx) * base_freq
+    t = np.clip(t, -lowpass_filter_width, lowpass_filter_width)
+    window = np.cos(t * math.pi / lowpass_filter_width / 2) ** 2
+    t *= math.pi
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kernel = np.where(t == 0, 1.0, np.sin(t) / t)
+    kernel = (kernel * window * base_freq / orig_freq).astype(np.float32)
+    kernel.flags.writeable = False
+    return kernel, width
+
+def resample(waveform, orig_sr, new_sr):
+    """重采样 [..., time] 波形，重采样核按采样率组合缓存"""
+    gcd = math.gcd(int(orig_sr), int(new_sr))
+    orig_freq, new_freq = int(orig_sr) // gcd, int(new_sr) // gcd
+    if orig_freq == new_freq:
+        return waveform
+    kernel, width = sinc_resample_kernel(orig_freq, new_freq)
+    shape = waveform.shape
+    waveform = waveform.reshape(-1, shape[-1]).astype(np.float32)
+    padded = np.pad(waveform, ((0, 0), (width, width + orig_freq)))
+    frames = np.lib.stride_tricks.sliding_window_view(padded, kernel.shape[1], axis=-1)[:, ::orig_freq]
+    resampled = (frames @ kernel.T).reshape(len(waveform), -1)
+    resampled = resampled[:, :math.ceil(new_freq * shape[-1] / orig_freq)]
+    return resampled.reshape(shape[:-1] + resampled.shape[-1:])
+
+def amplitude_to_db(power, top_db=None, amin=1e-10):
+    """功率谱转 dB，同 torchaudio.transforms.AmplitudeToDB(stype="power")；top_db 截断以整个输入的最大值为基准"""
+    mel_db = 10.0 * np.log10(np.maximum(power, amin))
+    if top_db is not None:
+        mel_db = np.maximum(mel_db, mel_db.max() - top_db)
+    return mel_db
+
+def load_audio(audio_path):
+    """读取音频，返回 ([channels, time] float32 波形, 采样率)，取值范围同 torchaudio.load"""
+    if soundfile is not None:
+        data, sr = soundfile.read(str(audio_path), dtype="float32", always_2d=True)
+        return data.T, sr
+    with wave.open(str(audio_path), "rb") as wav_file:
+        sr, channels, sample_width = wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth()
+        raw = wav_file.readframes(wav_file.getnframes())
+    if sample_width == 1:
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 3:
+        # 24bit 小端补成 32bit 整数
+        pcm = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        pcm = np.pad(pcm, ((0, 0), (1, 0))).view("<i4").reshape(-1)
+        data = pcm.astype(np.float32) / 2147483648.0
+    else:
+        dtype = {2: "<i2", 4: "<i4"}[sample_width]
+        data = np.frombuffer(raw, dtype=dtype).astype(np.float32) / float(2 ** (8 * sample_width - 1))
+    return data.reshape(-1, channels).T, sr
+
 def preprocess_audio_to_mel(waveform, sr):
     """
     将音频波形转换为模型所需的 Mel 频谱
     Args:
-        waveform: 音频波形，shape [time] 或 [batch, time]
+        waveform: 音频波形，shape [time] 或 [channels, time]
         sr: 采样率
     Returns:
-        mel_spec: Mel频谱，shape [1, n_mels, target_length]
+        mel_spec: Mel频谱，shape [channels, n_mels, target_length]
     """
     # 统一采样率
+    waveform = np.asarray(waveform, dtype=np.float32)
     if sr != SR:
-        waveform = torchaudio.transforms.Resample(sr, SR)(waveform)
-
-    # 保证是2维（batch, time）
-    if waveform.dim() == 1:
-        waveform = waveform.unsqueeze(0)
-
-    # Mel频谱转换
-    mel_transform = torchaudio.transforms.MelSpectrogram(
-        sample_rate=SR,
-        n_fft=512,
-        hop_length=HOP_LENGTH,
-        win_length=512,
-        n_mels=N_MELS,
-        f_min=0,
-        f_max=8000,
-        power=2.0
-    )
-    amp_to_db = torchaudio.transforms.AmplitudeToDB(top_db=120)
+        waveform = resample(waveform, sr, SR)
 
-    mel = mel_transform(waveform)  # [1, n_mels, time]
-    mel_db = amp_to_db(mel)  # 转换为dB
+    # 保证是2维（channels, time）
+    if waveform.ndim == 1:
+        waveform = waveform[np.newaxis, :]
+
+    # Mel频谱转换：各通道的帧一起做 rFFT，dB 截断以全部通道的最大值为基准
+    mel = np.stack(mel_spectrogram(list(waveform), SR, n_fft=512, hop_length=HOP_LENGTH, win_length=512,
+                                   n_mels=N_MELS, f_min=0, f_max=8000))
+    mel_db = amplitude_to_db(mel, top_db=120)
 
     # 调整时间维度到目标长度（截断/填充）
-    if mel_db.size(-1) > TARGET_LENGTH:
+    if mel_db.shape[-1] > TARGET_LENGTH:
         mel_db = mel_db[..., :TARGET_LENGTH]
-    elif mel_db.size(-1) < TARGET_LENGTH:
-        pad = torch.zeros(mel_db.size(0), N_MELS, TARGET_LENGTH - mel_db.size(-1))
-        mel_db = torch.cat([mel_db, pad], dim=-1)
+    elif mel_db.shape[-1] < TARGET_LENGTH:
+        mel_db = np.pad(mel_db, ((0, 0), (0, 0), (0, TARGET_LENGTH - mel_db.shape[-1])))
 
-    return mel_db
+    return mel_db.astype(np.float32)
 
 # ===================== ONNX模型推理 =====================
 def onnx_inference(onnx_model_path, audio_path, token_converter, top_k=3):
@@ -96,7 +152,7 @@ def onnx_inference(onnx_model_path, audio_path, token_converter, top_k=3):
         topk_results: 包含(标签名称, 概率)的列表
     """
     # 1. 加载音频文件
-    waveform, sr = torchaudio.load(audio_path)
+    waveform, sr = load_audio(audio_path)
     print(f"Loaded audio: {audio_path}, sample rate: {sr}, shape: {waveform.shape}")
 
     # 2. 预处理为Mel频谱
@@ -111,7 +167,7 @@ def onnx_inference(onnx_model_path, audio_path, token_converter, top_k=3):
 
     # 4. 执行推理
     input_name = ort_session.get_inputs()[0].name
-    ort_inputs = {input_name: mel_input.numpy()}
+    ort_inputs = {input_name: mel_input}
     ort_output = ort_session.run(None, ort_inputs)[0]  # [1, num_classes]
 
     # 5. 解析top-k结果（使用TokenConverter映射ID到标签）
@@ -0,0 +1,53 @@
+"""
+numpy 实现的 mel 频谱，与 torchaudio 的 MelSpectrogram 数值一致（float32 误差范围内），不依赖 torch
+AudioTagging/python/ced_onnx_inference.py 与 DolphinAsr/python/dolphin_onnx_opt_inferencer.py 共用，需与脚本放在同一目录
+"""
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def hann_window(win_length, n_fft):
+    """周期 Hann 窗（同 torch.hann_window），win_length < n_fft 时居中补零到 n_fft"""
+    window = np.zeros(n_fft, dtype=np.float64)
+    left = (n_fft - win_length) // 2
+    window[left:left + win_length] = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(win_length) / win_length)
+    window = window.astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+@lru_cache(maxsize=None)
+def mel_filterbank(sample_rate, n_fft, n_mels, f_min, f_max):
+    """HTK 刻度、不归一化的三角 mel 滤波器组 (n_fft // 2 + 1, n_mels)，同 torchaudio.functional.melscale_fbanks"""
+    all_freqs = np.linspace(0, sample_rate // 2, n_fft // 2 + 1)
+    m_min, m_max = (2595.0 * np.log10(1.0 + f / 700.0) for f in (f_min, f_max))
+    f_pts = 700.0 * (10 ** (np.linspace(m_min, m_max, n_mels + 2) / 2595.0) - 1.0)
+    f_diff = f_pts[1:] - f_pts[:-1]
+    slopes = f_pts[None, :] - all_freqs[:, None]
+    down = -slopes[:, :-2] / f_diff[:-1]
+    up = slopes[:, 2:] / f_diff[1:]
+    fbank = np.maximum(0.0, np.minimum(down, up)).astype(np.float32)
+    fbank.flags.writeable = False
+    return fbank
+
+
+def mel_spectrogram(waveforms, sample_rate, n_fft, hop_length, win_length, n_mels, f_min=0.0, f_max=None):
+    """
+    批量计算 mel 功率谱，同 torchaudio.transforms.MelSpectrogram（center=True、reflect 补边、power=2）
+    waveforms: 一维波形列表（长度可以不同），所有帧合并后只做一次 rFFT 和一次矩阵乘
+    返回与输入一一对应的 (n_mels, T) float32 数组列表
+    """
+    window = hann_window(win_length, n_fft)
+    fbank = mel_filterbank(sample_rate, n_fft, n_mels, float(f_min), float(sample_rate // 2 if f_max is None else f_max))
+    frames, counts = [], []
+    for waveform in waveforms:
+        padded = np.pad(np.asarray(waveform, dtype=np.float32), n_fft // 2, mode="reflect")
+        frames.append(np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length])
+        counts.append(len(frames[-1]))
+    frames = np.concatenate(frames)
+    np.multiply(frames, window, out=frames)
+    spectrum = np.fft.rfft(frames, axis=-1)
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    mel = power @ fbank
+    return [part.T for part in np.split(mel, np.cumsum(counts)[:-1])]
@@ -0,0 +1,273 @@
+"""
+dolphin_onnx_inferencer.py 与 dolphin_onnx_opt_inferencer.py 共用的音频读取与束搜索解码，需与这两个脚本放在同一目录
+"""
+import subprocess
+import threading
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# 可选的进程内解码后端，未安装时回退到 ffmpeg
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+try:
+    import av
+except ImportError:
+    av = None
+
+SAMPLE_RATE = 16000
+MAX_DECODE_STEPS = 1000
+AUDIO_WORKERS = 4           # 常驻解码线程数
+AUDIO_PREFETCH = 8          # 批量读取时最多同时预取的文件数
+
+
+class AudioDecoderPool:
+    """
+    音频解码服务：常驻的解码线程 + 有界预取队列，多个文件并发解码
+
+    解码后端按顺序尝试：
+      1. 标准库 wave：16bit PCM WAV 且采样率一致时在进程内直接读取
+      2. soundfile（可选安装）：libsndfile 支持的格式（wav/flac/ogg 等）且采样率一致时在进程内解码
+      3. PyAV（可选安装）：任意编码格式，进程内解码并重采样
+      4. ffmpeg 进程：以上都不可用时才启动，stdout 直接读入每个线程预分配的 int16 缓冲区
+    """
+
+    def __init__(self, num_workers=AUDIO_WORKERS, prefetch=AUDIO_PREFETCH, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.prefetch = max(1, prefetch)
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="audio-decoder")
+        self.local = threading.local()
+        self.stats = {"wave": 0, "soundfile": 0, "av": 0, "ffmpeg": 0}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _from_int16(pcm, channels):
+        """int16 交织数据 -> float32 单声道"""
+        if channels > 1:
+            pcm = pcm[:len(pcm) // channels * channels].reshape(-1, channels).mean(axis=1)
+        samples = np.empty(len(pcm), dtype=np.float32)
+        np.multiply(pcm, 1.0 / 32768.0, out=samples, casting="unsafe")
+        return samples
+
+    def _decode_wave(self, path):
+        if not str(path).lower().endswith(".wav"):
+            return None
+        try:
+            wav_file = wave.open(str(path), "rb")
+        except (wave.Error, EOFError):
+            return None  # 非 PCM 编码（如 float / A-law）交给其他后端
+        with wav_file:
+            if wav_file.getsampwidth() != 2 or wav_file.getframerate() != self.sample_rate:
+                return None
+            channels = wav_file.getnchannels()
+            pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2")
+        return self._from_int16(pcm, channels)
+
+    def _decode_soundfile(self, path):
+        if soundfile is None:
+            return None
+        try:
+            with soundfile.SoundFile(str(path)) as sound_file:
+                if sound_file.samplerate != self.sample_rate:
+                    return None
+                data = sound_file.read(dtype="float32")
+        except RuntimeError:
+            return None  # libsndfile 不支持的格式
+        return data if data.ndim == 1 else data.mean(axis=1, dtype=np.float32)
+
+    def _decode_av(self, path):
+        if av is None:
+            return None
+        try:
+            chunks = []
+            with av.open(str(path)) as container:
+                resampler = av.AudioResampler(format="s16", layout="mono", rate=self.sample_rate)
+                for frame in container.decode(audio=0):
+                    chunks.extend(f.to_ndarray().reshape(-1) for f in resampler.resample(frame))
+                chunks.extend(f.to_ndarray().reshape(-1) for f in resampler.resample(None))
+        except (OSError, ValueError, IndexError):
+            return None  # 无法打开或没有音频流，交给 ffmpeg 报出具体错误
+        pcm = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+        return self._from_int16(pcm, 1)
+
+    def _pcm_buffer(self, num_bytes):
+        """每个解码线程复用的 int16 缓冲区，按需倍增"""
+        buffer = getattr(self.local, "pcm", None)
+        if buffer is None or buffer.nbytes < num_bytes:
+            new_buffer = np.empty(max(num_bytes // 2, int(self.sample_rate * 30)), dtype=np.int16)
+            if buffer is not None:
+                new_buffer[:len(buffer)] = buffer
+            self.local.pcm = buffer = new_buffer
+        return buffer
+
+    def _decode_ffmpeg(self, path):
+        cmd = [
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", str(path),
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le",
+            "-ar", str(self.sample_rate), "-"
+        ]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        num_bytes = 0
+        buffer = self._pcm_buffer(0)
+        while True:
+            if num_bytes == buffer.nbytes:
+                buffer = self._pcm_buffer(buffer.nbytes * 2)
+            num_read = proc.stdout.readinto(memoryview(buffer.view(np.uint8))[num_bytes:])
+            if not num_read:
+                break
+            num_bytes += num_read
+        stderr = proc.stderr.read()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+        return self._from_int16(buffer[:num_bytes // 2], 1)
+
+    def decode(self, path):
+        """解码单个文件，返回 float32 单声道波形"""
+        for name, backend in (("wave", self._decode_wave), ("soundfile", self._decode_soundfile),
+                              ("av", self._decode_av), ("ffmpeg", self._decode_ffmpeg)):
+            samples = backend(path)
+            if samples is not None:
+                self.stats[name] += 1
+                return samples
+
+    def imap(self, paths):
+        """按输入顺序逐个返回解码结果，最多同时预取 prefetch 个文件"""
+        pending = deque()
+        for path in paths:
+            pending.append(self.executor.submit(self.decode, path))
+            if len(pending) >= self.prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def map(self, paths):
+        return list(self.imap(paths))
+
+
+_audio_pool = None
+_audio_pool_lock = threading.Lock()
+
+
+def get_audio_pool():
+    """进程内共享的音频解码服务，首次使用时创建"""
+    global _audio_pool
+    with _audio_pool_lock:
+        if _audio_pool is None:
+            _audio_pool = AudioDecoderPool()
+        return _audio_pool
+
+
+def load_audio(file_path):
+    """解码音频为 16k 单声道 float32 波形"""
+    return get_audio_pool().decode(file_path)
+
+
+
+
+def log_softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def beam_search(decoder_session, input_names, enc_out, prompts, beam_size, eos_id, max_steps=MAX_DECODE_STEPS):
+    """
+    批量束搜索，decoder_session 的输入依次为 (enc_out, ys)，input_names 为对应的输入名。
+    B 条语音 × beam_size 个候选堆叠在解码器的 batch 维上，每步一次解码器调用。
+    所有行共用一个预分配的 hyp 缓冲区，每行单独记录长度与是否已输出 EOS；
+    一条语音的最优已结束候选不劣于所有未结束候选时（分数只会下降）即停止，
+    之后不再把它的行送入解码器。解码器调用次数只取决于最长的假设。
+    返回 (每条语音的 token id 列表, 分数, 解码器调用次数)
+    """
+    batch_size, prompt_len = len(prompts), len(prompts[0])
+    num_rows = batch_size * beam_size
+    hyp = np.full((num_rows, max_steps), eos_id, dtype=np.int64)
+    hyp[:, :prompt_len] = np.repeat(np.array(prompts, dtype=np.int64), beam_size, axis=0)
+    lengths = np.full(num_rows, prompt_len, dtype=np.int64)
+    finished = np.zeros(num_rows, dtype=bool)
+    # 第一步所有候选相同，只从每条语音的第 0 个候选扩展
+    scores = np.full((batch_size, beam_size), -np.inf, dtype=np.float64)
+    scores[:, 0] = 0.0
+    done = np.zeros(batch_size, dtype=bool)
+
+    enc_rows = np.repeat(enc_out, beam_size, axis=0)
+    active_key, active_enc = None, enc_rows
+    current_len, num_calls = prompt_len, 0
+    while current_len < max_steps and not done.all():
+        active = np.flatnonzero(~done)
+        rows = (active[:, None] * beam_size + np.arange(beam_size)).reshape(-1)
+        # 活跃语音集合变化时才重新收集对应的 enc_out 行
+        if active_key != len(active):
+            active_key = len(active)
+            active_enc = enc_rows if len(active) == batch_size else enc_rows[rows]
+
+        logits = decoder_session.run(None, {
+            input_names[0]: active_enc,
+            input_names[1]: hyp[rows, :current_len]
+        })[0]
+        num_calls += 1
+        if logits.ndim == 3:
+            logits = logits[:, -1]
+        log_probs = log_softmax(logits.astype(np.float64))
+        # 已结束的候选只能继续输出 EOS 且不改变分数
+        log_probs[finished[rows]] = -np.inf
+        log_probs[finished[rows], eos_id] = 0.0
+
+        vocab_size = log_probs.shape[-1]
+        cand = (scores[active].reshape(-1, 1) + log_probs).reshape(len(active), beam_size * vocab_size)
+        top = np.argpartition(-cand, beam_size - 1, axis=1)[:, :beam_size]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(cand, top, axis=1), axis=1), axis=1)
+        src_rows = (active[:, None] * beam_size + top // vocab_size).reshape(-1)
+        tokens = (top % vocab_size).reshape(-1)
+
+        hyp[rows, :current_len] = hyp[src_rows, :current_len]
+        hyp[rows, current_len] = tokens
+        prev_finished = finished[src_rows]
+        lengths[rows] = np.where(prev_finished, lengths[src_rows], current_len + 1)
+        finished[rows] = prev_finished | (tokens == eos_id)
+        scores[active] = np.take_along_axis(cand, top, axis=1)
+        current_len += 1
+
+        row_finished = finished[rows].reshape(len(active), beam_size)
+        row_scores = scores[active]
+        best_finished = np.where(row_finished, row_scores, -np.inf).max(axis=1)
+        best_alive = np.where(row_finished, -np.inf, row_scores).max(axis=1)
+        done[active] = row_finished.all(axis=1) | (best_finished >= best_alive)
+
+    results, best_scores = [], []
+    for b in range(batch_size):
+        beam_rows = np.arange(b * beam_size, (b + 1) * beam_size)
+        candidates = beam_rows[finished[beam_rows]] if finished[beam_rows].any() else beam_rows
+        best = candidates[np.argmax(scores[b, candidates - b * beam_size])]
+        results.append(hyp[best, :lengths[best]].tolist())
+        best_scores.append(float(scores[b, best - b * beam_size]))
+    return results, best_scores, num_calls
+
+
+def beam_search_by_length(decoder_session, input_names, enc_out, valid_frames, prompts, beam_size, eos_id,
+                          max_steps=MAX_DECODE_STEPS):
+    """
+    解码器没有 memory mask，补齐帧会进入交叉注意力。按有效编码帧数把语音分组，
+    每组截到自己的有效长度后分别做 beam_search，结果与逐条 decode 一致；
+    长度相同的语音（及每条语音的 beam_size 个候选）仍在同一次解码器调用中合批。返回值同 beam_search
+    """
+    hyps, scores, num_calls = [None] * len(prompts), [None] * len(prompts), 0
+    for frames in np.unique(valid_frames):
+        rows = np.flatnonzero(valid_frames == frames)
+        group_hyps, group_scores, calls = beam_search(
+            decoder_session, input_names, enc_out[rows, :int(frames)], [prompts[row] for row in rows], beam_size,
+            eos_id, max_steps)
+        num_calls += calls
+        for row, ids, score in zip(rows, group_hyps, group_scores):
+            hyps[row], scores[row] = ids, score
+    return hyps, scores, num_calls
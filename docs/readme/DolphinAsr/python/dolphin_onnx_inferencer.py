@@ -1,14 +1,32 @@
+import math
+import re
 import numpy as np
 import onnxruntime as ort
 import time
 import onnx
 
+from dolphin_common import beam_search_by_length, get_audio_pool, load_audio
+
 # 配置
 SAMPLE_RATE = 16000  
 SPEECH_LENGTH = 30
 MAX_DECODE_STEPS = 1000
 CPU_THREADS = 1
 
+# 动态长度：按实际时长向上取整到最近的分桶（秒）再补齐，而不是一律补齐到 SPEECH_LENGTH
+# 分桶数量少，onnxruntime 对每种输入形状的内存规划可以复用
+DYNAMIC_LENGTH = False
+LENGTH_BUCKETS = (2, 4, 8, 16, SPEECH_LENGTH)
+RUN_BENCHMARK = False
+VERIFY_BATCH = False        # 截取不同时长的音频，校验 decode_batch（beam_size=1）与逐条 decode 结果一致
+BEAM_SIZE = 5               # decode_batch 的束宽，1 等价于贪婪解码
+
+BENCHMARK_DURATIONS = (2, 5, 10, 20, 30)
+
+# 长音频：按 SPEECH_LENGTH 秒的窗口切分，相邻窗口重叠 LONG_FORM_OVERLAP 秒，窗口成批编码与解码
+LONG_FORM_OVERLAP = 5
+LONG_FORM_BATCH_SIZE = 16   # 每批最多窗口数（编码器显存/内存上限）
+
 class TokenConverter:
     def __init__(self, token_file_path):
         self.token2id_dict = {}
@@ -28,30 +46,177 @@ class TokenConverter:
         return self.token2id_dict.get(token)
 
 # 音频预处理
-def load_audio(file_path):
-    import subprocess
-    import numpy as np
+def bucket_length(num_samples):
+    """返回不小于 num_samples 的最小分桶长度（采样点数），超过最大分桶时取最大分桶"""
+    for seconds in sorted(LENGTH_BUCKETS):
+        if num_samples <= seconds * SAMPLE_RATE:
+            return int(seconds * SAMPLE_RATE)
+    return int(SAMPLE_RATE * SPEECH_LENGTH)
+
+
+def pad_speech(raw_waveform, dynamic_length=DYNAMIC_LENGTH, return_num_samples=False):
+    """
+    截断/补齐波形，返回 (1, N) 的 speech 与 (1,) 的 speech_lengths
+    dynamic_length=False 时补齐到 SPEECH_LENGTH 秒，speech_lengths 为补齐后的长度（原行为）；
+    dynamic_length=True 时只补齐到分桶长度，speech_lengths 为真实长度
+    return_num_samples=True 时额外返回 (1,) 的补齐前采样点数，传给 decode / decode_batch 的 num_samples 用于计算 RTF
+    """
+    max_length = int(SAMPLE_RATE * SPEECH_LENGTH)
+    raw_waveform = raw_waveform[:max_length]
+    target_length = bucket_length(len(raw_waveform)) if dynamic_length else max_length
+
+    speech = np.pad(raw_waveform, (0, target_length - len(raw_waveform)))
+    speech_length = len(raw_waveform) if dynamic_length else target_length
+    speech, speech_lengths = speech.reshape(1, -1), np.array([speech_length], dtype=np.int64)
+    if return_num_samples:
+        return speech, speech_lengths, np.array([len(raw_waveform)], dtype=np.int64)
+    return speech, speech_lengths
+
+
+def preprocess_audio(audio_path, dynamic_length=DYNAMIC_LENGTH, return_num_samples=False):
+    return pad_speech(load_audio(audio_path), dynamic_length, return_num_samples)
+
+
+def stack_speech(padded):
+    """
+    pad_speech 的结果列表补齐到同一长度，返回 (B, N) 的 speech 与 (B,) 的 speech_lengths；
+    各项带有补齐前采样点数（return_num_samples=True）时额外返回 (B,) 的 num_samples
+    """
+    target_length = max(item[0].shape[1] for item in padded)
+    speech_np = np.zeros((len(padded), target_length), dtype=np.float32)
+    for row, item in enumerate(padded):
+        speech_np[row, :item[0].shape[1]] = item[0][0]
+    stacked = (speech_np, np.concatenate([item[1] for item in padded]))
+    if all(len(item) == 3 for item in padded):
+        stacked += (np.concatenate([item[2] for item in padded]),)
+    return stacked
+
+
+def preprocess_batch(audio_paths, dynamic_length=DYNAMIC_LENGTH, return_num_samples=False):
+    """多条音频补齐到同一长度，返回 (B, N) 的 speech 与 (B,) 的 speech_lengths（以及可选的 num_samples）"""
+    return stack_speech([pad_speech(waveform, dynamic_length, return_num_samples)
+                         for waveform in get_audio_pool().imap(audio_paths)])
+
+
+def split_long_audio(raw_waveform, overlap=LONG_FORM_OVERLAP):
+    """
+    按 SPEECH_LENGTH 秒的窗口切分长音频，相邻窗口重叠 overlap 秒，最后一个窗口可以较短
+    返回 [(窗口波形, 起始秒, 结束秒)]
+    """
+    window = int(SAMPLE_RATE * SPEECH_LENGTH)
+    stride = window - int(SAMPLE_RATE * overlap)
+    assert stride > 0, "LONG_FORM_OVERLAP 必须小于 SPEECH_LENGTH"
+    starts = [0]
+    while starts[-1] + window < len(raw_waveform):
+        starts.append(starts[-1] + stride)
+    return [(raw_waveform[start:start + window], start / SAMPLE_RATE,
+             min(start + window, len(raw_waveform)) / SAMPLE_RATE) for start in starts]
+
+
+TIMESTAMP_PATTERN = re.compile(r"^<(\d+(?:\.\d+)?)>$")
+
+
+def parse_segments(tokens):
+    """
+    把一个窗口的输出 token 按时间戳 token（如 <1.24>）切分为片段 [起始秒, 结束秒, 文本 token 列表]
+    起止时间为窗口内的相对时间；没有时间戳时起始为 None，未闭合的片段结束为 None；其他特殊 token 丢弃
+    """
+    segments, current = [], None
+    for token in tokens:
+        match = TIMESTAMP_PATTERN.match(token)
+        if match:
+            stamp = float(match.group(1))
+            if current is None:
+                current = [stamp, None, []]
+            elif current[2]:
+                current[1] = stamp
+                segments.append(current)
+                current = None
+            else:
+                current[0] = stamp  # 连续的时间戳取后一个作为起点
+        elif len(token) > 1 and token.startswith("<") and token.endswith(">"):
+            continue
+        else:
+            if current is None:
+                current = [None, None, []]
+            current[2].append(token)
+    if current is not None and current[2]:
+        segments.append(current)
+    return segments
+
+
+def align_overlap(prev_tokens, next_tokens):
+    """
+    无时间戳时按 token 对齐两个窗口的重叠部分：枚举重叠长度 k，比较前一窗口末尾 k 个与后一窗口开头 k 个 token，
+    取相同位置匹配比例最高者（至少匹配 2 个且不低于一半）。返回 (前一窗口保留的 token 数, 后一窗口跳过的 token 数)，
+    重叠部分前一半取前一窗口、后一半取后一窗口
+    """
+    best_score, best_k = 0.0, 0
+    for k in range(1, min(len(prev_tokens), len(next_tokens)) + 1):
+        matches = sum(a == b for a, b in zip(prev_tokens[-k:], next_tokens[:k]))
+        score = matches / k + k * 1e-4
+        if matches > 1 and matches * 2 >= k and score > best_score:
+            best_score, best_k = score, k
+    return len(prev_tokens) - best_k + best_k // 2, best_k // 2
+
+
+def merge_window_segments(window_segments, spans):
+    """
+    合并各窗口的片段，时间换算为全局时间
+    有时间戳时：前一窗口保留在重叠区中点之前开始的片段，后一窗口只保留在前一窗口最后保留片段结束之后开始的片段；
+    前一窗口末尾被窗口截断（未闭合）的片段只有开头部分：起点落在后一窗口内时由后一窗口的完整片段替换，
+    否则与后一窗口中的续段拼接（见 _splice_segment）；
+    无时间戳时按 align_overlap 的 token 对齐去掉重复部分
+    """
+    merged = []
+    for idx, (segments, (start, end)) in enumerate(zip(window_segments, spans)):
+        timed = all(seg[0] is not None for seg in segments)
+        # 片段为 [全局起点, 全局终点, token 列表, 窗口是否带时间戳, 是否未闭合]
+        segments = [[start + (seg[0] or 0.0), end if seg[1] is None else start + seg[1], list(seg[2]), timed,
+                     seg[1] is None] for seg in segments]
+        if idx > 0 and merged and segments:
+            prev_start, prev_end = spans[idx - 1]
+            if timed and merged[-1][3]:
+                cut = (start + prev_end) / 2
+                while merged and merged[-1][0] >= cut:
+                    merged.pop()
+                if merged and merged[-1][4] and segments[0][0] < prev_end:
+                    head = merged.pop()
+                    if head[0] < start:
+                        segments[0] = _splice_segment(head, segments[0])
+                last_end = merged[-1][1] if merged else start
+                segments = [seg for seg in segments if seg[0] >= last_end - 0.1]
+            else:
+                prev_tokens = [token for seg in merged for token in seg[2]]
+                next_tokens = [token for seg in segments for token in seg[2]]
+                keep, skip = align_overlap(prev_tokens, next_tokens)
+                _drop_tokens(merged, len(prev_tokens) - keep, from_end=True)
+                _drop_tokens(segments, skip, from_end=False)
+        merged.extend(segments)
+    return [(seg[0], seg[1], seg[2]) for seg in merged]
+
+
+def _splice_segment(head, tail):
+    """
+    拼接跨越窗口边界的片段：head 为前一窗口中被截断的开头，tail 为后一窗口中的续段，两者在重叠区有重复的 token。
+    优先按 align_overlap 对齐去重；对不齐时按 tail 起点在 head 时间范围内的位置估计 head 保留的 token 数
+    """
+    keep, skip = align_overlap(head[2], tail[2])
+    if keep == len(head[2]) and skip == 0:
+        keep = round(len(head[2]) * (tail[0] - head[0]) / max(head[1] - head[0], 1e-6))
+    return [head[0], tail[1], head[2][:keep] + tail[2][skip:], tail[3], tail[4]]
+
+
+def _drop_tokens(segments, count, from_end):
+    """从片段列表的末尾/开头删除 count 个文本 token，删空的片段一并移除"""
+    while count > 0 and segments:
+        seg = segments[-1] if from_end else segments[0]
+        removed = min(count, len(seg[2]))
+        seg[2] = seg[2][:len(seg[2]) - removed] if from_end else seg[2][removed:]
+        count -= removed
+        if not seg[2]:
+            segments.pop(-1 if from_end else 0)
 
-    cmd = [
-        "ffmpeg", "-nostdin", "-threads", "0", "-i", file_path,
-        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le",
-        "-ar", str(SAMPLE_RATE), "-"
-    ]
-
-    out = subprocess.run(cmd, capture_output=True, check=True).stdout
-    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
-
-
-def preprocess_audio(audio_path):
-    raw_waveform = load_audio(audio_path)
-    target_length = int(SAMPLE_RATE * SPEECH_LENGTH)
-
-    if len(raw_waveform) >= target_length:
-        speech = raw_waveform[:target_length]
-    else:
-        speech = np.pad(raw_waveform, (0, target_length - len(raw_waveform)))
-
-    return speech.reshape(1, -1), np.array([speech.shape[0]], dtype=np.int64)
 
 # onnx推理
 class DolphinONNXInferencer:
@@ -76,14 +241,93 @@ class DolphinONNXInferencer:
         sess_options.intra_op_num_threads = CPU_THREADS
         return ort.InferenceSession(model_path, sess_options=sess_options)
 
-    def decode(self, speech_np, speech_lengths_np, lang_sym="zh", region_sym="CN"):
+    def _valid_enc_frames(self, enc_outputs, padded_length, speech_lengths):
+        """
+        每条语音的有效编码帧数 (B,)
+        编码器带长度输出时直接使用，否则按 有效采样点 / 补齐后采样点 的比例向上取整估计
+        """
+        num_frames = enc_outputs[0].shape[1]
+        speech_lengths = np.minimum(np.asarray(speech_lengths, dtype=np.int64), padded_length)
+        if len(enc_outputs) > 1 and np.issubdtype(enc_outputs[1].dtype, np.integer):
+            valid_frames = np.where(speech_lengths >= padded_length, num_frames, enc_outputs[1].reshape(-1))
+        else:
+            valid_frames = np.array([math.ceil(num_frames * int(length) / padded_length) for length in speech_lengths])
+        return np.clip(valid_frames, 1, num_frames).astype(np.int64)
+
+    def _trim_enc_out(self, enc_outputs, padded_length, speech_lengths):
+        """去掉补齐部分对应的编码帧，解码器的交叉注意力只看有效帧（多条时保留到最长的一条）"""
+        return enc_outputs[0][:, :int(self._valid_enc_frames(enc_outputs, padded_length, speech_lengths).max())]
+
+    def _prompt_ids(self, lang_sym, region_sym):
+        return [self.sos_id, self.converter.token2id(f"<{lang_sym}>"),
+                self.converter.token2id(f"<{region_sym}>"), self.converter.token2id("<asr>")]
+
+    def decode_batch(self, speech_np, speech_lengths_np, lang_sym="zh", region_sym="CN", beam_size=BEAM_SIZE,
+                     num_samples=None):
+        """
+        批量束搜索解码
+        speech_np: (B, N) 补齐后的波形，speech_lengths_np: (B,)
+        lang_sym / region_sym 可以是单个字符串，也可以是与 batch 等长的列表
+        有效长度不同的语音按有效编码帧数分组解码（见 dolphin_common.beam_search_by_length），不会看到其他语音的补齐帧
+        num_samples: (B,) 补齐前的采样点数，用于计算 RTF；不传时按 speech_lengths_np 估计（固定 30 秒模式下偏大）
+        返回与输入顺序一致的结果列表
+        """
+        batch_size = speech_np.shape[0]
+        lang_syms = [lang_sym] * batch_size if isinstance(lang_sym, str) else list(lang_sym)
+        region_syms = [region_sym] * batch_size if isinstance(region_sym, str) else list(region_sym)
+
+        enc_start = time.time()
+        enc_outputs = self.encoder_session.run(None, {
+            self.encoder_input_names[0]: speech_np,
+            self.encoder_input_names[1]: speech_lengths_np
+        })
+        valid_frames = self._valid_enc_frames(enc_outputs, speech_np.shape[1], speech_lengths_np)
+        enc_time = time.time() - enc_start
+
+        dec_start = time.time()
+        prompts = [self._prompt_ids(lang, region) for lang, region in zip(lang_syms, region_syms)]
+        hyps, scores, num_calls = beam_search_by_length(
+            self.decoder_session, self.decoder_input_names, enc_outputs[0], valid_frames, prompts, beam_size, self.eos_id,
+            MAX_DECODE_STEPS)
+        dec_time = time.time() - dec_start
+        total_time = enc_time + dec_time
+
+        if num_samples is None:
+            num_samples = np.minimum(speech_lengths_np, speech_np.shape[1])
+        audio_duration = float(np.sum(num_samples)) / SAMPLE_RATE
+        results = []
+        for ids, score in zip(hyps, scores):
+            tokens = self.converter.ids2tokens(ids)
+            results.append({
+                "text": "".join(tokens),
+                "clean_text": "".join([t for t in tokens if len(t) == 1 or (not t.startswith("<") and not t.endswith(">"))]),
+                "token_ids": ids,
+                "score": round(score, 3),
+                "steps": len(ids) - len(prompts[0]),
+            })
+        for result in results:
+            result.update({
+                "rtf": round(total_time / audio_duration, 3),
+                "decoder_calls": num_calls,
+                "enc_time": round(enc_time, 3),
+                "dec_time": round(dec_time, 3),
+                "total_time": round(total_time, 3)
+            })
+        return results
+
+    def decode(self, speech_np, speech_lengths_np, lang_sym="zh", region_sym="CN", num_samples=None):
+        """
+        贪婪解码单条语音
+        num_samples: (1,) 补齐前的采样点数，用于计算 RTF；不传时按 speech_lengths_np 估计（固定 30 秒模式下为 30 秒）
+        """
         # Encoder推理
         enc_start = time.time()
         encoder_inputs = {
             self.encoder_input_names[0]: speech_np,
             self.encoder_input_names[1]: speech_lengths_np
         }
-        enc_out = self.encoder_session.run(None, encoder_inputs)[0]
+        enc_outputs = self.encoder_session.run(None, encoder_inputs)
+        enc_out = self._trim_enc_out(enc_outputs, speech_np.shape[1], speech_lengths_np)
         enc_time = time.time() - enc_start
 
         # Decoder初始化解码
@@ -123,7 +367,9 @@ class DolphinONNXInferencer:
         full_text = "".join(tokens)
         clean_text = "".join([t for t in tokens if len(t) == 1 or (not t.startswith("<") and not t.endswith(">"))])
 
-        audio_duration = speech_np.shape[1] / SAMPLE_RATE
+        if num_samples is None:
+            num_samples = np.minimum(speech_lengths_np, speech_np.shape[1])
+        audio_duration = int(num_samples[0]) / SAMPLE_RATE
         rtf = total_time / audio_duration
 
         return {
@@ -131,12 +377,85 @@ class DolphinONNXInferencer:
             "clean_text": clean_text,
             "rtf": round(rtf, 3),
             "steps": step + 1,
+            "enc_frames": enc_out.shape[1],
             "enc_time": round(enc_time, 3),
             "dec_time": round(dec_time, 3),
             "total_time": round(total_time, 3)
         }
 
 
+def transcribe_long(inferencer, raw_waveform, lang_sym="zh", region_sym="CN", overlap=LONG_FORM_OVERLAP,
+                    beam_size=1, batch_size=LONG_FORM_BATCH_SIZE, dynamic_length=DYNAMIC_LENGTH):
+    """
+    长音频转写：切分为重叠窗口，每批 batch_size 个窗口一次编码、一次批量解码，
+    再按时间戳（或 token 对齐）合并重叠部分，返回全文和带全局时间的片段
+    """
+    start_time = time.time()
+    windows = split_long_audio(raw_waveform, overlap)
+    window_segments, decoder_calls = [], 0
+    for batch_start in range(0, len(windows), batch_size):
+        batch = windows[batch_start:batch_start + batch_size]
+        speech_np, speech_lengths_np, num_samples = stack_speech(
+            [pad_speech(waveform, dynamic_length, return_num_samples=True) for waveform, _, _ in batch])
+        results = inferencer.decode_batch(speech_np, speech_lengths_np, lang_sym, region_sym, beam_size=beam_size,
+                                          num_samples=num_samples)
+        window_segments.extend(parse_segments(inferencer.converter.ids2tokens(r["token_ids"])) for r in results)
+        decoder_calls += results[0]["decoder_calls"]
+
+    segments = merge_window_segments(window_segments, [(begin, end) for _, begin, end in windows])
+    total_time = time.time() - start_time
+    audio_duration = len(raw_waveform) / SAMPLE_RATE
+    return {
+        "text": "".join("".join(tokens) for _, _, tokens in segments),
+        "segments": [{"start": round(begin, 2), "end": round(end, 2), "text": "".join(tokens)}
+                     for begin, end, tokens in segments],
+        "windows": len(windows),
+        "decoder_calls": decoder_calls,
+        "rtf": round(total_time / max(audio_duration, 1e-6), 3),
+        "total_time": round(total_time, 3)
+    }
+
+
+def benchmark_dynamic_length(inferencer, raw_waveform, durations=BENCHMARK_DURATIONS,
+                             lang_sym="zh", region_sym="CN"):
+    """
+    截取不同时长的音频，对比 固定补齐到 SPEECH_LENGTH 与 动态分桶 两种模式的编码/解码耗时
+    """
+    print(f"{'duration':>8} | {'fixed enc/dec/total (s)':>24} | {'dynamic enc/dec/total (s)':>26} | speedup")
+    results = []
+    for seconds in durations:
+        # 音频不够长时循环拼接到目标时长
+        waveform = np.resize(raw_waveform, int(seconds * SAMPLE_RATE))
+        speech_np, speech_lengths_np, num_samples = pad_speech(waveform, dynamic_length=False, return_num_samples=True)
+        fixed = inferencer.decode(speech_np, speech_lengths_np, lang_sym, region_sym, num_samples=num_samples)
+        speech_np, speech_lengths_np, num_samples = pad_speech(waveform, dynamic_length=True, return_num_samples=True)
+        dynamic = inferencer.decode(speech_np, speech_lengths_np, lang_sym, region_sym, num_samples=num_samples)
+        speedup = fixed["total_time"] / max(dynamic["total_time"], 1e-6)
+        print(f"{seconds:>7}s | {fixed['enc_time']:>7} {fixed['dec_time']:>7} {fixed['total_time']:>7}  "
+              f"| {dynamic['enc_time']:>8} {dynamic['dec_time']:>7} {dynamic['total_time']:>7}  | {speedup:.2f}x")
+        results.append({"duration": seconds, "fixed": fixed, "dynamic": dynamic, "speedup": round(speedup, 2)})
+    return results
+
+
+def verify_decode_batch(inferencer, raw_waveform, durations=BENCHMARK_DURATIONS, lang_sym="zh", region_sym="CN"):
+    """
+    截取不同时长的音频组成一批（动态分桶补齐到最长的一条），
+    校验 decode_batch(beam_size=1) 与逐条 decode 的结果一致，即短音频不会看到其他语音的补齐帧
+    """
+    padded = [pad_speech(np.resize(raw_waveform, int(seconds * SAMPLE_RATE)), dynamic_length=True)
+              for seconds in durations]
+    batch_results = inferencer.decode_batch(*stack_speech(padded), lang_sym, region_sym, beam_size=1)
+    consistent = True
+    for seconds, (speech_np, speech_lengths_np), batch_result in zip(durations, padded, batch_results):
+        single = inferencer.decode(speech_np, speech_lengths_np, lang_sym, region_sym)
+        if single["text"] != batch_result["text"]:
+            print(f"[decode_batch check] {seconds}s mismatch:\n  decode:       {single['text']}\n"
+                  f"  decode_batch: {batch_result['text']}")
+            consistent = False
+    print(f"[decode_batch check] {'consistent' if consistent else 'MISMATCH'} on {len(durations)} lengths")
+    return consistent
+
+
 def main():
     model_dir = ""# "/to/path/DolphinAsr-base-int8-onnx/"
     audio_path = f"{model_dir}audio.wav"
@@ -145,13 +464,26 @@ def main():
     tokens_path = f"{model_dir}tokens.txt"
 
     print("Loading audio...")
-    speech_np, speech_lengths_np = preprocess_audio(audio_path)
+    raw_waveform = load_audio(audio_path)
+    speech_np, speech_lengths_np, num_samples = pad_speech(raw_waveform, return_num_samples=True)
 
     print("Initializing inference engine...")
     inferencer = DolphinONNXInferencer(encoder_onnx_path, decoder_onnx_path, tokens_path)
 
+    # 超过 SPEECH_LENGTH 的音频走长音频模式，避免截断丢失内容
+    if len(raw_waveform) > SAMPLE_RATE * SPEECH_LENGTH:
+        print(f"Audio longer than {SPEECH_LENGTH}s, using long-form mode...")
+        result = transcribe_long(inferencer, raw_waveform, lang_sym="zh", region_sym="CN")
+        print("\n" + "=" * 80)
+        for segment in result["segments"]:
+            print(f"[{segment['start']:8.2f} - {segment['end']:8.2f}] {segment['text']}")
+        print(f"Windows: {result['windows']}, decoder calls: {result['decoder_calls']}")
+        print(f"Total time: {result['total_time']}s, RTF: {result['rtf']}")
+        print("=" * 80)
+        return result
+
     print("Starting inference...")
-    result = inferencer.decode(speech_np, speech_lengths_np, lang_sym="zh", region_sym="CN")
+    result = inferencer.decode(speech_np, speech_lengths_np, lang_sym="zh", region_sym="CN", num_samples=num_samples)
 
     print("\n" + "=" * 80)
     print("Inference Results:")
@@ -162,6 +494,13 @@ def main():
     print(f"Total time: {result['total_time']}s, RTF: {result['rtf']}")
     print("=" * 80)
 
+    if RUN_BENCHMARK:
+        print("\nBenchmarking fixed 30s padding vs dynamic length buckets...")
+        benchmark_dynamic_length(inferencer, load_audio(audio_path))
+
+    if VERIFY_BATCH:
+        verify_decode_batch(inferencer, raw_waveform)
+
     return result
 
 
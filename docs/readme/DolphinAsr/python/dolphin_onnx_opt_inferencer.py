@@ -1,15 +1,25 @@
 import numpy as np
 import onnxruntime as ort
-import torch
-import torchaudio
-import subprocess
 import time
 import onnx
+import sys
+from pathlib import Path
+
+from dolphin_common import beam_search_by_length, get_audio_pool, load_audio
+
+try:
+    from log_mel import mel_spectrogram
+except ImportError:
+    # 在仓库中直接运行时使用 AudioTagging/python 下的 log_mel.py
+    sys.path.append(str(Path(__file__).resolve().parents[2] / "AudioTagging" / "python"))
+    from log_mel import mel_spectrogram
 
 # ==================== 配置 ====================
 SAMPLE_RATE = 16000
 MAX_DECODE_STEPS = 1000
 CPU_THREADS = 1
+BEAM_SIZE = 5               # decode_batch 的束宽，1 等价于贪婪解码
+VERIFY_BATCH = False        # 截取不同长度的特征，校验 decode_batch（beam_size=1）与逐条 decode 结果一致
 
 # 特征提取参数（与训练一致）
 N_FFT = 512
@@ -19,6 +29,9 @@ N_MELS = 80
 FMIN = 0
 FMAX = 8000
 
+# 批量读取
+FBANK_CHUNK_SIZE = 8        # preprocess_batch 每凑满多少条波形合并提取一次 fbank
+
 
 # =============================================
 
@@ -38,33 +51,15 @@ class TokenConverter:
     def token2id(self, token):
         return self.token2id_dict.get(token)
 
-def load_audio(file_path):
-    """使用ffmpeg加载音频，返回float32波形"""
-    cmd = [
-        "ffmpeg", "-nostdin", "-threads", "0", "-i", file_path,
-        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le",
-        "-ar", str(SAMPLE_RATE), "-"
-    ]
-    out = subprocess.run(cmd, capture_output=True, check=True).stdout
-    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+# ==================== log-mel 前端（mel 频谱见 log_mel.py） ====================
+def extract_fbank_batch(waveforms):
+    """多条波形一起提取log-mel fbank特征，返回 (T_i, n_mels) 列表"""
+    mels = mel_spectrogram(waveforms, SAMPLE_RATE, N_FFT, HOP_LENGTH, WIN_LENGTH, N_MELS, FMIN, FMAX)
+    return [np.log(mel + np.float32(1e-6)).T for mel in mels]
 
 def extract_fbank(waveform):
     """从原始波形提取log-mel fbank特征 (T, n_mels)"""
-    waveform = torch.from_numpy(waveform).float().unsqueeze(0).unsqueeze(0)
-    mel_transform = torchaudio.transforms.MelSpectrogram(
-        sample_rate=SAMPLE_RATE,
-        n_fft=N_FFT,
-        hop_length=HOP_LENGTH,
-        win_length=WIN_LENGTH,
-        n_mels=N_MELS,
-        f_min=FMIN,
-        f_max=FMAX,
-        power=2.0,
-        normalized=False
-    )
-    mel_spec = mel_transform(waveform)
-    log_mel = torch.log(mel_spec + 1e-6)
-    return log_mel.squeeze().transpose(0, 1).numpy().astype(np.float32)
+    return extract_fbank_batch([waveform])[0]
 
 def preprocess_audio(audio_path):
     """加载音频并提取fbank特征，返回 (1, T, D) 和长度 (1,)"""
@@ -74,6 +69,25 @@ def preprocess_audio(audio_path):
     feats_len = np.array([feats.shape[1]], dtype=np.int64)
     return feats, feats_len
 
+def preprocess_batch(audio_paths, chunk_size=FBANK_CHUNK_SIZE):
+    """
+    多条音频提取fbank后按最长的一条补零，返回 (B, T, D) 和长度 (B,)
+    通过 imap 边解码边提取：每凑满 chunk_size 条波形合并做一次 rFFT，波形随即释放，内存中只保留当前一组
+    """
+    feats_list, chunk = [], []
+    for waveform in get_audio_pool().imap(audio_paths):
+        chunk.append(waveform)
+        if len(chunk) >= chunk_size:
+            feats_list.extend(extract_fbank_batch(chunk))
+            chunk = []
+    if chunk:
+        feats_list.extend(extract_fbank_batch(chunk))
+    feats_len = np.array([len(feats) for feats in feats_list], dtype=np.int64)
+    feats = np.zeros((len(feats_list), int(feats_len.max()), N_MELS), dtype=np.float32)
+    for row, f in enumerate(feats_list):
+        feats[row, :len(f)] = f
+    return feats, feats_len
+
 def get_input_names(model_path):
     """获取ONNX模型的输入名称"""
     model = onnx.load(model_path)
@@ -153,6 +167,91 @@ class DolphinONNXInferencer:
             "total_time": round(total_time, 3)
         }
 
+    def _prompt_ids(self, lang_sym, region_sym):
+        return [self.sos_id, self.converter.token2id(f"<{lang_sym}>"),
+                self.converter.token2id(f"<{region_sym}>"), self.asr_id]
+
+    def _valid_enc_frames(self, enc_outputs, padded_frames, feats_len):
+        """
+        每条语音的有效编码帧数 (B,)
+        编码器带长度输出时直接使用，否则按 有效 fbank 帧 / 补零后 fbank 帧 的比例向上取整估计
+        """
+        num_frames = enc_outputs[0].shape[1]
+        feats_len = np.minimum(np.asarray(feats_len, dtype=np.int64), padded_frames)
+        if len(enc_outputs) > 1 and np.issubdtype(enc_outputs[1].dtype, np.integer):
+            valid_frames = np.where(feats_len >= padded_frames, num_frames, enc_outputs[1].reshape(-1))
+        else:
+            valid_frames = -(-num_frames * feats_len // padded_frames)
+        return np.clip(valid_frames, 1, num_frames).astype(np.int64)
+
+    def decode_batch(self, speech_np, speech_lengths_np, lang_sym="zh", region_sym="CN", beam_size=BEAM_SIZE):
+        """
+        批量束搜索解码
+        speech_np: (B, T, D) 补零后的fbank特征，speech_lengths_np: (B,) 特征长度
+        lang_sym / region_sym 可以是单个字符串，也可以是与 batch 等长的列表
+        特征长度不同的语音按有效编码帧数分组解码（见 dolphin_common.beam_search_by_length），不会看到其他语音的补零帧
+        返回与输入顺序一致的结果列表
+        """
+        start_time = time.time()
+        batch_size = speech_np.shape[0]
+        lang_syms = [lang_sym] * batch_size if isinstance(lang_sym, str) else list(lang_sym)
+        region_syms = [region_sym] * batch_size if isinstance(region_sym, str) else list(region_sym)
+
+        # 1. Encoder推理
+        enc_outputs = self.encoder_session.run(None, {
+            self.enc_input_names[0]: speech_np,
+            self.enc_input_names[1]: speech_lengths_np
+        })
+        valid_frames = self._valid_enc_frames(enc_outputs, speech_np.shape[1], speech_lengths_np)
+        enc_time = time.time() - start_time
+
+        # 2. 按有效长度分组的批量束搜索
+        dec_start = time.time()
+        prompts = [self._prompt_ids(lang, region) for lang, region in zip(lang_syms, region_syms)]
+        hyps, scores, num_calls = beam_search_by_length(
+            self.decoder_session, self.dec_input_names, enc_outputs[0], valid_frames, prompts, beam_size, self.eos_id,
+            MAX_DECODE_STEPS)
+        dec_time = time.time() - dec_start
+        total_time = time.time() - start_time
+
+        # 3. 转换结果，RTF 按全部音频的总时长计算
+        audio_duration = float(speech_lengths_np.sum()) * HOP_LENGTH / SAMPLE_RATE
+        results = []
+        for ids, score in zip(hyps, scores):
+            tokens = self.converter.ids2tokens(ids)
+            results.append({
+                "text": "".join(tokens),
+                "clean_text": "".join(t for t in tokens if len(t) == 1 or (not t.startswith("<") and not t.endswith(">"))),
+                "score": round(score, 3),
+                "steps": len(ids) - len(prompts[0]),
+                "rtf": round(total_time / audio_duration, 3),
+                "decoder_calls": num_calls,
+                "enc_time": round(enc_time, 3),
+                "dec_time": round(dec_time, 3),
+                "total_time": round(total_time, 3)
+            })
+        return results
+
+def verify_decode_batch(inferencer, feats, lang_sym="zh", region_sym="CN", fractions=(0.25, 0.5, 1.0)):
+    """
+    截取 feats (1, T, D) 的不同长度组成一批（补零到最长的一条），
+    校验 decode_batch(beam_size=1) 与逐条 decode 的结果一致，即短语音不会看到其他语音的补零帧
+    """
+    lengths = [max(1, int(feats.shape[1] * fraction)) for fraction in fractions]
+    batch = np.zeros((len(lengths), max(lengths), feats.shape[2]), dtype=np.float32)
+    for row, length in enumerate(lengths):
+        batch[row, :length] = feats[0, :length]
+    batch_results = inferencer.decode_batch(batch, np.array(lengths, dtype=np.int64), lang_sym, region_sym, beam_size=1)
+    consistent = True
+    for length, batch_result in zip(lengths, batch_results):
+        single = inferencer.decode(feats[:, :length], np.array([length], dtype=np.int64), lang_sym, region_sym)
+        if single["text"] != batch_result["text"]:
+            print(f"[decode_batch check] {length} frames mismatch:\n  decode:       {single['text']}\n"
+                  f"  decode_batch: {batch_result['text']}")
+            consistent = False
+    print(f"[decode_batch check] {'consistent' if consistent else 'MISMATCH'} on {len(lengths)} lengths")
+    return consistent
+
 def main():
     # # 模型路径（请按实际情况修改）
     model_dir = "/to/path/DolphinAsr-base-int8-onnx"
@@ -179,5 +278,8 @@ def main():
     print(f"Total time: {result['total_time']}s, RTF: {result['rtf']}")
     print("=" * 80)
 
+    if VERIFY_BATCH:
+        verify_decode_batch(inferencer, speech_np)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
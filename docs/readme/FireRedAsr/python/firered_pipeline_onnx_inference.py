@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+FireRed 组合推理：FireRedVad + FireRedLID + FireRedASR 共用一次 Fbank 前端
+- 三个模型使用相同的 80 维 Kaldi Fbank（帧长25ms，帧移10ms），只是 cmvn.ark 不同；
+- 整段音频只提取一次原始 Fbank，各模型的 CMVN 转换为逐维仿射变换 x * scale + bias；
+- LID 和 ASR 直接从共享特征矩阵中切出 VAD 检测到的语音段，不再重新读取音频、计算 Fbank。
+模型下载
+git clone https://modelscope.cn/models/manyeyes/FireRedVad-onnx.git
+git clone https://www.modelscope.cn/manyeyes/FireRedLID-int8-onnx.git
+git clone https://www.modelscope.cn/manyeyes/fireredasr2-aed-large-zh-en-int8-onnx-offline-20260212.git
+"""
+
+import os
+import time
+import numpy as np
+import onnxruntime as ort
+import logging
+import kaldiio
+import kaldi_native_fbank as knf
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+logger = logging.getLogger(__name__)
+
+# ======================== 配置参数 ========================
+WAV_PATH = "/path/to/test_wavs/0.wav"
+VAD_DIR = "/path/to/FireRedVad-onnx"
+LID_DIR = "/path/to/FireRedLID-int8-onnx"
+ASR_DIR = "/path/to/fireredasr2-aed-large-zh-en-int8-onnx-offline-20260212"
+
+VAD_ONNX = os.path.join(VAD_DIR, "model.onnx")
+LID_ENCODER_ONNX = os.path.join(LID_DIR, "encoder.int8.onnx")
+LID_DECODER_ONNX = os.path.join(LID_DIR, "decoder.int8.onnx")
+ASR_ENCODER_ONNX = os.path.join(ASR_DIR, "encoder.int8.onnx")
+ASR_DECODER_ONNX = os.path.join(ASR_DIR, "decoder.int8.onnx")
+# fuse_decoder_argmax.py 生成的融合 decoder，存在时优先使用
+ASR_DECODER_ARGMAX_ONNX = os.path.join(ASR_DIR, "decoder.argmax.int8.onnx")
+USE_GPU = False
+
+# VAD 后处理参数（同 fireredvad_onnx_inference.py 示例）
+VAD_SMOOTH_WINDOW_SIZE = 5
+VAD_SPEECH_THRESHOLD = 0.4
+VAD_MIN_SPEECH_FRAME = 20
+VAD_MAX_SPEECH_FRAME = 2000
+VAD_MERGE_SILENCE_FRAME = 20
+VAD_EXTEND_SPEECH_FRAME = 20
+VAD_CHUNK_MAX_FRAME = 30000
+
+# LID：只使用前 LID_MAX_SECONDS 秒的语音帧
+LID_BEAM_SIZE = 3
+LID_MAX_SECONDS = 30
+
+# ASR 模型参数
+ASR_D_MODEL = 1280
+ASR_SOS_ID = 3
+ASR_EOS_ID = 4
+ASR_MAX_LEN_RATIO = 1.0
+
+# 同时按各脚本原来的方式（各自读取音频、计算 Fbank + CMVN）计时，输出每个阶段节省的前端耗时
+REPORT_FRONTEND_SAVINGS = True
+
+FRAME_SHIFT_SEC = 0.01
+# =========================================================
+
+
+# ======================== 共享前端 ========================
+class AffineCMVN:
+    """Kaldi CMVN 转换为逐维仿射变换：(x - mean) * istd == x * scale + bias"""
+
+    def __init__(self, kaldi_cmvn_file):
+        assert os.path.exists(kaldi_cmvn_file), f"找不到CMVN文件: {kaldi_cmvn_file}"
+        stats = kaldiio.load_mat(kaldi_cmvn_file)
+        assert stats.shape[0] == 2
+        self.dim = stats.shape[-1] - 1
+        count = stats[0, self.dim]
+        assert count >= 1
+        means = stats[0, :self.dim] / count
+        variance = np.maximum(stats[1, :self.dim] / count - means * means, 1e-20)
+        inverse_std = 1.0 / np.sqrt(variance)
+        self.scale = inverse_std.astype(np.float32)
+        self.bias = (-means * inverse_std).astype(np.float32)
+
+    def __call__(self, x):
+        assert x.shape[-1] == self.dim, "CMVN dim mismatch"
+        out = x * self.scale
+        out += self.bias
+        return out
+
+
+class KaldifeatFbank:
+    def __init__(self, num_mel_bins=80, frame_length=25, frame_shift=10):
+        opts = knf.FbankOptions()
+        opts.frame_opts.samp_freq = 16000
+        opts.frame_opts.frame_length_ms = frame_length
+        opts.frame_opts.frame_shift_ms = frame_shift
+        opts.frame_opts.dither = 0.0
+        opts.frame_opts.snip_edges = True
+        opts.mel_opts.num_bins = num_mel_bins
+        opts.mel_opts.debug_mel = False
+        self.opts = opts
+
+    def __call__(self, sample_rate, wav_np):
+        assert len(wav_np.shape) == 1
+        fbank = knf.OnlineFbank(self.opts)
+        fbank.accept_waveform(sample_rate, wav_np.tolist())
+        num_frames = fbank.num_frames_ready
+        if num_frames == 0:
+            return np.zeros((0, self.opts.mel_opts.num_bins), dtype=np.float32)
+        return np.vstack([fbank.get_frame(i) for i in range(num_frames)]).astype(np.float32)
+
+
+class SharedFrontend:
+    """原始 Fbank 只计算一次，按模型名称应用各自的 CMVN"""
+
+    def __init__(self, cmvn_files):
+        self.fbank = KaldifeatFbank(num_mel_bins=80, frame_length=25, frame_shift=10)
+        self.cmvns = {name: AffineCMVN(path) for name, path in cmvn_files.items()}
+
+    def compute(self, sample_rate, wav_np):
+        return self.fbank(sample_rate, wav_np)
+
+    def normalize(self, raw_feats, name):
+        return self.cmvns[name](raw_feats)
+
+
+# ======================== VAD ========================
+class VadPostprocessor:
+    """
+    VAD后处理：平滑、阈值、合并语音段（同 fireredvad_onnx_inference.py），
+    区别在于超过 max_speech_frame 的语音段不截断，而是切成连续的若干段，后续 ASR 不丢内容
+    """
+    def __init__(self, smooth_window_size, speech_threshold,
+                 min_speech_frame, max_speech_frame,
+                 merge_silence_frame, extend_speech_frame):
+        self.smooth_window_size = smooth_window_size
+        self.speech_threshold = speech_threshold
+        self.min_speech_frame = min_speech_frame
+        self.max_speech_frame = max_speech_frame
+        self.merge_silence_frame = merge_silence_frame
+        self.extend_speech_frame = extend_speech_frame
+
+    def process(self, probs):
+        """输入一维概率数组，返回语音段帧区间 [(start, end)]，end 不含"""
+        probs = np.asarray(probs).flatten()
+        # 平滑
+        kernel = np.ones(self.smooth_window_size) / self.smooth_window_size
+        smoothed = np.convolve(probs, kernel, mode='same')
+        # 阈值
+        decisions = (smoothed > self.speech_threshold).astype(int).tolist()
+
+        # 提取语音段
+        segments = []
+        start = None
+        for i, d in enumerate(decisions):
+            if d == 1 and start is None:
+                start = i
+            elif d == 0 and start is not None:
+                segments.append((start, i - 1))
+                start = None
+        if start is not None:
+            segments.append((start, len(decisions) - 1))
+
+        # 过滤短语音（超长语音在最后切分）
+        merged = [(s, e) for s, e in segments if e - s + 1 >= self.min_speech_frame]
+
+        # 合并短静音间隔
+        if len(merged) > 1:
+            final = [merged[0]]
+            for i in range(1, len(merged)):
+                gap = merged[i][0] - final[-1][1] - 1
+                if gap <= self.merge_silence_frame:
+                    final[-1] = (final[-1][0], merged[i][1])
+                else:
+                    final.append(merged[i])
+            merged = final
+
+        # 扩展语音段前后，重叠的段合并
+        result = []
+        for s, e in merged:
+            s = max(0, s - self.extend_speech_frame)
+            e = min(len(decisions) - 1, e + self.extend_speech_frame)
+            if result and s <= result[-1][1]:
+                result[-1] = (result[-1][0], e + 1)
+            else:
+                result.append((s, e + 1))
+
+        # 超长语音段（含合并、扩展后变长的段）切成连续的若干段，每段不超过 max_speech_frame 帧
+        chunks = []
+        for s, e in result:
+            for begin in range(s, e, self.max_speech_frame):
+                chunks.append((begin, min(begin + self.max_speech_frame, e)))
+        return chunks
+
+
+def run_vad(vad_sess, feats):
+    """按 VAD_CHUNK_MAX_FRAME 分块流式运行 VAD，返回逐帧语音概率 (T,)"""
+    input_names = [inp.name for inp in vad_sess.get_inputs()]
+    output_names = [out.name for out in vad_sess.get_outputs()]
+    num_caches = len([name for name in input_names if name.startswith('cache_')])
+    # cache 形状含动态维度时使用导出时的固定值（P=128, lookback_padding=19）
+    raw_shape = vad_sess.get_inputs()[1].shape
+    cache_shape = (1, 128, 19) if any(isinstance(dim, str) for dim in raw_shape) else raw_shape
+    caches = [np.zeros(cache_shape, dtype=np.float32) for _ in range(num_caches)]
+
+    all_probs = []
+    for start in range(0, feats.shape[0], VAD_CHUNK_MAX_FRAME):
+        feed_dict = {'feat': feats[np.newaxis, start:start + VAD_CHUNK_MAX_FRAME]}
+        for i, cache in enumerate(caches):
+            feed_dict[f'cache_{i}'] = cache
+        outputs = vad_sess.run(output_names, feed_dict)
+        all_probs.append(outputs[0].flatten())
+        caches = outputs[1:1 + num_caches]
+    return np.concatenate(all_probs) if all_probs else np.zeros(0, dtype=np.float32)
+
+
+# ======================== LID ========================
+def load_token_dict(dict_path):
+    """读取字典：一行是 token id 或只有 token，返回 (token2id, id2token)"""
+    token2id, id2token = {}, {}
+    with open(dict_path, 'r', encoding='utf-8') as f:
+        for idx, line in enumerate(f):
+            parts = line.strip().split()
+            if len(parts) < 1:
+                continue
+            tid = int(parts[1]) if len(parts) >= 2 and parts[1].isdigit() else idx
+            token2id[parts[0]] = tid
+            id2token[tid] = parts[0]
+    return token2id, id2token
+
+
+def log_softmax(logits):
+    """按最后一维计算 log_softmax（减去最大值防止溢出）"""
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def top_k(log_probs, k):
+    """按最后一维取前 k 大，返回 (indices, values)，均按分数降序"""
+    k = min(k, log_probs.shape[-1])
+    indices = np.argpartition(-log_probs, k - 1, axis=-1)[..., :k]
+    values = np.take_along_axis(log_probs, indices, axis=-1)
+    order = np.argsort(-values, axis=-1, kind="stable")
+    return np.take_along_axis(indices, order, axis=-1), np.take_along_axis(values, order, axis=-1)
+
+
+def lid_beam_search(dec_session, enc_out, enc_mask, sos_id, beam_size=LID_BEAM_SIZE):
+    """两步束搜索（同 fireredlid_onnx_inference.py 的 batch_beam_search），返回 (token id, 置信度)"""
+    batch, _, d_model = enc_out.shape
+    input_names = [i.name for i in dec_session.get_inputs()]
+    output_names = [o.name for o in dec_session.get_outputs()]
+    inputs = {}
+    for name in input_names:
+        if name == "encoder_out":
+            inputs[name] = enc_out
+        elif name == "encoder_mask":
+            inputs[name] = enc_mask.astype(np.bool_)
+        elif name == "ys":
+            inputs[name] = np.full((batch, 1), sos_id, dtype=np.int64)
+        elif name.startswith("cache_"):
+            inputs[name] = np.empty((batch, 0, d_model), dtype=np.float32)
+    outputs = dec_session.run(output_names, inputs)
+    logits1, caches1 = outputs[0], outputs[1:]
+    top_indices1, top_log_probs1 = top_k(log_softmax(logits1.reshape(batch, -1)), beam_size)
+    num_beams = top_indices1.shape[1]
+
+    def expand(x):
+        return np.broadcast_to(x[:, None], (batch, num_beams) + x.shape[1:]).reshape((batch * num_beams,) + x.shape[1:])
+
+    for name in input_names:
+        if name == "ys":
+            inputs[name] = top_indices1.astype(np.int64).reshape(batch * num_beams, 1)
+        elif name in ("encoder_out", "encoder_mask"):
+            inputs[name] = expand(inputs[name])
+        elif name.startswith("cache_"):
+            inputs[name] = expand(caches1[int(name.split('_')[1])])
+    logits2 = dec_session.run(output_names, inputs)[0]
+    top_indices2, top_log_probs2 = top_k(log_softmax(logits2.reshape(batch * num_beams, -1)), beam_size)
+    scores = (top_log_probs1[:, :, None] + top_log_probs2.reshape(batch, num_beams, -1)).reshape(batch, -1)
+
+    rows = np.arange(batch)
+    best = np.argmax(scores, axis=1)
+    return top_indices1[rows, best // top_log_probs2.shape[1]], np.exp(scores[rows, best] / 2)
+
+
+# ======================== ASR ========================
+def asr_greedy_decode(decoder_sess, enc_out, src_mask, max_len_ratio=ASR_MAX_LEN_RATIO):
+    """ASR 贪心解码（同 fireredasr_onnx_inference.py），返回去掉 SOS/EOS 的 token id 列表"""
+    output_names = [out.name for out in decoder_sess.get_outputs()]
+    fused_argmax = 'next_token' in output_names
+    n_layers = len([inp for inp in decoder_sess.get_inputs() if inp.name.startswith('cache_')])
+    first_output = 'next_token' if fused_argmax else output_names[0]
+    run_outputs = [first_output] + [f'new_cache_{i}' for i in range(n_layers)]
+
+    ys = np.array([[ASR_SOS_ID]], dtype=np.int64)
+    caches = [np.empty((1, 0, ASR_D_MODEL), dtype=np.float32) for _ in range(n_layers)]
+    for _ in range(int(enc_out.shape[1] * max_len_ratio)):
+        input_dict = {'ys': ys, 'encoder_outputs': enc_out, 'src_mask': src_mask}
+        for i, cache in enumerate(caches):
+            input_dict[f'cache_{i}'] = cache
+        outputs = decoder_sess.run(run_outputs, input_dict)
+        caches = outputs[1:]
+        if fused_argmax:
+            next_token = int(outputs[0].reshape(-1)[0])
+        else:
+            next_token = int(np.argmax(outputs[0].reshape(-1)))
+        ys = np.concatenate([ys, [[next_token]]], axis=1)
+        if next_token == ASR_EOS_ID:
+            break
+    tokens = ys[0, 1:].tolist()
+    if tokens and tokens[-1] == ASR_EOS_ID:
+        tokens = tokens[:-1]
+    return tokens
+
+
+# ======================== 组合推理 ========================
+def load_onnx_model(path, providers):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"ONNX模型文件不存在: {path}")
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options, providers=providers)
+
+
+class FireRedPipeline:
+    """VAD -> LID -> ASR，三个模型共用一次 Fbank 前端"""
+
+    def __init__(self, use_gpu=USE_GPU):
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
+        self.frontend = SharedFrontend({
+            "vad": os.path.join(VAD_DIR, "cmvn.ark"),
+            "lid": os.path.join(LID_DIR, "cmvn.ark"),
+            "asr": os.path.join(ASR_DIR, "cmvn.ark"),
+        })
+        self.vad_sess = load_onnx_model(VAD_ONNX, providers)
+        self.vad_postprocessor = VadPostprocessor(VAD_SMOOTH_WINDOW_SIZE, VAD_SPEECH_THRESHOLD,
+                                                  VAD_MIN_SPEECH_FRAME, VAD_MAX_SPEECH_FRAME,
+                                                  VAD_MERGE_SILENCE_FRAME, VAD_EXTEND_SPEECH_FRAME)
+        self.lid_enc_sess = load_onnx_model(LID_ENCODER_ONNX, providers)
+        self.lid_dec_sess = load_onnx_model(LID_DECODER_ONNX, providers)
+        lid_token2id, self.lid_id2token = load_token_dict(os.path.join(LID_DIR, "dict.txt"))
+        self.lid_sos_id = lid_token2id.get('<sos>', 0)
+        self.asr_enc_sess = load_onnx_model(ASR_ENCODER_ONNX, providers)
+        asr_decoder = ASR_DECODER_ARGMAX_ONNX if os.path.exists(ASR_DECODER_ARGMAX_ONNX) else ASR_DECODER_ONNX
+        self.asr_dec_sess = load_onnx_model(asr_decoder, providers)
+        _, self.asr_id2token = load_token_dict(os.path.join(ASR_DIR, "tokens.txt"))
+
+    def identify_language(self, lid_feats):
+        """LID：输入已做 CMVN 的语音帧 (T, 80)，返回 (语言, 置信度)"""
+        lengths = np.array([lid_feats.shape[0]], dtype=np.int64)
+        outputs = self.lid_enc_sess.run(["encoder_out", "encoder_mask"],
+                                        {"features": lid_feats[np.newaxis], "lengths": lengths})
+        token_ids, confidences = lid_beam_search(self.lid_dec_sess, outputs[0], outputs[1], self.lid_sos_id)
+        raw_token = self.lid_id2token.get(int(token_ids[0]), f"<UNK>{int(token_ids[0])}")
+        return raw_token.split('\t')[0].strip(), float(confidences[0])
+
+    def recognize(self, asr_feats):
+        """ASR：输入已做 CMVN 的一个语音段 (T, 80)，返回文本"""
+        lengths = np.array([asr_feats.shape[0]], dtype=np.int64)
+        enc_out, _, enc_mask = self.asr_enc_sess.run(['output', 'output_lengths', 'mask'],
+                                                     {'input': asr_feats[np.newaxis], 'input_lengths': lengths})
+        tokens = asr_greedy_decode(self.asr_dec_sess, enc_out, enc_mask.astype(np.bool_))
+        return ''.join(self.asr_id2token.get(t, '<unk>') for t in tokens)
+
+    def run(self, wav_path):
+        """
+        组合推理
+        Returns:
+            {"dur", "language", "confidence", "segments": [{"start", "end", "text"}], "timings"}
+            timings 为各阶段前端（Fbank/CMVN/切片）与模型推理耗时（秒）
+        """
+        timings = {}
+        sample_rate, wav_np = kaldiio.load_mat(wav_path)
+        dur = wav_np.shape[0] / sample_rate
+
+        # 共享 Fbank：整段音频只计算一次
+        t0 = time.perf_counter()
+        raw_feats = self.frontend.compute(sample_rate, wav_np)
+        timings["fbank"] = time.perf_counter() - t0
+
+        # VAD
+        t0 = time.perf_counter()
+        vad_feats = self.frontend.normalize(raw_feats, "vad")
+        timings["vad_frontend"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        segments = self.vad_postprocessor.process(run_vad(self.vad_sess, vad_feats)) if len(raw_feats) else []
+        timings["vad_model"] = time.perf_counter() - t0
+
+        # LID：拼接语音段对应的帧（最多 LID_MAX_SECONDS 秒），没有语音时使用整段
+        t0 = time.perf_counter()
+        max_frames = int(LID_MAX_SECONDS / FRAME_SHIFT_SEC)
+        speech = [raw_feats[s:e] for s, e in segments] or [raw_feats]
+        lid_feats = self.frontend.normalize(np.concatenate(speech)[:max_frames], "lid")
+        timings["lid_frontend"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        language, confidence = self.identify_language(lid_feats) if len(lid_feats) else (None, 0.0)
+        timings["lid_model"] = time.perf_counter() - t0
+
+        # ASR：逐个语音段切片 + CMVN 后识别
+        results = []
+        timings["asr_frontend"] = timings["asr_model"] = 0.0
+        for s, e in segments:
+            t0 = time.perf_counter()
+            asr_feats = self.frontend.normalize(raw_feats[s:e], "asr")
+            t1 = time.perf_counter()
+            text = self.recognize(asr_feats)
+            timings["asr_frontend"] += t1 - t0
+            timings["asr_model"] += time.perf_counter() - t1
+            results.append({"start": round(s * FRAME_SHIFT_SEC, 3), "end": round(e * FRAME_SHIFT_SEC, 3),
+                            "text": text})
+
+        return {"dur": round(dur, 3), "language": language, "confidence": confidence,
+                "segments": results, "timings": timings}
+
+
+def measure_separate_frontends(frontend, wav_path, segments):
+    """
+    按三个独立脚本的方式计时：VAD、LID 各自读取整段音频计算 Fbank + CMVN，
+    ASR 对每个语音段的波形单独计算 Fbank + CMVN。返回各阶段耗时（秒）
+    """
+    timings = {}
+    for name in ("vad", "lid"):
+        t0 = time.perf_counter()
+        sample_rate, wav_np = kaldiio.load_mat(wav_path)
+        frontend.normalize(frontend.compute(sample_rate, wav_np), name)
+        timings[name] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    sample_rate, wav_np = kaldiio.load_mat(wav_path)
+    hop = int(sample_rate * FRAME_SHIFT_SEC)
+    for seg in segments:
+        start, end = int(round(seg["start"] / FRAME_SHIFT_SEC)), int(round(seg["end"] / FRAME_SHIFT_SEC))
+        frontend.normalize(frontend.compute(sample_rate, wav_np[start * hop:end * hop]), "asr")
+    timings["asr"] = time.perf_counter() - t0
+    return timings
+
+
+def report_frontend_savings(shared_timings, separate_timings):
+    """输出每个阶段独立前端与共享前端的耗时对比（共享 Fbank 的耗时计入第一个使用它的 VAD 阶段）"""
+    shared = {
+        "vad": shared_timings["fbank"] + shared_timings["vad_frontend"],
+        "lid": shared_timings["lid_frontend"],
+        "asr": shared_timings["asr_frontend"],
+    }
+    logger.info("阶段  独立前端(ms)  共享前端(ms)  节省(ms)")
+    for name in ("vad", "lid", "asr"):
+        logger.info(f"{name.upper():<4}  {separate_timings[name] * 1000:>11.1f}  {shared[name] * 1000:>11.1f}  "
+                    f"{(separate_timings[name] - shared[name]) * 1000:>8.1f}")
+    total_separate, total_shared = sum(separate_timings.values()), sum(shared.values())
+    logger.info(f"合计  {total_separate * 1000:>11.1f}  {total_shared * 1000:>11.1f}  "
+                f"{(total_separate - total_shared) * 1000:>8.1f}")
+
+
+def main():
+    pipeline = FireRedPipeline()
+    result = pipeline.run(WAV_PATH)
+
+    print(f"音频时长: {result['dur']} 秒")
+    print(f"语言: {result['language']} (置信度 {result['confidence']:.4f})")
+    for seg in result["segments"]:
+        print(f"  {seg['start']:.3f} - {seg['end']:.3f}: {seg['text']}")
+
+    timings = result["timings"]
+    logger.info(f"Fbank {timings['fbank'] * 1000:.1f}ms, VAD {timings['vad_model'] * 1000:.1f}ms, "
+                f"LID {timings['lid_model'] * 1000:.1f}ms, ASR {timings['asr_model'] * 1000:.1f}ms")
+    if REPORT_FRONTEND_SAVINGS:
+        separate = measure_separate_frontends(pipeline.frontend, WAV_PATH, result["segments"])
+        report_frontend_savings(timings, separate)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,8 @@ CMVN_FILE = os.path.join(ONNX_DIR, "cmvn.ark")
 DICT_PATH = os.path.join(ONNX_DIR, "tokens.txt")
 ENCODER_ONNX = os.path.join(ONNX_DIR, "encoder.int8.onnx")
 DECODER_ONNX = os.path.join(ONNX_DIR, "decoder.int8.onnx")
+# fuse_decoder_argmax.py 生成的融合 decoder（图内 ArgMax，每步只输出 next_token），存在时优先使用
+DECODER_ARGMAX_ONNX = os.path.join(ONNX_DIR, "decoder.argmax.int8.onnx")
 
 # 音频文件路径
 WAV_PATH = "/path/to/test_wavs/0.wav"
@@ -202,12 +204,13 @@ def load_onnx_model(path):
     return session
 
 encoder_sess = load_onnx_model(ENCODER_ONNX)
-decoder_sess = load_onnx_model(DECODER_ONNX)
+decoder_sess = load_onnx_model(DECODER_ARGMAX_ONNX if os.path.exists(DECODER_ARGMAX_ONNX) else DECODER_ONNX)
 
 # 验证 decoder 输入数量
 decoder_inputs = decoder_sess.get_inputs()
 n_layers_onnx = len(decoder_inputs) - 3  # 减去 ys, encoder_outputs, src_mask
 assert n_layers_onnx == n_layers_dec, f"Decoder layer mismatch: ONNX has {n_layers_onnx}, expected {n_layers_dec}"
+decoder_fused_argmax = 'next_token' in [out.name for out in decoder_sess.get_outputs()]
 
 # ========== 初始化特征提取器和词典 ==========
 feat_extractor = FeatExtractor(kaldi_cmvn_file=CMVN_FILE)
@@ -263,19 +266,18 @@ def greedy_decode_with_onnx(decoder_sess, enc_out: torch.Tensor, src_mask: torch
 
         # 运行 ONNX
         # output_names = ['logits'] + [f'new_cache_{i}' for i in range(n_layers_dec)]
-        output_names = ['output'] + [f'new_cache_{i}' for i in range(n_layers_dec)]
+        # 融合 decoder 直接输出 next_token，只拷回一个 id；否则取回 logits 在主机端 argmax
+        first_output = 'next_token' if decoder_fused_argmax else 'output'
+        output_names = [first_output] + [f'new_cache_{i}' for i in range(n_layers_dec)]
         outputs = decoder_sess.run(output_names, input_dict)
-        logits = outputs[0]  # (1, vocab_size)
         new_caches = outputs[1:]  # 每层的新缓存
 
-        # 取 argmax 得到下一个 token
-        next_token = int(np.argmax(logits, axis=-1).item())
+        if decoder_fused_argmax:
+            next_token = int(outputs[0].reshape(-1)[0])
+        else:
+            next_token = int(np.argmax(outputs[0], axis=-1).item())  # logits: (1, vocab_size)
         token_list.append(next_token)
-
-        # 调试：打印 logits top5
-        probs = np.exp(logits - np.max(logits)) / np.sum(np.exp(logits - np.max(logits)))
-        top5 = np.argsort(probs[0])[-5:][::-1]
-        logger.debug(f"Step {step}: token {next_token}, top5 ids: {top5}, probs: {probs[0][top5]}")
+        logger.debug(f"Step {step}: token {next_token}")
 
         # 更新序列和缓存
         ys = np.concatenate([ys, [[next_token]]], axis=1)
@@ -311,6 +313,6 @@ def main():
     print(f"\n识别文本: {text}")
 
 if __name__ == "__main__":
-    # 设置日志级别为 DEBUG 以查看每一步的 token 分布
+    # 设置日志级别为 DEBUG 以查看每一步解码出的 token
     logger.setLevel(logging.DEBUG)
     main()
\ No newline at end of file
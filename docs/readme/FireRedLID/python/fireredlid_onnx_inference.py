@@ -3,6 +3,7 @@
 import os
 import sys
 import math
+import time
 import numpy as np
 import torch
 import onnxruntime as ort
@@ -17,6 +18,14 @@ ENCODER_ONNX = os.path.join(MODEL_DIR, "encoder.int8.onnx")
 DECODER_ONNX = os.path.join(MODEL_DIR, "decoder.int8.onnx")
 USE_GPU = False
 BEAM_SIZE = 3
+# 渐进前缀提前退出：依次只编码前 N 秒特征，置信度达到阈值即停止，否则继续更长前缀，最后退回整段音频
+EARLY_EXIT = False
+EARLY_EXIT_PREFIXES = (2, 4, 8)  # 前缀时长（秒）
+EARLY_EXIT_THRESHOLD = 0.9  # 置信度阈值
+FRAME_SHIFT_MS = 10  # fbank 帧移（毫秒），用于前缀秒数与帧数换算
+# 批量识别：WAV_LIST 非空时 main 对列表中的文件批量识别，按特征长度排序后每批最多 LID_BATCH_SIZE 条
+WAV_LIST = []
+LID_BATCH_SIZE = 16
 # =========================================================
 
 # 基础配置
@@ -231,40 +240,45 @@ def init_components():
     return feat_extractor, tokenizer, sos_id, eos_id, pad_id, token2id, id2token, enc_session, dec_session
 
 
-def process_audio(feat_extractor, enc_session):
-    """提取音频特征并运行编码器"""
-    # 特征提取
-    if not os.path.exists(WAV_PATH):
-        raise FileNotFoundError(f"音频文件不存在: {WAV_PATH}")
-    uttid = os.path.splitext(os.path.basename(WAV_PATH))[0]
-    try:
-        feats, lengths, durs, _, _ = feat_extractor([WAV_PATH], [uttid])
-    except Exception as e1:
-        logger.warning(f"特征提取顺序1失败: {e1}")
-        try:
-            feats, lengths, durs, _, _ = feat_extractor([uttid], [WAV_PATH])
-        except Exception as e2:
-            raise RuntimeError(f"特征提取失败: {e2}") from e2
-
-    # 特征维度适配
-    expected_feat_dim = None
+def get_expected_feat_dim(enc_session):
+    """从编码器输入 features 的形状读取模型期望的特征维度"""
     for inp in enc_session.get_inputs():
         if inp.name == "features" and len(inp.shape) >= 3 and isinstance(inp.shape[2], int):
-            expected_feat_dim = inp.shape[2]
-            break
-    if expected_feat_dim is None:
-        raise RuntimeError("无法确定模型期望的特征维度")
+            return inp.shape[2]
+    raise RuntimeError("无法确定模型期望的特征维度")
+
 
-    actual_feat_dim = feats.shape[2]
+def adapt_feat_dim(feats, expected_feat_dim):
+    """特征维度适配：多余的维度裁剪掉，不足时报错"""
+    actual_feat_dim = feats.shape[-1]
     if actual_feat_dim > expected_feat_dim:
         logger.warning(f"裁剪特征维度: {actual_feat_dim} -> {expected_feat_dim}")
-        feats = feats[:, :, :expected_feat_dim]
+        feats = feats[..., :expected_feat_dim]
     elif actual_feat_dim < expected_feat_dim:
         raise ValueError(f"特征维度不足: 实际{actual_feat_dim} < 期望{expected_feat_dim}")
+    return feats
+
+
+def extract_features(feat_extractor, enc_session, wav_path=WAV_PATH):
+    """提取音频特征并适配编码器期望的特征维度，返回 (feats_np, lengths_np, dur)"""
+    # 特征提取
+    if not os.path.exists(wav_path):
+        raise FileNotFoundError(f"音频文件不存在: {wav_path}")
+    uttid = os.path.splitext(os.path.basename(wav_path))[0]
+    feats, lengths, durs, _, _ = feat_extractor([wav_path], [uttid])
+    if feats is None:
+        raise RuntimeError(f"特征提取失败（音频过短）: {wav_path}")
+
+    # 特征维度适配
+    feats = adapt_feat_dim(feats, get_expected_feat_dim(enc_session))
 
-    # 编码器推理
     feats_np = feats.numpy().astype(np.float32)
     lengths_np = lengths.numpy().astype(np.int64)
+    return feats_np, lengths_np, durs[0]
+
+
+def run_encoder(enc_session, feats_np, lengths_np):
+    """运行编码器，返回 (enc_out, enc_mask)"""
     output_names = [o.name for o in enc_session.get_outputs()]
     inputs = {"features": feats_np, "lengths": lengths_np}
     outputs = enc_session.run(output_names, inputs)
@@ -285,14 +299,37 @@ def process_audio(feat_extractor, enc_session):
     return enc_out, enc_mask
 
 
-def beam_search_decode(dec_session, enc_out, enc_mask, sos_id, eos_id, id2token):
-    """核心束搜索解码逻辑（完整保留两步束搜索）"""
-    batch = 1
-    d_model = enc_out.shape[2]
+def process_audio(feat_extractor, enc_session):
+    """提取音频特征并运行编码器"""
+    feats_np, lengths_np, _ = extract_features(feat_extractor, enc_session)
+    return run_encoder(enc_session, feats_np, lengths_np)
+
+
+def log_softmax(logits):
+    """按最后一维计算 log_softmax（减去最大值防止溢出）"""
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def top_k(log_probs, k):
+    """按最后一维取前 k 大（argpartition 选出后只对 k 个排序），返回 (indices, values)，均按分数降序"""
+    k = min(k, log_probs.shape[-1])
+    indices = np.argpartition(-log_probs, k - 1, axis=-1)[..., :k]
+    values = np.take_along_axis(log_probs, indices, axis=-1)
+    order = np.argsort(-values, axis=-1, kind="stable")
+    return np.take_along_axis(indices, order, axis=-1), np.take_along_axis(values, order, axis=-1)
+
+
+def batch_beam_search(dec_session, enc_out, enc_mask, sos_id, beam_size=BEAM_SIZE):
+    """
+    两步束搜索（batch 版）：enc_out 的每一行是一条语音，返回 (语言 token id, 置信度)，shape 均为 (batch,)
+    第二步把 batch × beam_size 个候选堆叠为一个 batch，只调用一次解码器
+    """
+    batch, _, d_model = enc_out.shape
     n_layers = sum(1 for inp in dec_session.get_inputs() if inp.name.startswith("cache_"))
 
     # 第一步：初始sos
-    ys = np.array([[sos_id]], dtype=np.int64)
+    ys = np.full((batch, 1), sos_id, dtype=np.int64)
     caches = [np.empty((batch, 0, d_model), dtype=np.float32) for _ in range(n_layers)]
 
     # 运行解码器第一步
@@ -311,59 +348,193 @@ def beam_search_decode(dec_session, enc_out, enc_mask, sos_id, eos_id, id2token)
     outputs = dec_session.run(output_names, inputs)
     logits1, caches1 = outputs[0], outputs[1:]
 
-    # 计算第一步概率
-    log_probs1 = logits1[0] - np.log(np.sum(np.exp(logits1[0])))
-    top_indices1 = np.argsort(log_probs1)[::-1][:BEAM_SIZE]
-    top_log_probs1 = log_probs1[top_indices1]
-
-    # 遍历第一步候选，运行第二步
-    candidates = []
-    for i, token1 in enumerate(top_indices1):
-        score = top_log_probs1[i]
-        ys2 = np.array([[token1]], dtype=np.int64)
-
-        # 深拷贝缓存
-        import copy
-        caches_copy = copy.deepcopy(caches1)
-
-        # 第二步推理
-        inputs["ys"] = ys2
-        for name in input_names:
-            if name.startswith("cache_"):
-                inputs[name] = caches_copy[int(name.split('_')[1])]
-        outputs2 = dec_session.run(output_names, inputs)
-        logits2 = outputs2[0]
-
-        log_probs2 = logits2[0] - np.log(np.sum(np.exp(logits2[0])))
-        top_indices2 = np.argsort(log_probs2)[::-1][:BEAM_SIZE]
-        for j, token2 in enumerate(top_indices2):
-            new_score = score + log_probs2[token2]
-            candidates.append((token1, token2, new_score, log_probs2[token2]))
+    # 计算第一步概率 (batch, num_beams)
+    top_indices1, top_log_probs1 = top_k(log_softmax(logits1.reshape(batch, -1)), beam_size)
+    num_beams = top_indices1.shape[1]
+
+    # 第二步：全部候选堆叠为一个 batch，一次解码器调用完成
+    # 编码器输出与第一步缓存只读，用 broadcast_to 扩展到每条语音 num_beams 行；
+    # 单条语音时 reshape 后仍是视图，不做拷贝
+    def expand(x):
+        return np.broadcast_to(x[:, None], (batch, num_beams) + x.shape[1:]).reshape((batch * num_beams,) + x.shape[1:])
+
+    for name in input_names:
+        if name == "ys":
+            inputs[name] = top_indices1.astype(np.int64).reshape(batch * num_beams, 1)
+        elif name in ("encoder_out", "encoder_mask"):
+            inputs[name] = expand(inputs[name])
+        elif name.startswith("cache_"):
+            inputs[name] = expand(caches1[int(name.split('_')[1])])
+    logits2 = dec_session.run(output_names, inputs)[0]
+
+    # 每个候选取前 beam_size 个第二步 token，累计得分 (batch, num_beams * beam_size)
+    top_indices2, top_log_probs2 = top_k(log_softmax(logits2.reshape(batch * num_beams, -1)), beam_size)
+    scores = (top_log_probs1[:, :, None] + top_log_probs2.reshape(batch, num_beams, -1)).reshape(batch, -1)
 
     # 选择最优结果
-    best_token1, best_token2, best_score, best_logprob2 = max(candidates, key=lambda x: x[2])
-    final_token = best_token1
-    confidence = np.exp(best_score / 2)
+    rows = np.arange(batch)
+    best = np.argmax(scores, axis=1)
+    final_tokens = top_indices1[rows, best // top_log_probs2.shape[1]]
+    confidences = np.exp(scores[rows, best] / 2)
+    return final_tokens, confidences
+
+
+def token_to_language(id2token, token_id):
+    """token id 转换为语言标签（去掉字典中 tab 之后的部分）"""
+    raw_token = id2token.get(token_id, f"<UNK>{token_id}")
+    return raw_token.split('\t')[0].strip() if '\t' in raw_token else raw_token.strip()
+
+
+def beam_search_decode(dec_session, enc_out, enc_mask, sos_id, eos_id, id2token, verbose=True):
+    """核心束搜索解码逻辑（完整保留两步束搜索），返回 (语言, token id, 置信度)"""
+    final_tokens, confidences = batch_beam_search(dec_session, enc_out, enc_mask, sos_id, BEAM_SIZE)
+    confidence = confidences[0]
 
     # 解析结果
-    token_id_py = int(final_token)
-    raw_token = id2token.get(token_id_py, f"<UNK>{token_id_py}")
-    clean_token = raw_token.split('\t')[0].strip() if '\t' in raw_token else raw_token.strip()
+    token_id_py = int(final_tokens[0])
+    clean_token = token_to_language(id2token, token_id_py)
 
     # 打印关键信息
+    if verbose:
+        log_result(clean_token, token_id_py, confidence)
+    return clean_token, token_id_py, confidence
+
+
+def log_result(clean_token, token_id, confidence, used_seconds=None, total_seconds=None, encoded_seconds=None):
     logger.info(f"\n========== 推理结果 ==========")
     logger.info(f"音频文件: {WAV_PATH}")
     logger.info(f"预测语言: {clean_token}")
-    logger.info(f"Token ID: {token_id_py}")
+    logger.info(f"Token ID: {token_id}")
     logger.info(f"置信度: {confidence:.4f}")
+    if used_seconds is not None:
+        logger.info(f"使用音频: {used_seconds:.2f}s / {total_seconds:.2f}s")
+    if encoded_seconds is not None:
+        logger.info(f"累计编码: {encoded_seconds:.2f}s（含未达到阈值的前缀）")
     logger.info("==================================")
 
 
+def early_exit_decode(enc_session, dec_session, feats_np, lengths_np, sos_id, eos_id, id2token,
+                      prefixes=EARLY_EXIT_PREFIXES, threshold=EARLY_EXIT_THRESHOLD):
+    """
+    渐进前缀提前退出：特征只提取一次，依次编码前 prefixes 秒的特征并解码，
+    置信度达到 threshold 即返回；所有前缀都未达到时用整段特征解码。
+    每个前缀都从头重新编码，编码器的实际计算量是所有尝试过的前缀之和（回退时再加上整段）。
+    返回 (语言, token id, 置信度, 最终采用的前缀秒数, 累计编码的秒数)
+    """
+    total_frames = int(lengths_np[0])
+    frames_per_second = 1000 // FRAME_SHIFT_MS
+    encoded_frames = 0
+    for seconds in sorted(prefixes):
+        num_frames = int(seconds * frames_per_second)
+        if num_frames >= total_frames:
+            break
+        enc_out, enc_mask = run_encoder(enc_session, feats_np[:, :num_frames],
+                                        np.array([num_frames], dtype=np.int64))
+        encoded_frames += num_frames
+        lang, token_id, confidence = beam_search_decode(dec_session, enc_out, enc_mask, sos_id, eos_id,
+                                                        id2token, verbose=False)
+        logger.info(f"前缀 {seconds}s: {lang} 置信度 {confidence:.4f}")
+        if confidence >= threshold:
+            return lang, token_id, confidence, num_frames / frames_per_second, encoded_frames / frames_per_second
+
+    # 前缀都不够确定（或音频本身较短），编码整段特征
+    enc_out, enc_mask = run_encoder(enc_session, feats_np, lengths_np)
+    lang, token_id, confidence = beam_search_decode(dec_session, enc_out, enc_mask, sos_id, eos_id,
+                                                    id2token, verbose=False)
+    encoded_frames += total_frames
+    return lang, token_id, confidence, total_frames / frames_per_second, encoded_frames / frames_per_second
+
+
+class FireRedLID:
+    """
+    可复用的语种识别对象：模型与特征提取器只加载一次，
+    identify_batch 按特征长度排序分批，每批编码器和解码器各只运行一次（解码器两步）
+    """
+
+    def __init__(self, batch_size=LID_BATCH_SIZE, beam_size=BEAM_SIZE):
+        (self.feat_extractor, self.tokenizer, self.sos_id, self.eos_id, self.pad_id,
+         self.token2id, self.id2token, self.enc_session, self.dec_session) = init_components()
+        self.expected_feat_dim = get_expected_feat_dim(self.enc_session)
+        self.batch_size = batch_size
+        self.beam_size = beam_size
+
+    def _load_feature(self, wav_path):
+        """读取音频并提取 CMVN 后的 fbank 特征，返回 (特征 tensor 或 None, 时长)"""
+        sample_rate, wav_np = kaldiio.load_mat(wav_path)
+        dur = wav_np.shape[0] / sample_rate
+        fbank = self.feat_extractor.fbank((sample_rate, wav_np))
+        if fbank.shape[0] < 1:
+            return None, dur
+        if self.feat_extractor.cmvn is not None:
+            fbank = self.feat_extractor.cmvn(fbank)
+        fbank = adapt_feat_dim(fbank, self.expected_feat_dim)
+        return torch.from_numpy(np.ascontiguousarray(fbank)).float(), dur
+
+    def identify_batch(self, wav_paths):
+        """
+        批量语种识别
+        Args:
+            wav_paths: 音频文件路径列表
+        Returns:
+            与输入顺序一致的结果列表，每项为 {"path", "language", "token_id", "confidence", "duration"}；
+            特征为空（音频过短）的文件 language 为 None
+        """
+        start_time = time.time()
+        feats, results = [], []
+        for wav_path in wav_paths:
+            feat, dur = self._load_feature(wav_path)
+            feats.append(feat)
+            results.append({"path": wav_path, "language": None, "token_id": None,
+                            "confidence": 0.0, "duration": dur})
+
+        # 按特征长度降序排序，长度相近的文件分到同一批，减少补齐
+        order = sorted((i for i, feat in enumerate(feats) if feat is not None),
+                       key=lambda i: feats[i].size(0), reverse=True)
+        for begin in range(0, len(order), self.batch_size):
+            batch_ids = order[begin:begin + self.batch_size]
+            batch_feats = [feats[i] for i in batch_ids]
+            feats_np = self.feat_extractor.pad_feat(batch_feats, 0.0).numpy().astype(np.float32)
+            lengths_np = np.array([feat.size(0) for feat in batch_feats], dtype=np.int64)
+
+            enc_out, enc_mask = run_encoder(self.enc_session, feats_np, lengths_np)
+            final_tokens, confidences = batch_beam_search(self.dec_session, enc_out, enc_mask,
+                                                          self.sos_id, self.beam_size)
+            for i, token_id, confidence in zip(batch_ids, final_tokens, confidences):
+                results[i]["token_id"] = int(token_id)
+                results[i]["language"] = token_to_language(self.id2token, int(token_id))
+                results[i]["confidence"] = float(confidence)
+
+        elapsed = time.time() - start_time
+        logger.info(f"批量识别 {len(wav_paths)} 个文件，耗时 {elapsed:.3f}s，"
+                    f"{len(wav_paths) / max(elapsed, 1e-9):.2f} files/s")
+        return results
+
+    def identify(self, wav_path):
+        """单个文件语种识别"""
+        return self.identify_batch([wav_path])[0]
+
+
 def main():
     try:
+        if WAV_LIST:
+            # 批量识别：组件只加载一次，按长度排序分批推理
+            lid = FireRedLID()
+            for result in lid.identify_batch(WAV_LIST):
+                logger.info(f"{result['path']}: {result['language']} 置信度 {result['confidence']:.4f}")
+            return
+
         # 初始化组件
         feat_extractor, tokenizer, sos_id, eos_id, pad_id, token2id, id2token, enc_session, dec_session = init_components()
 
+        if EARLY_EXIT:
+            # 渐进前缀编码+束搜索解码，置信度足够即停止
+            feats_np, lengths_np, dur = extract_features(feat_extractor, enc_session)
+            lang, token_id, confidence, used_seconds, encoded_seconds = early_exit_decode(
+                enc_session, dec_session, feats_np, lengths_np, sos_id, eos_id, id2token)
+            log_result(lang, token_id, confidence, used_seconds=min(used_seconds, dur), total_seconds=dur,
+                       encoded_seconds=encoded_seconds)
+            return
+
         # 音频处理+编码器推理
         enc_out, enc_mask = process_audio(feat_extractor, enc_session)
 
@@ -6,9 +6,11 @@ Description: FireRedPunc ONNX 标点恢复推理脚本。
 Date:       2025-02-14
 """
 import re
+import time
+import unicodedata
+from functools import lru_cache
 import numpy as np
 import onnxruntime as ort
-from transformers import BertTokenizer
 
 # ========== 配置路径（请根据实际情况修改）==========
 ONNX_PATH = "/path/to/model.onnx"
@@ -16,70 +18,479 @@ VOCAB_PATH = "/path/to/tokens.txt"
 OUT_DICT_PATH = "/path/to/out_dict"
 # ==============================================
 
+# ========== 批处理参数 ==========
+BATCH_SIZE = 32             # 每批最多文本条数
+MAX_BATCH_TOKENS = 8192     # 每批补齐后的 token 总数上限（batch * 最长长度）
+
+# ========== 长文本滑动窗口参数 ==========
+WINDOW_SIZE = 256           # 超过该长度的序列切分为重叠窗口（需小于模型最大位置长度）
+WINDOW_OVERLAP = 64         # 相邻窗口重叠的 token 数，每个 token 至少保留 WINDOW_OVERLAP / 2 的上下文
+
+# ========== 流式增量标点参数 ==========
+STREAM_CONTEXT = 64         # 送入模型的已提交 token 左侧上下文长度
+STREAM_LOOKAHEAD = 16       # token 右侧至少有这么多 token 后，其标点视为稳定并提交
+
+# ========== 分词缓存 ==========
+TOKENIZE_CACHE_SIZE = 65536  # 按词缓存分词结果的条数
+
+# ========== 预编译的文本处理正则 ==========
+PUNC_PATTERN = re.compile("[，。？！,.?!]")
+# 清洗时两侧都是这些字符的空白会被删除
+CLEAN_CJK_PATTERN = re.compile(
+    r'(?<=[\u3400-\u4dbf\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff\u31f0-\u31ff\U00020000-\U0002a6df'
+    r'\U0002a700-\U0002b73f\U0002b740-\U0002b81f\U0002b820-\U0002ceaf\U0002ceb0-\U0002ebef\U00030000-\U0003134f])'
+    r'\s+'
+    r'(?=[\u3400-\u4dbf\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff\u31f0-\u31ff\U00020000-\U0002a6df'
+    r'\U0002a700-\U0002b73f\U0002b740-\U0002b81f\U0002b820-\U0002ceaf\U0002ceb0-\U0002ebef\U00030000-\U0003134f])')
+# BERT 分词前会删除的控制字符（\t \n \r 视为空白保留）
+CONTROL_PATTERN = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f\ufffd]')
+# BERT 分词会在空白处及汉字前后切分，在这些位置截断文本不会改变两侧的分词结果
+CJK_CHARS = ('\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff\U00020000-\U0002a6df\U0002a700-\U0002b73f'
+             '\U0002b740-\U0002b81f\U0002b820-\U0002ceaf\U0002f800-\U0002fa1f')
+WORD_UNIT_PATTERN = re.compile(f'[{CJK_CHARS}]|[^\\s{CJK_CHARS}]+')
+WORD_END_PATTERN = re.compile(r'[\s，。？！,.?!]$')
+ALNUM_PATTERN = re.compile("[a-zA-Z0-9#]")
+
+
+def _is_punctuation(char):
+    """与 BERT 一致：ASCII 非字母数字符号及 Unicode P 类字符都视为标点"""
+    cp = ord(char)
+    if 33 <= cp <= 47 or 58 <= cp <= 64 or 91 <= cp <= 96 or 123 <= cp <= 126:
+        return True
+    return unicodedata.category(char).startswith("P")
+
+
+class WordPieceTokenizer:
+    """
+    与 BertTokenizer(do_lower_case=True) 分词结果一致的 WordPiece 分词器
+
+    词表构建为前缀树，最长匹配只需沿树走一遍；文本按空白和汉字切分为词后逐词分词，
+    每个词的结果按 LRU 缓存，重复出现的词不再重新切分
+    """
+
+    def __init__(self, vocab_file, unk_token="[UNK]", pad_token="[PAD]", max_chars_per_word=100,
+                 cache_size=TOKENIZE_CACHE_SIZE):
+        with open(vocab_file, 'r', encoding='utf-8') as f:
+            lines = [line.rstrip('\n') for line in f]
+        self.vocab = {token: idx for idx, token in enumerate(lines)}
+        self.ids_to_tokens = lines
+        self.unk_token_id = self.vocab[unk_token]
+        self.pad_token_id = self.vocab.get(pad_token, 0)
+        self.max_chars_per_word = max_chars_per_word
+        self.special_tokens = {token for token in ("[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]") if token in self.vocab}
+        self.special_pattern = re.compile('(' + '|'.join(re.escape(t) for t in sorted(self.special_tokens)) + ')')
+
+        # 词首与 "##" 续接两棵前缀树，节点中 '' 键存放以该节点结尾的 token id
+        self.word_trie, self.suffix_trie = {}, {}
+        for token, idx in self.vocab.items():
+            trie, piece = (self.suffix_trie, token[2:]) if token.startswith("##") else (self.word_trie, token)
+            if not piece:
+                continue
+            node = trie
+            for char in piece:
+                node = node.setdefault(char, {})
+            node[''] = idx
+
+        # 按 token id 预先计算重建文本所需的字符类别，重建时直接按 id 取值
+        self.token_texts = np.array([t[2:] if t.startswith("##") else t for t in lines], dtype=object)
+        self.subword_mask = np.array([t.startswith("##") for t in lines], dtype=bool)
+        self.alnum_mask = np.array([bool(ALNUM_PATTERN.search(t)) for t in lines], dtype=bool)
+
+        self.encode_word = lru_cache(maxsize=cache_size)(self._encode_word)
+
+    def _wordpiece(self, word):
+        """贪心最长匹配；任一位置匹配失败则整个词为 [UNK]"""
+        if len(word) > self.max_chars_per_word:
+            return [self.unk_token_id]
+        ids, start, trie = [], 0, self.word_trie
+        while start < len(word):
+            node, match = trie, None
+            for pos in range(start, len(word)):
+                node = node.get(word[pos])
+                if node is None:
+                    break
+                if '' in node:
+                    match = (pos + 1, node[''])
+            if match is None:
+                return [self.unk_token_id]
+            start, token_id = match
+            ids.append(token_id)
+            trie = self.suffix_trie
+        return ids
+
+    def _encode_word(self, word):
+        """对不含空白的单个词分词：特殊 token 保留，其余小写、去重音、按标点切开后做 WordPiece"""
+        ids = []
+        for part in (self.special_pattern.split(word) if self.special_tokens and '[' in word else [word]):
+            if part in self.special_tokens:
+                ids.append(self.vocab[part])
+                continue
+            part = unicodedata.normalize("NFD", unicodedata.normalize("NFC", part).lower())
+            piece = []
+            for char in part:
+                category = unicodedata.category(char)
+                if category == "Mn" or (category.startswith("C") and char not in "\t\n\r"):
+                    continue
+                if _is_punctuation(char):
+                    if piece:
+                        ids.extend(self._wordpiece("".join(piece)))
+                        piece = []
+                    ids.extend(self._wordpiece(char))
+                else:
+                    piece.append(char)
+            if piece:
+                ids.extend(self._wordpiece("".join(piece)))
+        return tuple(ids)
+
+    def encode(self, text):
+        """文本 -> token id 列表"""
+        ids = []
+        for word in WORD_UNIT_PATTERN.findall(CONTROL_PATTERN.sub('', text)):
+            ids.extend(self.encode_word(word))
+        return ids
+
+    def tokenize(self, text):
+        return [self.ids_to_tokens[idx] for idx in self.encode(text)]
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab.get(token, self.unk_token_id) for token in tokens]
+
+
 # 加载标点映射文件
 with open(OUT_DICT_PATH, 'r', encoding='utf-8') as f:
     out_lines = [line.strip() for line in f.readlines() if line.strip() != '']
 punc_map = {i: sym for i, sym in enumerate(out_lines)}
+# 按类别索引取标点文本，类别 0（空格）不输出
+punc_texts = np.array([""] + [(sym.split() or [""])[0] for sym in out_lines[1:]], dtype=object)
 
 # 加载 tokenizer
-tokenizer = BertTokenizer(vocab_file=VOCAB_PATH, do_lower_case=True)
+tokenizer = WordPieceTokenizer(VOCAB_PATH)
 
 # 加载 ONNX 模型（CPU 推理）
 session = ort.InferenceSession(ONNX_PATH, providers=['CPUExecutionProvider'])
 
 
 def remove_punc_and_fix_space(text):
-    """移除文本中已有的标点，仅保留中文字符"""
-    text = re.sub("[，。？！,\.?!]", " ", text)
-    pattern = re.compile(r'([\u3400-\u4dbf\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff\u31f0-\u31ff\U00020000-\U0002a6df\U0002a700-\U0002b73f\U0002b740-\U0002b81f\U0002b820-\U0002ceaf\U0002ceb0-\U0002ebef\U00030000-\U0003134f])')
-    parts = pattern.split(text.strip())
-    parts = [p for p in parts if p.strip()]
-    return "".join(parts)
+    """移除文本中已有的标点，并删除两个汉字之间的空白"""
+    text = PUNC_PATTERN.sub(" ", CONTROL_PATTERN.sub("", text)).strip()
+    return CLEAN_CJK_PATTERN.sub("", text)
 
 
-def add_punc_to_text(tokens, preds):
+def add_punc_to_text(ids, preds, prev_id=None, prev_pred=0):
     """
-    根据分词结果和预测的标点类别索引，重建带标点的文本
+    根据 token id 和预测的标点类别索引，重建带标点的文本
+    prev_id / prev_pred 为前文最后一个 token 及其标点类别（增量拼接时使用），据此决定开头是否补空格
     """
-    txt = ""
-    for i, (token, p) in enumerate(zip(tokens, preds)):
-        # 处理 BERT 子词（如 "##ing"）
-        if token.startswith("##"):
-            token = token[2:]
-        # 英文或数字前添加空格
-        elif re.search("[a-zA-Z0-9#]+", token) and i > 0 and re.search("[a-zA-Z0-9#]+", tokens[i-1]):
-            if preds[i-1] == 0:  # 前一个 token 后无标点
-                txt += " "
-        txt += token
-        # 添加标点（非空格类别）
-        if p != 0:
-            txt += punc_map.get(p, '').split()[0]
-    # 合并多余空格
-    txt = re.sub(r'\s+', ' ', txt)
-    return txt.strip()
-
-
-def inference(text):
-    """对输入文本执行标点恢复"""
-    cleaned = remove_punc_and_fix_space(text)
-    if not cleaned:
+    ids = np.asarray(ids, dtype=np.int64)
+    preds = np.asarray(preds, dtype=np.int64)
+    if len(ids) == 0:
         return ""
+    # 英文或数字 token 前一个 token 也是英文或数字且其后无标点时补空格，BERT 子词（如 "##ing"）直接拼接
+    alnum = tokenizer.alnum_mask[ids]
+    prev_alnum = np.concatenate([[prev_id is not None and tokenizer.alnum_mask[prev_id]], alnum[:-1]])
+    prev_preds = np.concatenate([[prev_pred], preds[:-1]])
+    space = alnum & prev_alnum & (prev_preds == 0) & ~tokenizer.subword_mask[ids]
+
+    pieces = np.empty((len(ids), 3), dtype=object)
+    pieces[:, 0] = np.where(space, " ", "")
+    pieces[:, 1] = tokenizer.token_texts[ids]
+    pieces[:, 2] = punc_texts[preds]
+    txt = "".join(pieces.ravel().tolist())
+    return txt.strip() if prev_id is None else txt.rstrip()
+
+
+def tokenize_text(text):
+    """清洗并分词，返回 input_ids"""
+    return tokenizer.encode(remove_punc_and_fix_space(text))
 
-    tokens = tokenizer.tokenize(cleaned)
-    input_ids = tokenizer.convert_tokens_to_ids(tokens)
-    input_ids_np = np.array([input_ids], dtype=np.int64)
-    lengths_np = np.array([len(input_ids)], dtype=np.int64)
+
+def run_batch(batch_ids):
+    """多条 token id 序列补齐成一批运行一次模型，返回每条序列的标点类别（已去掉补齐部分）"""
+    lengths = np.array([len(ids) for ids in batch_ids], dtype=np.int64)
+    input_ids_np = np.full((len(batch_ids), int(lengths.max())), tokenizer.pad_token_id, dtype=np.int64)
+    for row, ids in enumerate(batch_ids):
+        input_ids_np[row, :len(ids)] = ids
 
     # ONNX 推理
-    outputs = session.run(None, {'input_ids': input_ids_np, 'lengths': lengths_np})
-    logits = outputs[0]                     # shape: (1, seq_len, num_classes)
-    preds = np.argmax(logits, axis=-1)[0]    # shape: (seq_len,)
+    outputs = session.run(None, {'input_ids': input_ids_np, 'lengths': lengths})
+    logits = outputs[0]                     # shape: (batch, seq_len, num_classes)
+    preds = np.argmax(logits, axis=-1)      # shape: (batch, seq_len)
+    return [preds[row, :length] for row, length in enumerate(lengths)]
+
+
+def make_batches(lengths, batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS):
+    """按长度排序后切分批次，使同批序列长度相近、补齐浪费最少，返回每批的原始下标列表"""
+    batches, current = [], []
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # 已按长度升序，加入当前序列后的补齐长度即为它自身的长度
+        if current and (len(current) >= batch_size or (len(current) + 1) * lengths[idx] > max_batch_tokens):
+            batches.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def split_windows(length, window_size=WINDOW_SIZE, overlap=WINDOW_OVERLAP):
+    """返回覆盖 [0, length) 的窗口起点，相邻窗口重叠 overlap 个 token，最后一个窗口与末尾对齐"""
+    if length <= window_size:
+        return [0]
+    stride = window_size - overlap
+    return list(range(0, length - window_size, stride)) + [length - window_size]
+
+
+def stitch_windows(length, starts, window_preds):
+    """
+    拼接各窗口的预测：每个 token 取它距窗口内侧边界最远（上下文最充分）的窗口的结果。
+    位于全文开头/结尾的窗口边界不算内侧边界，那一侧本来就没有更多上下文
+    """
+    preds = np.zeros(length, dtype=np.int64)
+    best_margin = np.full(length, -1, dtype=np.int64)
+    for start, window_pred in zip(starts, window_preds):
+        end = start + len(window_pred)
+        pos = np.arange(start, end)
+        left = pos - start if start > 0 else np.full(len(pos), length)
+        right = end - 1 - pos if end < length else np.full(len(pos), length)
+        margin = np.minimum(left, right)
+        better = margin > best_margin[start:end]
+        preds[start:end][better] = window_pred[better]
+        best_margin[start:end][better] = margin[better]
+    return preds
+
+
+def predict_sequences(sequences, batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS,
+                      window_size=WINDOW_SIZE, overlap=WINDOW_OVERLAP):
+    """
+    预测多条 token id 序列的标点类别：超过 window_size 的序列切分为重叠窗口，
+    所有窗口与短序列一起按长度排序成批推理，再把窗口结果拼回整条序列。计算量与文本长度成线性关系
+    """
+    assert 0 <= overlap < window_size, "WINDOW_OVERLAP 必须小于 WINDOW_SIZE"
+    pieces = []  # (序列下标, 窗口起点, 窗口内 token id)
+    for seq_idx, ids in enumerate(sequences):
+        for start in split_windows(len(ids), window_size, overlap):
+            pieces.append((seq_idx, start, ids[start:start + window_size]))
+
+    piece_preds = [None] * len(pieces)
+    for batch in make_batches([len(ids) for _, _, ids in pieces], batch_size, max_batch_tokens):
+        for i, preds in zip(batch, run_batch([pieces[i][2] for i in batch])):
+            piece_preds[i] = preds
 
-    return add_punc_to_text(tokens, preds)
+    starts = [[] for _ in sequences]
+    window_preds = [[] for _ in sequences]
+    for (seq_idx, start, _), preds in zip(pieces, piece_preds):
+        starts[seq_idx].append(start)
+        window_preds[seq_idx].append(preds)
+    return [stitch_windows(len(ids), starts[i], window_preds[i]) for i, ids in enumerate(sequences)]
+
+
+def inference(text, window_size=WINDOW_SIZE, overlap=WINDOW_OVERLAP):
+    """对输入文本执行标点恢复，长文本自动按重叠窗口成批推理后拼接"""
+    input_ids = tokenize_text(text)
+    if not input_ids:
+        return ""
+    preds = predict_sequences([input_ids], window_size=window_size, overlap=overlap)[0]
+    return add_punc_to_text(input_ids, preds)
+
+
+def inference_batch(texts, batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS):
+    """
+    批量标点恢复：全部文本先分词，按长度排序补齐成批，每批只调用一次模型，
+    返回结果与输入顺序一致
+    """
+    tokenized = [tokenize_text(text) for text in texts]
+    results = [""] * len(texts)
+    valid = [idx for idx, ids in enumerate(tokenized) if ids]
+
+    all_preds = predict_sequences([tokenized[idx] for idx in valid], batch_size, max_batch_tokens)
+    for idx, preds in zip(valid, all_preds):
+        results[idx] = add_punc_to_text(tokenized[idx], preds)
+    return results
+
+
+class StreamingPunctuator:
+    """
+    流式 ASR 的增量标点
+
+    已提交部分的分词与标点不再重算，只保留末尾 context 个 token 作为左侧上下文；
+    每次追加文本后只对 左侧上下文 + 未提交文本 运行模型，单次更新的开销与全文长度无关。
+    未提交文本中右侧已有 lookahead 个 token 的词，标点视为稳定并提交；末尾可能仍在增长的词不提交。
+    """
+
+    def __init__(self, context=STREAM_CONTEXT, lookahead=STREAM_LOOKAHEAD, window_size=WINDOW_SIZE):
+        assert context + lookahead < window_size, "STREAM_CONTEXT + STREAM_LOOKAHEAD 必须小于 WINDOW_SIZE"
+        self.context = context
+        self.lookahead = lookahead
+        self.window_size = window_size
+        self.reset()
+
+    def reset(self):
+        self.committed_text = ""    # 已提交部分的带标点文本
+        self.context_ids = []       # 已提交部分末尾的 token id
+        self.last_id = None         # 已提交部分最后一个 token 及其标点类别，拼接时判断是否补空格
+        self.last_pred = 0
+        self.pending = ""           # 未提交的文本
+        self.pending_text = ""      # 未提交部分当前的带标点文本
+
+    @property
+    def text(self):
+        return (self.committed_text + self.pending_text).strip()
+
+    def _commit(self, ids, preds):
+        if len(ids) == 0:
+            return
+        self.committed_text += add_punc_to_text(ids, preds, self.last_id, self.last_pred)
+        self.context_ids = (self.context_ids + list(ids))[-self.context:] if self.context else []
+        self.last_id, self.last_pred = ids[-1], int(preds[-1])
+
+    def append(self, text, final=False):
+        """追加新识别出的文本，final=True 表示文本结束、提交全部剩余内容；返回当前完整的带标点文本"""
+        self.pending += text
+        word_ended = final or bool(WORD_END_PATTERN.search(self.pending))
+        cleaned = remove_punc_and_fix_space(self.pending)
+        units, unit_ids = [], []
+        for unit in WORD_UNIT_PATTERN.finditer(cleaned):
+            ids = tokenizer.encode_word(unit.group())
+            # BOM、零宽字符、单独的组合符号等编码为空，不参与窗口划分（输出中也会被丢弃）
+            if ids:
+                units.append(unit)
+                unit_ids.append(ids)
+
+        first = 0
+        self.pending_text = ""
+        budget = self.window_size - len(self.context_ids)
+        while first < len(units):
+            # 从 first 开始尽量多取词放入窗口
+            last, num_tokens = first, 0
+            while last < len(units) and (last == first or num_tokens + len(unit_ids[last]) <= budget):
+                num_tokens += len(unit_ids[last])
+                last += 1
+            window_ids = [i for ids in unit_ids[first:last] for i in ids]
+            preds = run_batch([self.context_ids + window_ids])[0][len(self.context_ids):]
+
+            # 右侧上下文足够的词提交；窗口未到达末尾时至少提交一个词以保证前进
+            reaches_end = last == len(units)
+            # 末尾可能仍在增长的词分词结果未定，不计入右侧上下文
+            growing = reaches_end and not word_ended
+            stable_tokens = num_tokens - (len(unit_ids[last - 1]) if growing else 0)
+            commit, offset = first, 0
+            while commit < last:
+                end = offset + len(unit_ids[commit])
+                if not (reaches_end and final):
+                    if growing and commit == last - 1:
+                        break
+                    if stable_tokens - end < self.lookahead and (reaches_end or commit > first):
+                        break
+                offset, commit = end, commit + 1
+
+            if commit > first:
+                self._commit(window_ids[:offset], preds[:offset])
+            if reaches_end:
+                if commit < last:
+                    self.pending_text = add_punc_to_text(window_ids[offset:], preds[offset:],
+                                                         self.last_id, self.last_pred)
+                first = commit
+                break
+            first = commit
+            budget = self.window_size - len(self.context_ids)
+
+        # 未提交部分保留清洗后的文本，原文以空白或标点结尾时保留一个空格作为词边界
+        if first < len(units):
+            self.pending = cleaned[units[first].start():] + (" " if word_ended else "")
+        else:
+            self.pending = ""
+        return self.text
+
+    def finalize(self):
+        """文本结束：提交剩余内容并返回完整的带标点文本"""
+        return self.append("", final=True)
+
+
+def benchmark_text_processing(text, repeat=20):
+    """
+    文本预处理（清洗 + 分词）与后处理（标点重建）的吞吐基准，单位 tokens/s，不运行模型。
+    cold 为每轮前清空按词 LRU 缓存的吞吐（每个词都重新做 WordPiece 匹配），
+    warm 为缓存已覆盖全部词之后的吞吐（重复文本的上限）。
+    安装了 transformers 时同时测量原实现（每次编译正则 + BertTokenizer + 逐 token 拼接字符串）作为对照
+    """
+    input_ids = tokenize_text(text)
+    preds = np.random.default_rng(0).integers(0, len(punc_map), len(input_ids))
+    results = {}
+
+    elapsed = 0.0
+    for _ in range(repeat):
+        tokenizer.encode_word.cache_clear()
+        start = time.perf_counter()
+        add_punc_to_text(tokenize_text(text), preds)
+        elapsed += time.perf_counter() - start
+    results["cold"] = len(input_ids) * repeat / elapsed
+
+    tokenize_text(text)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        add_punc_to_text(tokenize_text(text), preds)
+    results["warm"] = len(input_ids) * repeat / (time.perf_counter() - start)
+
+    try:
+        from transformers import BertTokenizer
+    except ImportError:
+        return results
+
+    bert_tokenizer = BertTokenizer(vocab_file=VOCAB_PATH, do_lower_case=True)
+
+    def legacy_clean(raw):
+        raw = re.sub("[，。？！,\.?!]", " ", raw)
+        pattern = re.compile(r'([\u3400-\u4dbf\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff\u31f0-\u31ff\U00020000-\U0002a6df\U0002a700-\U0002b73f\U0002b740-\U0002b81f\U0002b820-\U0002ceaf\U0002ceb0-\U0002ebef\U00030000-\U0003134f])')
+        return "".join(p for p in pattern.split(raw.strip()) if p.strip())
+
+    def legacy_add_punc(tokens, token_preds):
+        txt = ""
+        for i, (token, p) in enumerate(zip(tokens, token_preds)):
+            if token.startswith("##"):
+                token = token[2:]
+            elif i > 0 and re.search("[a-zA-Z0-9#]+", token) and re.search("[a-zA-Z0-9#]+", tokens[i-1]):
+                if token_preds[i-1] == 0:
+                    txt += " "
+            txt += token
+            if p != 0:
+                txt += punc_map.get(p, '').split()[0]
+        return re.sub(r'\s+', ' ', txt).strip()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        tokens = bert_tokenizer.tokenize(legacy_clean(text))
+        bert_tokenizer.convert_tokens_to_ids(tokens)
+        legacy_text = legacy_add_punc(tokens, preds)
+    results["legacy"] = len(input_ids) * repeat / (time.perf_counter() - start)
+    results["consistent"] = legacy_text == add_punc_to_text(input_ids, preds)
+    return results
 
 
 if __name__ == "__main__":
     test_text = "今天天气真不错我们出去散步吧The weather is really nice today. Let's go out for a walk"
     print(f"输入: {test_text}")
     result = inference(test_text)
-    print(f"输出: {result}")
\ No newline at end of file
+    print(f"输出: {result}")
+
+    # 批量推理：按长度排序补齐成批，每批调用一次模型
+    test_texts = ["你好今天过得怎么样", test_text, "", "我们明天早上八点在公司门口集合然后一起出发"]
+    for text, result in zip(test_texts, inference_batch(test_texts)):
+        print(f"{text} -> {result}")
+
+    # 长文本：超过 WINDOW_SIZE 个 token 时切分为重叠窗口成批推理后拼接
+    long_text = test_text * 50
+    print(f"长文本输出: {inference(long_text)[:200]}...")
+
+    # 流式增量标点：模拟 ASR 逐段输出
+    punctuator = StreamingPunctuator()
+    for i in range(0, len(test_text), 4):
+        print(f"流式: {punctuator.append(test_text[i:i + 4])}")
+    print(f"流式最终: {punctuator.finalize()}")
+
+    # 文本预处理 / 后处理吞吐基准
+    bench = benchmark_text_processing(long_text)
+    print(f"文本处理吞吐: 冷缓存 {bench['cold']:.0f} tokens/s，热缓存 {bench['warm']:.0f} tokens/s", end="")
+    if "legacy" in bench:
+        print(f"，原实现 {bench['legacy']:.0f} tokens/s，冷缓存加速 {bench['cold'] / bench['legacy']:.1f} 倍，"
+              f"结果一致: {bench['consistent']}", end="")
+    print()